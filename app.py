@@ -1,26 +1,42 @@
 # 标准库导入
-from flask import Flask, render_template, request, jsonify, send_file, abort
+from flask import Flask, render_template, request, jsonify, send_file, abort, Response, stream_with_context
 from urllib.parse import unquote, quote
 import os
 import json
 import time
 import re
 import subprocess
+import shutil
+import tempfile
 import wave
-import torch
-from functools import lru_cache
+import sqlite3
+import threading
+import atexit
+import uuid
 import hashlib
+import hmac
+import struct
+import html
+from contextlib import contextmanager
 
 # 第三方库导入
 import numpy as np
 import soundfile as sf
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import HTTPException
 import magic
-from moviepy.editor import VideoFileClip
-from funasr import AutoModel
-from modelscope.pipelines import pipeline
-from modelscope.utils.constant import Tasks
-import hashlib
+from resampler import PolyphaseResampler, load_resampled
+# torch、funasr 导入很慢，在用到时才导入，进程启动后可以立即响应请求
+from model_server import (ModelClient, build_asr_model, build_vad_model, configure_cpu, parse_address,
+                          warm_up_model, build_streaming_model, detect_memory_limit, parse_cpu_list, ShardPool,
+                          DEFAULT_ONNX_MODEL)
+from concurrent.futures.process import BrokenProcessPool
+
+# 可选依赖：实时转写的 WebSocket 接口
+try:
+    from flask_sock import Sock, ConnectionClosed
+except ImportError:
+    Sock = None
 
 # 初始化语音识别器
 inference_pipeline = None
@@ -40,61 +56,565 @@ app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['AUDIO_FOLDER'] = 'audio_output'  # 改为 audio_output
 app.config['TRANSCRIPTS_FOLDER'] = 'txt_output'  # 改为 txt_output
-app.config['RECENT_FILES'] = 'recent_files.json'
+app.config['RECENT_FILES'] = 'recent_files.json'  # 旧版最近文件列表，启动时导入媒体目录
+app.config['OBJECTS_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], '.objects')  # 按内容哈希存放的上传文件
+app.config['INCOMING_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], '.incoming')  # 上传中的临时文件
+app.config['UPLOAD_CHUNK_SIZE'] = 8 * 1024 * 1024  # 分块上传时每块大小，需小于 MAX_CONTENT_LENGTH
+app.config['UPLOAD_MAX_TOTAL_BYTES'] = int(os.environ.get('UPLOAD_MAX_TOTAL_MB', 10240)) * 1024 * 1024  # 分块上传的单文件上限
+app.config['TRANSCRIPT_CACHE_FOLDER'] = os.path.join(app.config['TRANSCRIPTS_FOLDER'], 'cache')
+app.config['TRANSCRIPT_CACHE_MAX_BYTES'] = int(os.environ.get('TRANSCRIPT_CACHE_MAX_MB', 200)) * 1024 * 1024
+app.config['PCM_FOLDER'] = os.path.join(app.config['AUDIO_FOLDER'], 'pcm')  # 解码后的 16kHz 单声道 PCM，按内容哈希存放
+app.config['PREVIEW_PROXY'] = os.environ.get('PREVIEW_PROXY', '0') == '1'  # 为大视频在后台转码低码率预览版本
+app.config['PREVIEW_PROXY_MIN_BYTES'] = int(os.environ.get('PREVIEW_PROXY_MIN_MB', 100)) * 1024 * 1024  # 超过该大小的视频才转码
+app.config['PREVIEW_PROXY_FOLDER'] = os.path.join(app.config['AUDIO_FOLDER'], 'proxy')  # 按内容哈希存放的预览版本
+app.config['PREVIEW_PROXY_HEIGHT'] = 480  # 预览版本的最大高度
+app.config['PREVIEW_PROXY_BITRATE'] = '800k'  # 预览版本的视频码率
+app.config['PCM_STORE_MAX_BYTES'] = int(os.environ.get('PCM_STORE_MAX_MB', 20480)) * 1024 * 1024
+# 各目录的（容量上限 MB，最长保留天数），0 表示不限制；超过容量时按最近使用时间淘汰
+app.config['STORAGE_QUOTAS'] = {
+    'uploads': (int(os.environ.get('UPLOADS_MAX_MB', 51200)), float(os.environ.get('UPLOADS_MAX_AGE_DAYS', 0))),
+    'audio': (int(os.environ.get('AUDIO_OUTPUT_MAX_MB', 10240)), float(os.environ.get('AUDIO_OUTPUT_MAX_AGE_DAYS', 30))),
+    'transcripts': (int(os.environ.get('TRANSCRIPTS_MAX_MB', 1024)), float(os.environ.get('TRANSCRIPTS_MAX_AGE_DAYS', 0))),
+    'proxy': (int(os.environ.get('PREVIEW_PROXY_MAX_MB', 10240)), float(os.environ.get('PREVIEW_PROXY_MAX_AGE_DAYS', 30))),
+}
+app.config['STORAGE_GC_INTERVAL'] = float(os.environ.get('STORAGE_GC_INTERVAL', 600))  # 后台清理存储的间隔（秒），0 表示不启动
+app.config['TEMP_FILE_MAX_AGE'] = float(os.environ.get('TEMP_FILE_MAX_AGE', 3600))  # 超过该时长（秒）未修改的临时文件视为中断遗留，新写入的文件在此期间不会被淘汰
+app.config['UPLOAD_SESSION_TTL'] = float(os.environ.get('UPLOAD_SESSION_TTL_HOURS', 24)) * 3600  # 分块上传会话没有进展后保留的时长（秒）
+app.config['CHECKPOINT_MAX_AGE'] = 7 * 86400  # 没有对应任务的片段断点保留时长（秒）
+app.config['ADMIN_TOKEN'] = os.environ.get('ADMIN_TOKEN')  # 管理接口的访问令牌（X-Admin-Token 请求头），为空时只允许本机访问
+app.config['ASR_MODEL'] = os.environ.get('ASR_MODEL', 'paraformer-zh')
+app.config['ASR_MODEL_REVISION'] = os.environ.get('ASR_MODEL_REVISION', 'v2.0.4')
+app.config['ASR_BEAM_SIZE'] = 1
+app.config['INFERENCE_BACKEND'] = os.environ.get('INFERENCE_BACKEND', 'torch')  # torch：PyTorch AutoModel；onnx：ONNX Runtime（CPU）
+app.config['ASR_ONNX_MODEL'] = os.environ.get('ASR_ONNX_MODEL', DEFAULT_ONNX_MODEL)  # onnx 后端的模型 ID 或本地目录
+app.config['ASR_ONNX_QUANTIZE'] = os.environ.get('ASR_ONNX_QUANTIZE', '1') != '0'  # onnx 后端使用 int8 动态量化模型
+app.config['ONNX_INTRA_OP_THREADS'] = os.environ.get('ONNX_INTRA_OP_THREADS') or os.environ.get('TORCH_NUM_THREADS')
+app.config['INFERENCE_MODE'] = os.environ.get('INFERENCE_MODE', 'local')  # local：本进程加载模型；server：调用模型服务进程
+app.config['MODEL_SERVER_ADDRESS'] = parse_address(os.environ.get('MODEL_SERVER_ADDRESS', '127.0.0.1:6007'))
+app.config['MODEL_SERVER_AUTHKEY'] = (os.environ['MODEL_SERVER_AUTHKEY'].encode('utf-8')
+                                      if os.environ.get('MODEL_SERVER_AUTHKEY') else None)  # 与模型服务一致，未设置时不认证
+app.config['TORCH_NUM_THREADS'] = os.environ.get('TORCH_NUM_THREADS')  # local 模式下的 torch 线程数
+app.config['TORCH_INTEROP_THREADS'] = os.environ.get('TORCH_INTEROP_THREADS')
+app.config['CPU_AFFINITY'] = os.environ.get('CPU_AFFINITY')  # local 模式下绑定的 CPU 核，例如 "0-3"
+app.config['MODEL_PRELOAD'] = os.environ.get('MODEL_PRELOAD', '1') != '0'  # 启动时在后台加载模型，设为 0 时第一次转录时才加载
+app.config['MODEL_WARMUP'] = os.environ.get('MODEL_WARMUP', '1') != '0'  # 加载后用一段静音做一次推理预热
+app.config['MODEL_LOAD_RETRY_SECONDS'] = 5.0  # 模型加载失败（如模型服务未启动）后重试的初始间隔
+app.config['DATABASE'] = os.environ.get('LOCALWEB_DB', 'localweb.db')  # 任务表等持久化数据
+app.config['METRICS_FLUSH_INTERVAL'] = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))  # 计数器和直方图在进程内累加后写入数据库的间隔（秒），0 表示每次直接写入
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 1))  # 每个进程的转录工作线程数，0 表示只提供 Web 服务
+app.config['JOB_MAX_QUEUED'] = int(os.environ.get('JOB_MAX_QUEUED', 20))  # 排队任务上限
+app.config['JOB_POLL_INTERVAL'] = 1.0  # 空闲时轮询任务表的间隔（秒）
+app.config['JOB_STALE_SECONDS'] = 600  # 运行中任务超过该时间无心跳则重新排队（进程崩溃后恢复）
+app.config['JOB_HEARTBEAT_INTERVAL'] = app.config['JOB_STALE_SECONDS'] / 4  # 运行中任务刷新心跳的间隔（秒），与进度无关
+app.config['JOB_MAX_ATTEMPTS'] = 3  # 因进程崩溃被重新领取的最多次数
+# 任务内存预算：所有进程中运行的任务预估峰值内存之和不超过预算，超出时排队等待，单个任务超过预算时拒绝
+_memory_budget_mb = int(os.environ.get('MEMORY_BUDGET_MB', 0))  # 0 为容器内存上限的一半，负数为不限制
+app.config['MEMORY_BUDGET_BYTES'] = (_memory_budget_mb * 1024 * 1024 if _memory_budget_mb > 0 else
+                                     0 if _memory_budget_mb < 0 else int((detect_memory_limit() or 0) * 0.5))
+app.config['JOB_MEMORY_BASE_BYTES'] = int(os.environ.get('JOB_MEMORY_BASE_MB', 256)) * 1024 * 1024  # 与音频时长无关的开销（推理批次、模型中间结果）
+app.config['JOB_MEMORY_PCM_FACTOR'] = float(os.environ.get('JOB_MEMORY_PCM_FACTOR', 3))  # 16kHz float32 PCM 大小的倍数（映射的 PCM、VAD 输入、片段拷贝）
+app.config['JOB_MEMORY_SIZE_FACTOR'] = float(os.environ.get('JOB_MEMORY_SIZE_FACTOR', 8))  # 时长未知时按文件大小的该倍数估计 PCM 大小（约为 64kbps 压缩音频）
+app.config['SSE_POLL_INTERVAL'] = 0.5  # 事件流检查任务状态的间隔（秒）
+app.config['SSE_KEEPALIVE_SECONDS'] = 15  # 事件流无数据时发送心跳的间隔，防止代理断开连接
+app.config['STREAMING_MODEL'] = os.environ.get('STREAMING_MODEL', 'paraformer-zh-streaming')  # 实时转写使用的流式模型
+app.config['STREAMING_MODEL_REVISION'] = os.environ.get('STREAMING_MODEL_REVISION', 'v2.0.4')
+app.config['STREAM_CHUNK_SIZE'] = [0, 10, 5]  # 流式解码块大小（60ms 为单位）：当前块 600ms，向后看 300ms
+app.config['STREAM_ENCODER_LOOK_BACK'] = 4  # 编码器向前参考的块数
+app.config['STREAM_DECODER_LOOK_BACK'] = 1  # 解码器向前参考的块数
+app.config['STREAM_MAX_CONCURRENT'] = int(os.environ.get('STREAM_MAX_CONCURRENT', 4))  # 每个进程同时进行的实时转写连接数
+app.config['STREAM_MAX_BACKLOG_SECONDS'] = float(os.environ.get('STREAM_MAX_BACKLOG_SECONDS', 5))  # 未处理音频超过该时长时断开连接
+app.config['STREAM_IDLE_TIMEOUT'] = 30  # 超过该时长（秒）没有收到数据时断开连接
+app.config['TRANSCRIBE_BATCH_SIZE'] = int(os.environ.get('TRANSCRIBE_BATCH_SIZE', 4))  # 每批送入模型的片段数
+app.config['TRANSCRIBE_BATCH_SECONDS'] = float(os.environ.get('TRANSCRIBE_BATCH_SECONDS', 240))  # 每批音频总时长上限（秒）
+app.config['SHARD_WORKERS'] = int(os.environ.get('SHARD_WORKERS', 0))  # 长音频分片并行推理的进程数（各自加载模型），0 表示不启用
+app.config['SHARD_CPUS'] = os.environ.get('SHARD_CPUS')  # 分给这些进程的 CPU 核，例如 "0-15"，默认为本进程可用的全部核
+app.config['SHARD_MIN_SECONDS'] = float(os.environ.get('SHARD_MIN_SECONDS', 1800))  # 音频时长达到该值才并行推理
+app.config['SHARD_MIN_PRIORITY'] = int(os.environ.get('SHARD_MIN_PRIORITY', 0))  # 任务优先级达到该值才并行推理
+app.config['RESAMPLE_BLOCK_FRAMES'] = 65536  # 音频转换时每次读取的帧数
+app.config['SEGMENT_MODE'] = os.environ.get('SEGMENT_MODE', 'energy')  # 分片方式：energy（能量VAD）/ fsmn（FunASR VAD模型）/ fixed（固定时长）
+app.config['SEGMENT_MAX_SECONDS'] = float(os.environ.get('SEGMENT_MAX_SECONDS', 60))  # 单个片段最长时长（秒）
+app.config['VAD_FRAME_MS'] = 30  # 能量VAD帧长（毫秒）
+app.config['VAD_THRESHOLD_DB'] = 12  # 语音帧需高出噪声底的分贝数
+app.config['VAD_MIN_DB'] = -60  # 绝对能量下限（dBFS），低于此值一律视为静音
+app.config['VAD_MIN_SILENCE'] = 0.5  # 短于该时长（秒）的停顿不切分
+app.config['VAD_MIN_SPEECH'] = 0.2  # 短于该时长（秒）的声音视为噪声丢弃
+app.config['VAD_PAD'] = 0.2  # 语音区间前后保留的边距（秒）
+app.config['VAD_MAX_GAP'] = 1.0  # 间隔不超过该时长（秒）的相邻语音合并为一个片段
 
 # 确保所需目录存在
 for folder in [app.config['UPLOAD_FOLDER'], app.config['AUDIO_FOLDER'], 
-               app.config['TRANSCRIPTS_FOLDER']]:
+               app.config['TRANSCRIPTS_FOLDER'], app.config['TRANSCRIPT_CACHE_FOLDER'],
+               app.config['OBJECTS_FOLDER'], app.config['INCOMING_FOLDER'], app.config['PCM_FOLDER'],
+               app.config['PREVIEW_PROXY_FOLDER']]:
     os.makedirs(folder, exist_ok=True)
 
+# 数据库表结构，所有进程共享同一个 SQLite 文件
+DB_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        filename TEXT NOT NULL,
+        source_path TEXT NOT NULL,
+        status TEXT NOT NULL,
+        priority INTEGER NOT NULL DEFAULT 0,
+        progress INTEGER NOT NULL DEFAULT 0,
+        message TEXT NOT NULL DEFAULT '',
+        error TEXT,
+        result TEXT,
+        worker TEXT,
+        cancel_requested INTEGER NOT NULL DEFAULT 0,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        updated_at REAL NOT NULL,
+        finished_at REAL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs(status, priority DESC, created_at)",
+    # 每个提交（或合并到已有任务上）的请求持有一个令牌，取消时只释放自己的那一份等待
+    """CREATE TABLE IF NOT EXISTS job_waiters (
+        token TEXT PRIMARY KEY,
+        job_id TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        released_at REAL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_job_waiters_job ON job_waiters(job_id)",
+    """CREATE TABLE IF NOT EXISTS file_index (
+        path TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        inode INTEGER NOT NULL,
+        sha256 TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_file_index_sha256 ON file_index(sha256)",
+    """CREATE TABLE IF NOT EXISTS transcript_cache (
+        cache_key TEXT PRIMARY KEY,
+        content_hash TEXT NOT NULL,
+        params TEXT NOT NULL,
+        path TEXT NOT NULL,
+        size_bytes INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        last_access REAL NOT NULL,
+        hits INTEGER NOT NULL DEFAULT 0
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_transcript_cache_access ON transcript_cache(last_access)",
+    "CREATE INDEX IF NOT EXISTS idx_transcript_cache_content ON transcript_cache(content_hash)",
+    """CREATE TABLE IF NOT EXISTS counters (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS segment_checkpoints (
+        fingerprint TEXT NOT NULL,
+        start_ms INTEGER NOT NULL,
+        end_ms INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        PRIMARY KEY (fingerprint, start_ms, end_ms)
+    )""",
+    """CREATE TABLE IF NOT EXISTS metric_buckets (
+        name TEXT NOT NULL,
+        labels TEXT NOT NULL,
+        le TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (name, labels, le)
+    )""",
+    """CREATE TABLE IF NOT EXISTS metric_sums (
+        name TEXT NOT NULL,
+        labels TEXT NOT NULL,
+        sum REAL NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (name, labels)
+    )""",
+    """CREATE TABLE IF NOT EXISTS upload_sessions (
+        id TEXT PRIMARY KEY,
+        filename TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        received INTEGER NOT NULL DEFAULT 0,
+        mime TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS pcm_store (
+        content_hash TEXT NOT NULL,
+        sample_rate INTEGER NOT NULL,
+        path TEXT NOT NULL,
+        samples INTEGER NOT NULL,
+        size_bytes INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        last_access REAL NOT NULL,
+        PRIMARY KEY (content_hash, sample_rate)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_pcm_store_access ON pcm_store(last_access)",
+    "CREATE INDEX IF NOT EXISTS idx_pcm_store_path ON pcm_store(path)",
+    """CREATE TABLE IF NOT EXISTS media_files (
+        path TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        mime TEXT,
+        content_hash TEXT,
+        size INTEGER,
+        duration REAL,
+        sample_rate INTEGER,
+        channels INTEGER,
+        transcript_status TEXT NOT NULL DEFAULT 'none',
+        job_id TEXT,
+        listed INTEGER NOT NULL DEFAULT 1,
+        created_at REAL NOT NULL,
+        uploaded_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_media_files_recent ON media_files(listed, uploaded_at DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_media_files_name ON media_files(name)",
+    "CREATE INDEX IF NOT EXISTS idx_media_files_hash ON media_files(content_hash)",
+    """CREATE TABLE IF NOT EXISTS transcripts (
+        id INTEGER PRIMARY KEY,
+        cache_key TEXT NOT NULL UNIQUE,
+        content_hash TEXT NOT NULL,
+        source_path TEXT,
+        transcript_path TEXT,
+        created_at REAL NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_transcripts_content ON transcripts(content_hash)",
+    """CREATE TABLE IF NOT EXISTS transcript_segments (
+        id INTEGER PRIMARY KEY,
+        transcript_id INTEGER NOT NULL,
+        seq INTEGER NOT NULL,
+        start_ms INTEGER,
+        end_ms INTEGER,
+        text TEXT NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_transcript_segments_transcript ON transcript_segments(transcript_id, seq)",
+    # 跨进程的互斥租约（如后台存储清理），持有者崩溃后到期自动释放
+    """CREATE TABLE IF NOT EXISTS leases (
+        name TEXT PRIMARY KEY,
+        owner TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS storage_usage (
+        area TEXT PRIMARY KEY,
+        files INTEGER NOT NULL,
+        bytes INTEGER NOT NULL,
+        updated_at REAL NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS storage_gc_runs (
+        id INTEGER PRIMARY KEY,
+        started_at REAL NOT NULL,
+        finished_at REAL NOT NULL,
+        report TEXT NOT NULL
+    )""",
+]
+
+# 转录文本全文索引：rowid 为 transcript_segments.id，tokens 为中日韩文字切成的二元组和其他单词
+# 部分 SQLite 编译时没有 FTS5，建表失败时搜索接口不可用，其余功能不受影响
+TRANSCRIPT_FTS_SCHEMA = "CREATE VIRTUAL TABLE IF NOT EXISTS transcript_fts USING fts5(tokens, tokenize = 'unicode61')"
+
+# 已有数据库中需要补充的列：(表名, 列名, 列定义)
+DB_COLUMNS = [
+    ('jobs', 'attempts', 'INTEGER NOT NULL DEFAULT 0'),
+    ('file_index', 'mime', 'TEXT'),
+    ('jobs', 'fingerprint', 'TEXT'),
+    ('jobs', 'timings', 'TEXT'),
+    ('jobs', 'dedup_key', 'TEXT'),
+    ('jobs', 'waiters', 'INTEGER NOT NULL DEFAULT 1'),
+    ('jobs', 'memory_estimate', 'INTEGER'),
+    ('media_files', 'last_access', 'REAL'),
+]
+
+# 依赖补充列的索引，在补充列之后创建
+DB_INDEXES = [
+    # 同一内容 + 转录参数同时只有一个排队中或运行中的任务
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_dedup ON jobs(dedup_key) "
+    "WHERE dedup_key IS NOT NULL AND status IN ('queued', 'running')",
+]
+
+_db_local = threading.local()
+
+def get_db():
+    """获取当前线程的数据库连接（WAL 模式，支持多进程并发读写）"""
+    conn = getattr(_db_local, 'conn', None)
+    # fork 出来的子进程不能复用父进程的连接
+    if conn is None or getattr(_db_local, 'pid', None) != os.getpid():
+        conn = sqlite3.connect(app.config['DATABASE'], timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        _db_local.conn = conn
+        _db_local.pid = os.getpid()
+    return conn
+
+def init_db():
+    """创建数据库表"""
+    db = get_db()
+    for statement in DB_SCHEMA:
+        db.execute(statement)
+    for table, column, definition in DB_COLUMNS:
+        columns = [row['name'] for row in db.execute(f'PRAGMA table_info({table})')]
+        if column not in columns:
+            try:
+                db.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+            except sqlite3.OperationalError:
+                # 其他进程可能刚刚添加了该列
+                pass
+    for statement in DB_INDEXES:
+        db.execute(statement)
+    try:
+        db.execute(TRANSCRIPT_FTS_SCHEMA)
+    except sqlite3.OperationalError as e:
+        print(f"SQLite 不支持 FTS5，转录全文搜索不可用: {str(e)}")
+
+init_db()
+
+# 模型加载状态：loading（加载中）、ready（已加载并预热）、error（加载失败，后台稍后重试）
+model_status = {'state': 'loading', 'error': None, 'started_at': time.time(), 'ready_at': None}
+model_lock = threading.Lock()
+model_attempted = threading.Event()  # 第一次加载尝试结束（无论成败）
+
 def init_model():
-    """初始化语音识别模型"""
+    """初始化语音识别模型；server 模式下只创建模型服务的客户端"""
     global inference_pipeline
     try:
-        print("正在加载语音识别模型...")
-        
-        # 使用 FunASR 模型，添加性能优化参数
-        inference_pipeline = AutoModel(
-            model="paraformer-zh",
-            model_revision="v2.0.4",
-            device="cuda" if torch.cuda.is_available() else "cpu",
-            batch_size=4,          # 增加批处理大小
-            num_workers=4,         # 增加工作进程数
-            beam_size=1,           # 减小束搜索大小以提高速度
-            hotwords_path=None,    # 关闭热词功能以提高速度
-            continuous_decoding=True  # 启用连续解码
-        )
-        
-        if not torch.cuda.is_available():
-            print("警告：未检测到GPU，将使用CPU进行推理")
-            
-        print("语音识别模型加载完成")
+        if app.config['INFERENCE_MODE'] == 'server':
+            client = ModelClient(app.config['MODEL_SERVER_ADDRESS'], app.config['MODEL_SERVER_AUTHKEY'])
+            info = client.ping()
+            print(f"已连接模型服务: {app.config['MODEL_SERVER_ADDRESS']} (pid={info['pid']})")
+            inference_pipeline = client
+        else:
+            print("正在加载语音识别模型...")
+            configure_cpu(app.config['TORCH_NUM_THREADS'], app.config['TORCH_INTEROP_THREADS'],
+                          app.config['CPU_AFFINITY'])
+            # 使用 FunASR 模型，添加性能优化参数
+            model = build_asr_model(**asr_model_options())
+            if app.config['MODEL_WARMUP']:
+                # 第一次推理要初始化计算图和内存池，放在就绪之前完成
+                with stage_timer('model_warmup'):
+                    warm_up_model(model)
+            inference_pipeline = model
+            print("语音识别模型加载完成")
+        model_status.update(state='ready', error=None, ready_at=time.time())
         return True
     except Exception as e:
         print(f"语音识别模型加载失败: {str(e)}")
+        model_status.update(state='error', error=str(e))
+        return False
+
+def asr_model_options():
+    """本进程和分片推理进程创建语音识别模型的参数"""
+    return {
+        'model': app.config['ASR_MODEL'],
+        'model_revision': app.config['ASR_MODEL_REVISION'],
+        'batch_size': app.config['TRANSCRIBE_BATCH_SIZE'],
+        'beam_size': app.config['ASR_BEAM_SIZE'],
+        'backend': app.config['INFERENCE_BACKEND'],
+        'onnx_model': app.config['ASR_ONNX_MODEL'],
+        'quantize': app.config['ASR_ONNX_QUANTIZE'],
+        'intra_op_threads': app.config['ONNX_INTRA_OP_THREADS']
+    }
+
+shard_pool = None
+shard_pool_lock = threading.Lock()
+
+def get_shard_pool():
+    """分片推理进程池，第一次使用时创建（各进程加载模型需要一些时间）"""
+    global shard_pool
+    with shard_pool_lock:
+        if shard_pool is None:
+            cpus = parse_cpu_list(app.config['SHARD_CPUS']) if app.config['SHARD_CPUS'] else None
+            shard_pool = ShardPool(app.config['SHARD_WORKERS'], asr_model_options(), cpus,
+                                   warmup=app.config['MODEL_WARMUP'])
+            print(f"分片推理进程池: {shard_pool.workers} 个进程，CPU 分组 {shard_pool.cpu_groups}")
+        return shard_pool
+
+def reset_shard_pool():
+    """子进程异常退出后进程池不可再用，丢弃后下次重新创建"""
+    global shard_pool
+    with shard_pool_lock:
+        if shard_pool is not None:
+            shard_pool.shutdown()
+            shard_pool = None
+
+def should_shard(task_id, samples, sr):
+    """本地推理、启用了分片进程池，且音频足够长、任务优先级足够高时并行推理"""
+    if not app.config['SHARD_WORKERS'] or app.config['INFERENCE_MODE'] == 'server':
+        return False
+    if samples < app.config['SHARD_MIN_SECONDS'] * sr:
         return False
+    job = JobQueue.get(task_id) if task_id else None
+    return (job['priority'] if job else 0) >= app.config['SHARD_MIN_PRIORITY']
+
+def load_model_in_background():
+    """后台加载模型，失败后按指数退避重试，直到加载成功"""
+    delay = app.config['MODEL_LOAD_RETRY_SECONDS']
+    while True:
+        with model_lock:
+            loaded = inference_pipeline is not None or init_model()
+        model_attempted.set()
+        if loaded:
+            return
+        time.sleep(delay)
+        delay = min(delay * 2, 60)
 
-# 应用启动时初始化模型
-init_model()
+def start_model_loading():
+    """启动后台模型加载线程，Web 请求不必等待模型加载完成"""
+    if not app.config['MODEL_PRELOAD']:
+        model_status['state'] = 'lazy'
+        model_attempted.set()
+        return
+    threading.Thread(target=load_model_in_background, name='model-loader', daemon=True).start()
 
 def ensure_model_loaded():
-    """确保模型已加载"""
-    global inference_pipeline
+    """确保模型已加载；后台正在加载时等待其完成"""
     if inference_pipeline is None:
-        if not init_model():
-            raise Exception("语音识别模型未能正确加载，请检查系统环境和模型配置")
+        with model_lock:
+            if inference_pipeline is None and not init_model():
+                raise Exception("语音识别模型未能正确加载，请检查系统环境和模型配置")
     return inference_pipeline
 
-def get_recent_files():
-    try:
-        with open(app.config['RECENT_FILES'], 'r') as f:
-            return json.load(f)
-    except:
-        return []
+class MediaCatalog:
+    """媒体文件目录：上传和提取出的音视频文件的内容哈希、类型、时长、采样率、声道数和转录状态
 
-def save_recent_files(files):
-    with open(app.config['RECENT_FILES'], 'w') as f:
-        json.dump(files, f)
+    保存在共享数据库中，多个 worker 进程同时上传也不会丢失记录；最近文件列表和按文件名查找路径都是索引查询。
+    listed 为 0 的文件不出现在最近文件列表中（提取出的音频、清空列表后的文件），但仍保留其信息。
+    转录状态：none（未转录）、queued、running、complete、error、cancelled。
+    """
+
+    @classmethod
+    def probe(cls, path, mime):
+        """读取音视频的时长、采样率和声道数；无法识别的格式返回空值，转录后再补上时长"""
+        if not (mime or '').startswith(('audio/', 'video/')):
+            return None, None, None
+        return probe_media_info(path)
+
+    @classmethod
+    def register(cls, name, path, mime, content_hash=None, listed=True):
+        """登记文件；同一路径重新上传时更新内容信息，内容变化后转录状态重置"""
+        path = os.path.abspath(path)
+        content_hash = content_hash or get_file_hash(path)
+        duration, sample_rate, channels = cls.probe(path, mime)
+        now = time.time()
+        get_db().execute(
+            "INSERT INTO media_files (path, name, mime, content_hash, size, duration, sample_rate, channels, "
+            "listed, created_at, uploaded_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(path) DO UPDATE SET name = excluded.name, mime = excluded.mime, "
+            "size = excluded.size, duration = COALESCE(excluded.duration, media_files.duration), "
+            "sample_rate = COALESCE(excluded.sample_rate, media_files.sample_rate), "
+            "channels = COALESCE(excluded.channels, media_files.channels), "
+            "transcript_status = CASE WHEN media_files.content_hash = excluded.content_hash "
+            "THEN media_files.transcript_status ELSE 'none' END, "
+            "content_hash = excluded.content_hash, listed = MAX(media_files.listed, excluded.listed), "
+            "uploaded_at = CASE WHEN excluded.listed THEN excluded.uploaded_at ELSE media_files.uploaded_at END, "
+            "updated_at = excluded.updated_at",
+            (path, name, mime, content_hash, os.path.getsize(path), duration, sample_rate, channels,
+             1 if listed else 0, now, now, now))
+        return cls.get(path)
+
+    @classmethod
+    def get(cls, path):
+        row = get_db().execute('SELECT * FROM media_files WHERE path = ?', (os.path.abspath(path),)).fetchone()
+        return cls.to_json(row) if row is not None else None
+
+    @classmethod
+    def to_json(cls, row):
+        return {
+            'name': row['name'],
+            'path': row['path'],
+            'type': row['mime'],
+            'content_hash': row['content_hash'],
+            'size': row['size'],
+            'duration': row['duration'],
+            'sample_rate': row['sample_rate'],
+            'channels': row['channels'],
+            'transcript_status': row['transcript_status'],
+            'job_id': row['job_id'],
+            'uploaded_at': row['uploaded_at'],
+            'last_access': row['last_access']
+        }
+
+    @classmethod
+    def list(cls, limit=10, offset=0, status=None, listed_only=True):
+        """按上传时间倒序分页查询，返回 (文件列表, 总数)"""
+        where, params = [], []
+        if listed_only:
+            where.append('listed = 1')
+        if status:
+            where.append('transcript_status = ?')
+            params.append(status)
+        clause = f"WHERE {' AND '.join(where)}" if where else ''
+        db = get_db()
+        total = db.execute(f'SELECT COUNT(*) FROM media_files {clause}', params).fetchone()[0]
+        rows = db.execute(f'SELECT * FROM media_files {clause} ORDER BY uploaded_at DESC LIMIT ? OFFSET ?',
+                          params + [limit, offset]).fetchall()
+        return [cls.to_json(row) for row in rows], total
+
+    @classmethod
+    def resolve(cls, name, folders):
+        """按文件名查找路径，folders 为优先顺序；目录中没有记录时返回 None"""
+        candidates = [os.path.abspath(os.path.join(folder, name)) for folder in folders]
+        rows = get_db().execute(
+            f"SELECT path FROM media_files WHERE path IN ({','.join('?' * len(candidates))})",
+            candidates).fetchall()
+        found = {row['path'] for row in rows}
+        for path in candidates:
+            if path in found:
+                return path
+        return None
+
+    @classmethod
+    def set_transcript_status(cls, path, status, job_id=None, duration=None):
+        get_db().execute(
+            "UPDATE media_files SET transcript_status = ?, job_id = COALESCE(?, job_id), "
+            "duration = COALESCE(duration, ?), updated_at = ? WHERE path = ?",
+            (status, job_id, duration, time.time(), os.path.abspath(path)))
+
+    @classmethod
+    def set_job_status(cls, job_id, status, duration=None):
+        """更新关联到该任务的所有文件，相同内容的请求合并到一个任务时，各自的文件都随任务更新"""
+        get_db().execute(
+            "UPDATE media_files SET transcript_status = ?, duration = COALESCE(duration, ?), updated_at = ? "
+            "WHERE job_id = ?",
+            (status, duration, time.time(), job_id))
+
+    @classmethod
+    def touch(cls, path):
+        """记录最近使用时间（预览、下载、转录），存储清理按它淘汰最久未用的文件；一分钟内重复访问不再写库"""
+        now = time.time()
+        get_db().execute('UPDATE media_files SET last_access = ? WHERE path = ? AND '
+                         '(last_access IS NULL OR last_access < ?)', (now, os.path.abspath(path), now - 60))
+
+    @classmethod
+    def access_times(cls):
+        """各文件最近一次上传或使用的时间（相同内容重新上传时硬链接的修改时间仍是第一次上传的时间）"""
+        return {row['path']: row['used_at'] for row in get_db().execute(
+            'SELECT path, MAX(COALESCE(last_access, 0), uploaded_at) AS used_at FROM media_files')}
+
+    @classmethod
+    def forget(cls, path):
+        get_db().execute('DELETE FROM media_files WHERE path = ?', (os.path.abspath(path),))
+
+    @classmethod
+    def clear_listed(cls):
+        """清空最近文件列表，文件信息仍然保留"""
+        get_db().execute('UPDATE media_files SET listed = 0 WHERE listed = 1')
+
+    @classmethod
+    def migrate_recent_files(cls):
+        """导入旧版 recent_files.json；先改名再读取，多个 worker 同时启动时只有一个进程导入"""
+        legacy = app.config['RECENT_FILES']
+        migrated = f"{legacy}.migrated"
+        try:
+            os.rename(legacy, migrated)
+        except OSError:
+            return
+        try:
+            with open(migrated, 'r') as f:
+                files = json.load(f)
+        except Exception as e:
+            print(f"读取旧版最近文件列表失败: {str(e)}")
+            return
+        # 列表最前面是最近上传的文件，倒序登记使其上传时间最晚
+        for info in reversed(files):
+            try:
+                if os.path.isfile(info['path']):
+                    cls.register(info['name'], info['path'], info.get('type'))
+            except Exception as e:
+                print(f"导入最近文件失败: {info}: {str(e)}")
+        print(f"已导入旧版最近文件列表: {len(files)} 个文件")
 
 def extract_audio(video_path, output_path):
     """从视频中提取音频并压缩为MP3格式"""
@@ -102,8 +622,12 @@ def extract_audio(video_path, output_path):
         print(f"开始提取音频: {video_path} -> {output_path}")
         
         # 使用ffmpeg提取音频并压缩为MP3
+        ffmpeg = find_ffmpeg()
+        if ffmpeg is None:
+            print("未找到 ffmpeg")
+            return False
         command = [
-            'ffmpeg',
+            ffmpeg,
             '-i', video_path,  # 输入文件
             '-vn',             # 禁用视频流
             '-ac', '1',        # 单声道
@@ -128,99 +652,627 @@ def extract_audio(video_path, output_path):
         print(f"音频提取失败: {str(e)}")
         return False
 
-def convert_to_wav(input_path, output_path, sample_rate=16000):
-    """将音频转换为 WAV 格式，采样率为16kHz"""
+_ffmpeg_path = None
+
+def find_ffmpeg():
+    """查找 ffmpeg：优先使用系统安装的，没有时使用 imageio-ffmpeg 自带的可执行文件"""
+    global _ffmpeg_path
+    if _ffmpeg_path is None:
+        path = shutil.which('ffmpeg')
+        if not path:
+            try:
+                import imageio_ffmpeg
+                path = imageio_ffmpeg.get_ffmpeg_exe()
+            except Exception:
+                path = ''
+        _ffmpeg_path = path
+    return _ffmpeg_path or None
+
+FFMPEG_DURATION_RE = re.compile(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)')
+FFMPEG_AUDIO_RE = re.compile(r'Audio: [^\n]*?, (\d+) Hz, ([^,\n]+)')
+
+def probe_media_info(file_path):
+    """读取时长（秒）、采样率和声道数，只读文件头不解码；soundfile 不支持的格式（视频等）用 ffmpeg 读取，失败时返回空值"""
     try:
-        print(f"开始转换音频: {input_path} -> {output_path}")
-        
-        # 检查文件类型
-        mime = magic.Magic(mime=True)
-        file_type = mime.from_file(input_path)
-        print(f"输入文件类型: {file_type}")
-        
-        if file_type.startswith('video/'):
-            # 如果是视频文件，先提取音频
-            print("检测到视频文件，先提取音频...")
-            temp_audio = os.path.join(os.path.dirname(output_path), 'temp_audio.wav')
-            video = VideoFileClip(input_path)
-            video.audio.write_audiofile(temp_audio)
-            input_path = temp_audio
-            print(f"音频提取完成: {temp_audio}")
-        
-        # 读取音频文件
-        data, sr = sf.read(input_path)
-        print(f"原始采样率: {sr}Hz")
-        
-        # 如果是立体声，转换为单声道
-        if len(data.shape) > 1:
-            print("转换立体声为单声道")
-            data = np.mean(data, axis=1)
-        
-        # 重采样到16kHz
-        if sr != sample_rate:
-            print(f"重采样到 {sample_rate}Hz")
-            # 计算重采样比例
-            ratio = sample_rate / sr
-            new_length = int(len(data) * ratio)
-            # 使用线性插值进行重采样
-            indices = np.linspace(0, len(data)-1, new_length)
-            data = np.interp(indices, np.arange(len(data)), data)
-        
-        # 保存为WAV格式
-        print("保存为WAV格式")
-        sf.write(output_path, data, sample_rate)
-        print("音频转换完成")
-        
-        # 清理临时文件
-        if file_type.startswith('video/') and os.path.exists(temp_audio):
-            os.remove(temp_audio)
-            print("临时音频文件已清理")
-        
+        info = sf.info(file_path)
+        return info.duration, info.samplerate, info.channels
+    except Exception:
+        pass
+    ffmpeg = find_ffmpeg()
+    if ffmpeg is None:
+        return None, None, None
+    try:
+        # 不指定输出时 ffmpeg 只打印输入信息后退出
+        result = subprocess.run([ffmpeg, '-nostdin', '-hide_banner', '-i', file_path],
+                                capture_output=True, text=True, errors='replace', timeout=30)
+    except (OSError, subprocess.TimeoutExpired):
+        return None, None, None
+    duration = sample_rate = channels = None
+    match = FFMPEG_DURATION_RE.search(result.stderr)
+    if match:
+        hours, minutes, seconds = match.groups()
+        duration = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    match = FFMPEG_AUDIO_RE.search(result.stderr)
+    if match:
+        sample_rate = int(match.group(1))
+        layout = match.group(2).strip()
+        surround = re.match(r'(\d+)\.(\d+)', layout)
+        count = re.match(r'(\d+) channels', layout)
+        channels = ({'mono': 1, 'stereo': 2}.get(layout) or
+                    (int(surround.group(1)) + int(surround.group(2)) if surround else None) or
+                    (int(count.group(1)) if count else None))
+    return duration, sample_rate, channels
+
+def get_file_mime(file_path):
+    """文件类型：优先使用上传时记录的结果，文件变化或没有记录时重新检测"""
+    st = os.stat(file_path)
+    row = get_db().execute('SELECT size, mtime_ns, mime FROM file_index WHERE path = ?',
+                           (os.path.abspath(file_path),)).fetchone()
+    if row and row['mime'] and row['size'] == st.st_size and row['mtime_ns'] == st.st_mtime_ns:
+        return row['mime']
+    mime = magic.from_file(file_path, mime=True)
+    if row and row['size'] == st.st_size and row['mtime_ns'] == st.st_mtime_ns:
+        # 上传前就存在的文件：记下检测结果，之后不再检测
+        get_db().execute('UPDATE file_index SET mime = ? WHERE path = ?', (mime, os.path.abspath(file_path)))
+    return mime
+
+def decode_audio(input_path, sample_rate=16000, mp3_path=None, timings=None, output=None):
+    """解码音频或视频中的音轨，返回单声道 float32 PCM（采样率 sample_rate）
+
+    使用一个 ffmpeg 进程只解码一次：PCM 通过管道直接读入内存，不写中间 WAV 文件；
+    指定 mp3_path 时同一次解码同时导出可下载的 MP3。没有 ffmpeg 时用 soundfile 读取并多相重采样。
+    output 为二进制文件对象时 PCM 边解码边写入其中，返回采样点数。
+    """
+    ffmpeg = find_ffmpeg()
+    if ffmpeg is None:
+        if mp3_path:
+            raise Exception("导出 MP3 需要 ffmpeg")
+        decode_timings = {}
+        data, sr = load_resampled(input_path, sample_rate, blocksize=app.config['RESAMPLE_BLOCK_FRAMES'],
+                                  timings=decode_timings, output=output)
+        for stage, elapsed in decode_timings.items():
+            record_stage(stage, elapsed, timings)
+        print(f"原始采样率: {sr}Hz，已转换为 {sample_rate}Hz 单声道")
+        # 写入 output 时 data 为采样点数
+        return data
+
+    print(f"开始解码音频: {input_path}" + (f"，同时导出 {mp3_path}" if mp3_path else ""))
+    command = [ffmpeg, '-nostdin', '-v', 'error', '-i', input_path]
+    mp3_temp = None
+    if mp3_path:
+        # 先写临时文件，解码成功后再改名，失败时不留下不完整的 MP3
+        mp3_temp = mp3_path + '.part'
+        command += ['-map', '0:a:0', '-ac', '1', '-codec:a', 'libmp3lame', '-q:a', '2', '-ar', '44100',
+                    '-f', 'mp3', '-y', mp3_temp]
+    command += ['-map', '0:a:0', '-ac', '1', '-ar', str(sample_rate), '-f', 'f32le', 'pipe:1']
+
+    pcm = bytearray()
+    written = 0
+    try:
+        with stage_timer('decode', timings), tempfile.TemporaryFile() as errors:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=errors)
+            try:
+                while True:
+                    chunk = process.stdout.read(READ_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    if output is not None:
+                        output.write(chunk)
+                        written += len(chunk)
+                    else:
+                        pcm += chunk
+            finally:
+                process.stdout.close()
+                returncode = process.wait()
+            if returncode != 0:
+                errors.seek(0)
+                message = errors.read()[-2000:].decode('utf-8', 'replace').strip()
+                raise Exception(f"音频解码失败: {message}")
+        if mp3_temp:
+            os.replace(mp3_temp, mp3_path)
+    finally:
+        if mp3_temp and os.path.exists(mp3_temp):
+            os.remove(mp3_temp)
+    if output is not None:
+        return written // 4
+    # bytearray 上的视图可写，不再复制一份
+    return np.frombuffer(pcm, dtype=np.float32)
+
+class PcmStore:
+    """解码后的 16kHz 单声道 float32 PCM，按源文件内容哈希存放，每个源文件只解码一次
+
+    文件格式：32 字节文件头（标识、版本、声道数、采样率、采样格式、采样点数）后接原始采样数据，
+    读取时用 np.memmap 映射，分片和推理直接使用其切片，不复制、不再解码。
+    超过容量上限时按最近访问时间淘汰。
+    """
+
+    HEADER = struct.Struct('<4sHHI4sQ8x')
+    MAGIC = b'LWPC'
+    VERSION = 1
+
+    @classmethod
+    def entry_path(cls, content_hash, sample_rate):
+        return os.path.join(app.config['PCM_FOLDER'], f"{content_hash}_{sample_rate}.pcm")
+
+    @classmethod
+    def map_file(cls, path):
+        """映射 PCM 文件，返回一维 float32 数组（写时复制，修改不会写回文件）"""
+        with open(path, 'rb') as f:
+            header = f.read(cls.HEADER.size)
+        magic_bytes, version, channels, sample_rate, dtype, samples = cls.HEADER.unpack(header)
+        if magic_bytes != cls.MAGIC or version != cls.VERSION or dtype != b'f32\x00' or channels != 1:
+            raise ValueError(f'无效的 PCM 文件: {path}')
+        if samples == 0:
+            return np.zeros(0, dtype=np.float32)
+        return np.memmap(path, dtype=np.float32, mode='c', offset=cls.HEADER.size, shape=(samples,))
+
+    @classmethod
+    def get(cls, file_path, sample_rate=16000):
+        """已存在时返回映射的 PCM，否则返回 None"""
+        content_hash = get_file_hash(file_path)
+        db = get_db()
+        row = db.execute('SELECT path FROM pcm_store WHERE content_hash = ? AND sample_rate = ?',
+                         (content_hash, sample_rate)).fetchone()
+        if row is not None:
+            try:
+                data = cls.map_file(row['path'])
+            except (OSError, ValueError) as e:
+                print(f"PCM 文件不可用，重新解码: {str(e)}")
+                db.execute('DELETE FROM pcm_store WHERE path = ?', (row['path'],))
+            else:
+                db.execute('UPDATE pcm_store SET last_access = ? WHERE path = ?', (time.time(), row['path']))
+                incr_counter('localweb_pcm_store_hits_total')
+                return data
+        incr_counter('localweb_pcm_store_misses_total')
+        return None
+
+    @classmethod
+    def samples(cls, file_path, sample_rate=16000):
+        """已解码时返回采样点数，不映射文件、不计入命中率"""
+        row = get_db().execute('SELECT samples FROM pcm_store WHERE content_hash = ? AND sample_rate = ?',
+                               (get_file_hash(file_path), sample_rate)).fetchone()
+        return row['samples'] if row is not None else None
+
+    @classmethod
+    def load(cls, file_path, sample_rate=16000, mp3_path=None, timings=None):
+        """返回文件的 PCM，第一次使用时解码并保存（mp3_path 不为空时同时导出 MP3）"""
+        data = cls.get(file_path, sample_rate)
+        if data is not None:
+            print(f"使用已解码的 PCM: {file_path}")
+            return data
+        return cls.decode(file_path, sample_rate, mp3_path, timings)
+
+    @classmethod
+    def decode(cls, file_path, sample_rate=16000, mp3_path=None, timings=None):
+        """解码文件并保存 PCM，返回映射的数组"""
+        content_hash = get_file_hash(file_path)
+        path = cls.entry_path(content_hash, sample_rate)
+        # 先写临时文件，写完文件头再原子替换，并发解码同一文件时互不影响
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(b'\x00' * cls.HEADER.size)
+                samples = decode_audio(file_path, sample_rate, mp3_path=mp3_path, timings=timings, output=f)
+                f.seek(0)
+                f.write(cls.HEADER.pack(cls.MAGIC, cls.VERSION, 1, sample_rate, b'f32\x00', samples))
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        now = time.time()
+        get_db().execute(
+            "INSERT INTO pcm_store (content_hash, sample_rate, path, samples, size_bytes, created_at, last_access) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(content_hash, sample_rate) DO UPDATE SET path = excluded.path, samples = excluded.samples, "
+            "size_bytes = excluded.size_bytes, last_access = excluded.last_access",
+            (content_hash, sample_rate, path, samples, os.path.getsize(path), now, now))
+        cls.evict(keep=path)
+        return cls.map_file(path)
+
+    @classmethod
+    def alias(cls, file_path, source_path, sample_rate=16000):
+        """让 file_path（如从视频提取的 MP3）直接使用 source_path 的 PCM，不再单独解码"""
+        db = get_db()
+        row = db.execute('SELECT path, samples, size_bytes FROM pcm_store WHERE content_hash = ? AND sample_rate = ?',
+                         (get_file_hash(source_path), sample_rate)).fetchone()
+        if row is None:
+            return False
+        now = time.time()
+        db.execute(
+            "INSERT OR REPLACE INTO pcm_store (content_hash, sample_rate, path, samples, size_bytes, created_at, last_access) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (get_file_hash(file_path), sample_rate, row['path'], row['samples'], row['size_bytes'], now, now))
         return True
-    except Exception as e:
-        print(f"音频转换失败: {str(e)}")
-        # 确保清理临时文件
-        if 'temp_audio' in locals() and os.path.exists(temp_audio):
-            os.remove(temp_audio)
-            print("清理临时音频文件")
-        raise
+
+    @classmethod
+    def evict(cls, keep=None):
+        """总大小超过上限时删除最久未访问的 PCM 文件（同一文件的别名一起删除）"""
+        db = get_db()
+        max_bytes = app.config['PCM_STORE_MAX_BYTES']
+        files = db.execute('SELECT path, MAX(size_bytes) AS size_bytes, MAX(last_access) AS last_access '
+                           'FROM pcm_store GROUP BY path ORDER BY last_access').fetchall()
+        total = sum(row['size_bytes'] for row in files)
+        for row in files:
+            if total <= max_bytes:
+                break
+            if row['path'] == keep:
+                continue
+            try:
+                os.remove(row['path'])
+            except FileNotFoundError:
+                pass
+            db.execute('DELETE FROM pcm_store WHERE path = ?', (row['path'],))
+            total -= row['size_bytes']
+            incr_counter('localweb_pcm_store_evictions_total')
+
+    @classmethod
+    def purge(cls, content_hash=None):
+        """删除指定内容（为空时全部）的 PCM 文件，返回 (文件数, 字节数)；正在使用的映射在关闭前仍然有效"""
+        db = get_db()
+        if content_hash is None:
+            rows = db.execute('SELECT path, MAX(size_bytes) AS size_bytes FROM pcm_store GROUP BY path').fetchall()
+        else:
+            rows = db.execute('SELECT path, MAX(size_bytes) AS size_bytes FROM pcm_store WHERE path IN '
+                              '(SELECT path FROM pcm_store WHERE content_hash = ?) GROUP BY path',
+                              (content_hash,)).fetchall()
+        for row in rows:
+            try:
+                os.remove(row['path'])
+            except FileNotFoundError:
+                pass
+            db.execute('DELETE FROM pcm_store WHERE path = ?', (row['path'],))
+        return len(rows), sum(row['size_bytes'] for row in rows)
+
+    @classmethod
+    def stats(cls):
+        row = get_db().execute(
+            'SELECT COUNT(*) AS files, COALESCE(SUM(size_bytes), 0) AS size_bytes, COALESCE(SUM(samples), 0) AS samples '
+            'FROM (SELECT path, MAX(size_bytes) AS size_bytes, MAX(samples) AS samples FROM pcm_store GROUP BY path)'
+        ).fetchone()
+        counters = get_counters('localweb_pcm_store_')
+        return {
+            'files': row['files'],
+            'size_bytes': row['size_bytes'],
+            'max_bytes': app.config['PCM_STORE_MAX_BYTES'],
+            'hits': counters.get('localweb_pcm_store_hits_total', 0),
+            'misses': counters.get('localweb_pcm_store_misses_total', 0),
+            'evictions': counters.get('localweb_pcm_store_evictions_total', 0)
+        }
+
+class JobCancelled(Exception):
+    """任务被用户取消"""
+
+class QueueFullError(Exception):
+    """排队任务数超过上限"""
+
+class WaiterTokenError(Exception):
+    """取消任务时没有提供有效的等待者令牌"""
+
+class MemoryBudgetError(Exception):
+    """任务预估内存超过整个内存预算"""
+
+def estimate_job_memory(file_path, sample_rate=16000):
+    """估计转录任务的峰值内存（字节）
+
+    解码由 ffmpeg 子进程流式完成，下混为单声道后才进入本进程，源文件的声道数和采样率不影响峰值；
+    峰值主要由 16kHz float32 PCM 的大小决定。已解码时使用准确的采样点数，否则用媒体目录或文件头中的时长；
+    都读不出时长时按文件大小估计，不把未知长度的文件当作很短的文件放行。
+    """
+    samples = PcmStore.samples(file_path, sample_rate)
+    if samples is None:
+        info = MediaCatalog.get(file_path)
+        duration = info['duration'] if info else None
+        if duration is None:
+            duration = probe_media_info(file_path)[0]
+        if duration:
+            samples = int(duration * sample_rate)
+        else:
+            samples = int(os.path.getsize(file_path) * app.config['JOB_MEMORY_SIZE_FACTOR'] / 4)
+    return int(app.config['JOB_MEMORY_BASE_BYTES'] + samples * 4 * app.config['JOB_MEMORY_PCM_FACTOR'])
 
 class ProcessStatus:
-    _instances = {}
-    
+    """任务进度，保存在任务表中，所有工作进程都可以查询"""
+
     @classmethod
     def get_instance(cls, task_id):
-        if task_id not in cls._instances:
-            cls._instances[task_id] = {
+        row = get_db().execute(
+            'SELECT status, progress, message, error FROM jobs WHERE id = ?', (task_id,)).fetchone()
+        if row is None:
+            return {
                 'status': 'pending',
                 'progress': 0,
                 'message': '',
                 'error': None
             }
-        return cls._instances[task_id]
+        return dict(row)
     
     @classmethod
     def update_progress(cls, task_id, progress, message=''):
-        instance = cls.get_instance(task_id)
-        instance['progress'] = progress
-        instance['message'] = message
+        get_db().execute(
+            'UPDATE jobs SET progress = ?, message = ?, updated_at = ? WHERE id = ?',
+            (progress, message, time.time(), task_id))
+
+    @classmethod
+    def heartbeat(cls, task_id, worker_id):
+        """刷新运行中任务的心跳；任务已结束或已被其他工作线程重新领取时返回 False"""
+        return get_db().execute(
+            "UPDATE jobs SET updated_at = ? WHERE id = ? AND status = 'running' AND worker = ?",
+            (time.time(), task_id, worker_id)).rowcount > 0
+
+    @classmethod
+    def raise_if_cancelled(cls, task_id):
+        row = get_db().execute(
+            'SELECT cancel_requested FROM jobs WHERE id = ?', (task_id,)).fetchone()
+        if row is not None and row['cancel_requested']:
+            raise JobCancelled('任务已取消')
+        
+    @classmethod
+    def set_timings(cls, task_id, timings):
+        get_db().execute('UPDATE jobs SET timings = ? WHERE id = ?', (json.dumps(timings), task_id))
+
+    @classmethod
+    def set_fingerprint(cls, task_id, fingerprint):
+        """记录任务对应的断点指纹，事件流据此推送已完成片段的文本"""
+        get_db().execute('UPDATE jobs SET fingerprint = ? WHERE id = ?', (fingerprint, task_id))
         
     @classmethod
     def set_error(cls, task_id, error):
-        instance = cls.get_instance(task_id)
-        instance['status'] = 'error'
-        instance['error'] = str(error)
+        now = time.time()
+        get_db().execute(
+            "UPDATE jobs SET status = 'error', error = ?, updated_at = ?, finished_at = ? WHERE id = ?",
+            (str(error), now, now, task_id))
+
+    @classmethod
+    def set_cancelled(cls, task_id):
+        now = time.time()
+        get_db().execute(
+            "UPDATE jobs SET status = 'cancelled', message = '任务已取消', updated_at = ?, finished_at = ? "
+            "WHERE id = ?",
+            (now, now, task_id))
         
     @classmethod
-    def set_complete(cls, task_id):
-        instance = cls.get_instance(task_id)
-        instance['status'] = 'complete'
-        instance['progress'] = 100
+    def set_complete(cls, task_id, result=None):
+        now = time.time()
+        get_db().execute(
+            "UPDATE jobs SET status = 'complete', progress = 100, message = '转录完成', result = ?, "
+            "updated_at = ?, finished_at = ? WHERE id = ?",
+            (result, now, now, task_id))
         
     @classmethod
     def clear(cls, task_id):
-        if task_id in cls._instances:
-            del cls._instances[task_id]
+        get_db().execute('DELETE FROM jobs WHERE id = ?', (task_id,))
+
+class JobQueue:
+    """基于 SQLite 的持久化转录任务队列，支持优先级、取消和排队上限"""
+
+    @classmethod
+    def submit(cls, filename, source_path, priority=0, dedup_key=None, memory_estimate=None):
+        """提交任务，返回 (任务ID, 是否新建, 等待者令牌)
+
+        dedup_key 相同（同一内容、同一转录参数）且仍在排队或运行中的任务只有一个，
+        后来的请求合并到该任务上，共享进度和结果；所有进程通过同一个任务表协调。
+        每个请求得到一个等待者令牌，取消时凭令牌只撤回自己的请求。
+        memory_estimate 为预估峰值内存，超过整个内存预算时拒绝，领取任务时按预算放行。
+        """
+        db = get_db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            if dedup_key is not None:
+                row = db.execute(
+                    "SELECT id FROM jobs WHERE dedup_key = ? AND status IN ('queued', 'running')",
+                    (dedup_key,)).fetchone()
+                if row is not None:
+                    # 合并的请求优先级更高时提升原任务的优先级
+                    db.execute('UPDATE jobs SET waiters = waiters + 1, priority = MAX(priority, ?) WHERE id = ?',
+                               (priority, row['id']))
+                    token = cls.attach(db, row['id'])
+                    db.execute('COMMIT')
+                    incr_counter('localweb_jobs_coalesced_total')
+                    return row['id'], False, token
+            budget = app.config['MEMORY_BUDGET_BYTES']
+            if budget and memory_estimate and memory_estimate > budget:
+                raise MemoryBudgetError(f'文件过长，预计需要 {memory_estimate // 1024 // 1024}MB 内存，'
+                                        f'超过内存预算 {budget // 1024 // 1024}MB')
+            queued = db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            if queued >= app.config['JOB_MAX_QUEUED']:
+                raise QueueFullError(f'排队任务已满（{queued}），请稍后再试')
+            job_id = uuid.uuid4().hex
+            now = time.time()
+            db.execute(
+                "INSERT INTO jobs (id, filename, source_path, status, priority, message, dedup_key, "
+                "memory_estimate, created_at, updated_at) VALUES (?, ?, ?, 'queued', ?, '排队中...', ?, ?, ?, ?)",
+                (job_id, filename, source_path, priority, dedup_key, memory_estimate, now, now))
+            token = cls.attach(db, job_id)
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        return job_id, True, token
+
+    @classmethod
+    def attach(cls, db, job_id):
+        """为一个请求登记等待者，返回令牌；在调用方的事务中执行"""
+        token = uuid.uuid4().hex
+        db.execute('INSERT INTO job_waiters (token, job_id, created_at) VALUES (?, ?, ?)',
+                   (token, job_id, time.time()))
+        return token
+
+    @classmethod
+    def waiter_released(cls, job_id, token):
+        """该令牌对应的请求是否已经取消"""
+        if not token:
+            return False
+        row = get_db().execute('SELECT released_at FROM job_waiters WHERE token = ? AND job_id = ?',
+                               (token, job_id)).fetchone()
+        return row is not None and row['released_at'] is not None
+
+    @classmethod
+    def claim(cls, worker_id):
+        """领取优先级最高的排队任务；长时间无心跳的运行中任务视为崩溃，重新领取
+
+        运行中任务的预估内存加上该任务超过内存预算时不领取，等其他任务结束；
+        不跳过它去领取后面较小的任务，避免长音频一直排不上。没有任务在运行时总是放行。
+        """
+        db = get_db()
+        now = time.time()
+        stale_before = now - app.config['JOB_STALE_SECONDS']
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            # 反复导致进程崩溃的任务不再重试
+            db.execute(
+                "UPDATE jobs SET status = 'error', error = '任务多次中断，已放弃', finished_at = ?, updated_at = ? "
+                "WHERE status = 'running' AND updated_at < ? AND attempts >= ?",
+                (now, now, stale_before, app.config['JOB_MAX_ATTEMPTS']))
+            row = db.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' "
+                "OR (status = 'running' AND updated_at < ?) "
+                "ORDER BY priority DESC, created_at LIMIT 1",
+                (stale_before,)).fetchone()
+            budget = app.config['MEMORY_BUDGET_BYTES']
+            if row is not None and budget and row['memory_estimate']:
+                # 运行中的任务由心跳线程持续刷新 updated_at（与进度无关），超时未刷新的说明进程已退出，不再占用预算；
+                # 这些任务会被重新领取，若把它们计入预算，排在前面的任务会一直等待
+                admitted = db.execute(
+                    "SELECT COALESCE(SUM(memory_estimate), 0) FROM jobs "
+                    "WHERE status = 'running' AND updated_at >= ? AND id != ?",
+                    (stale_before, row['id'])).fetchone()[0]
+                if admitted and admitted + row['memory_estimate'] > budget:
+                    row = None
+            if row is not None:
+                db.execute(
+                    "UPDATE jobs SET status = 'running', worker = ?, started_at = ?, updated_at = ?, "
+                    "attempts = attempts + 1, message = '开始处理...' WHERE id = ?",
+                    (worker_id, now, now, row['id']))
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        return dict(row) if row is not None else None
+
+    @classmethod
+    def get(cls, job_id):
+        row = get_db().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    @classmethod
+    def queue_position(cls, job):
+        """排在该任务前面的任务数"""
+        return get_db().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'queued' "
+            "AND (priority > ? OR (priority = ? AND created_at < ?))",
+            (job['priority'], job['priority'], job['created_at'])).fetchone()[0]
+
+    @classmethod
+    def cancel(cls, job_id, token=None):
+        """撤回令牌对应的请求，返回 (任务, 是否只释放了该请求)；任务不存在时返回 (None, False)
+
+        同一令牌只计一次，重复取消不影响其他请求。还有其他请求在等待结果时任务继续运行；
+        最后一个请求撤回后，排队中的任务直接取消，运行中的任务在下一个检查点停止。
+        任务有未撤回的令牌时必须提供其中之一，否则抛出 WaiterTokenError。
+        """
+        db = get_db()
+        now = time.time()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            job = db.execute('SELECT status FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if job is None:
+                db.execute('COMMIT')
+                return None, False
+            active = job['status'] in ('queued', 'running')
+            if token is not None:
+                waiter = db.execute('SELECT released_at FROM job_waiters WHERE token = ? AND job_id = ?',
+                                    (token, job_id)).fetchone()
+                if waiter is None:
+                    raise WaiterTokenError('等待者令牌无效')
+                if waiter['released_at'] is not None:
+                    db.execute('COMMIT')
+                    return cls.get(job_id), True
+                if active:
+                    db.execute('UPDATE job_waiters SET released_at = ? WHERE token = ?', (now, token))
+                    db.execute('UPDATE jobs SET waiters = MAX(waiters - 1, 0) WHERE id = ?', (job_id,))
+                    if db.execute('SELECT waiters FROM jobs WHERE id = ?', (job_id,)).fetchone()['waiters'] > 0:
+                        db.execute('COMMIT')
+                        return cls.get(job_id), True
+            elif active and db.execute('SELECT 1 FROM job_waiters WHERE job_id = ? AND released_at IS NULL LIMIT 1',
+                                       (job_id,)).fetchone() is not None:
+                raise WaiterTokenError('取消任务需要提供提交时返回的 waiter_token')
+            db.execute(
+                "UPDATE jobs SET status = 'cancelled', message = '任务已取消', updated_at = ?, finished_at = ? "
+                "WHERE id = ? AND status = 'queued'",
+                (now, now, job_id))
+            db.execute(
+                "UPDATE jobs SET cancel_requested = 1, message = '正在取消...' WHERE id = ? AND status = 'running'",
+                (job_id,))
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        return cls.get(job_id), False
+
+    @classmethod
+    def retry(cls, job_id):
+        """重新排队失败或已取消的任务，已完成的片段会从断点继续；相同内容已有任务在进行时合并到该任务
+
+        返回 (任务, 等待者令牌)，任务不能重试时令牌为 None。
+        与提交新任务一样检查排队上限和内存预算，超过时抛出 QueueFullError / MemoryBudgetError。
+        """
+        token = None
+        db = get_db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            job = db.execute('SELECT status, dedup_key, memory_estimate FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            active = None
+            if job is not None and job['status'] in ('error', 'cancelled') and job['dedup_key'] is not None:
+                active = db.execute("SELECT id FROM jobs WHERE dedup_key = ? AND status IN ('queued', 'running')",
+                                    (job['dedup_key'],)).fetchone()
+            if active is not None:
+                job_id = active['id']
+                db.execute('UPDATE jobs SET waiters = waiters + 1 WHERE id = ?', (job_id,))
+                token = cls.attach(db, job_id)
+            elif job is not None and job['status'] in ('error', 'cancelled'):
+                budget = app.config['MEMORY_BUDGET_BYTES']
+                if budget and job['memory_estimate'] and job['memory_estimate'] > budget:
+                    raise MemoryBudgetError(f"文件过长，预计需要 {job['memory_estimate'] // 1024 // 1024}MB 内存，"
+                                            f"超过内存预算 {budget // 1024 // 1024}MB")
+                queued = db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+                if queued >= app.config['JOB_MAX_QUEUED']:
+                    raise QueueFullError(f'排队任务已满（{queued}），请稍后再试')
+                now = time.time()
+                db.execute(
+                    "UPDATE jobs SET status = 'queued', error = NULL, cancel_requested = 0, attempts = 0, "
+                    "waiters = 1, message = '排队中...', updated_at = ?, finished_at = NULL WHERE id = ?",
+                    (now, job_id))
+                # 之前的请求都已结束，重试的请求是唯一的等待者
+                db.execute('UPDATE job_waiters SET released_at = ? WHERE job_id = ? AND released_at IS NULL',
+                           (now, job_id))
+                token = cls.attach(db, job_id)
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        return cls.get(job_id), token
+
+    @classmethod
+    def memory_usage(cls):
+        """运行中任务（心跳未超时）的预估内存之和与内存预算"""
+        stale_before = time.time() - app.config['JOB_STALE_SECONDS']
+        admitted = get_db().execute(
+            "SELECT COALESCE(SUM(memory_estimate), 0) FROM jobs WHERE status = 'running' AND updated_at >= ?",
+            (stale_before,)).fetchone()[0]
+        return {'budget_bytes': app.config['MEMORY_BUDGET_BYTES'], 'admitted_bytes': admitted}
+
+    @classmethod
+    def stats(cls):
+        rows = get_db().execute('SELECT status, COUNT(*) AS n FROM jobs GROUP BY status').fetchall()
+        counts = {row['status']: row['n'] for row in rows}
+        return {
+            'queued': counts.get('queued', 0),
+            'running': counts.get('running', 0),
+            'max_queued': app.config['JOB_MAX_QUEUED'],
+            'workers_per_process': app.config['JOB_WORKERS'],
+            'memory': cls.memory_usage()
+        }
 
 @app.route('/task-status/<task_id>')
 def get_task_status(task_id):
@@ -228,24 +1280,363 @@ def get_task_status(task_id):
     status = ProcessStatus.get_instance(task_id)
     return jsonify(status)
 
-# 添加缓存装饰器
-@lru_cache(maxsize=32)
 def get_file_hash(file_path):
-    """计算文件的MD5哈希值"""
-    hash_md5 = hashlib.md5()
+    """计算文件内容的 SHA-256；文件大小、修改时间和 inode 都未变时直接使用索引中的结果"""
+    st = os.stat(file_path)
+    path = os.path.abspath(file_path)
+    db = get_db()
+    row = db.execute('SELECT size, mtime_ns, inode, sha256 FROM file_index WHERE path = ?',
+                     (path,)).fetchone()
+    if row is not None and (row['size'], row['mtime_ns'], row['inode']) == (st.st_size, st.st_mtime_ns, st.st_ino):
+        return row['sha256']
+
+    hash_sha256 = hashlib.sha256()
     with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hash_sha256.update(chunk)
+    file_hash = hash_sha256.hexdigest()
+    record_file_hash(file_path, file_hash, st)
+    return file_hash
+
+def record_file_hash(file_path, file_hash, st=None, mime=None):
+    """把文件的哈希、MIME 类型和 stat 信息写入索引"""
+    st = st or os.stat(file_path)
+    get_db().execute(
+        "INSERT INTO file_index (path, size, mtime_ns, inode, sha256, mime, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT(path) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns, "
+        "inode = excluded.inode, sha256 = excluded.sha256, mime = excluded.mime, updated_at = excluded.updated_at",
+        (os.path.abspath(file_path), st.st_size, st.st_mtime_ns, st.st_ino, file_hash, mime, time.time()))
 
-def get_cached_transcript(file_path):
+# 计数器和直方图先在进程内累加，定期（以及 /metrics 抓取时）合并写入数据库，热路径上不再每次写库
+_metrics_lock = threading.Lock()
+_pending_metrics = {'pid': os.getpid(), 'counters': {}, 'buckets': {}, 'sums': {}}
+
+def _pending_metrics_locked():
+    # fork 出来的子进程继承了父进程尚未写入的数据，由父进程负责写入
+    if _pending_metrics['pid'] != os.getpid():
+        _pending_metrics.update(pid=os.getpid(), counters={}, buckets={}, sums={})
+    return _pending_metrics
+
+def flush_metrics():
+    """把本进程累加的计数器和直方图在一个事务中写入数据库，失败时放回，下次再写"""
+    with _metrics_lock:
+        pending = _pending_metrics_locked()
+        counters, buckets, sums = pending['counters'], pending['buckets'], pending['sums']
+        if not (counters or buckets or sums):
+            return
+        pending.update(counters={}, buckets={}, sums={})
+    db = get_db()
+    # 调用方已在事务中时（如提交任务时计数），合并到该事务中
+    own_transaction = not db.in_transaction
+    try:
+        if own_transaction:
+            db.execute('BEGIN IMMEDIATE')
+        try:
+            db.executemany(
+                "INSERT INTO counters (name, value) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                list(counters.items()))
+            db.executemany(
+                "INSERT INTO metric_buckets (name, labels, le, count) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(name, labels, le) DO UPDATE SET count = count + excluded.count",
+                [key + (count,) for key, count in buckets.items()])
+            db.executemany(
+                "INSERT INTO metric_sums (name, labels, sum, count) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(name, labels) DO UPDATE SET sum = sum + excluded.sum, count = count + excluded.count",
+                [key + (total, count) for key, (total, count) in sums.items()])
+            if own_transaction:
+                db.execute('COMMIT')
+        except Exception:
+            if own_transaction:
+                db.execute('ROLLBACK')
+            raise
+    except Exception:
+        with _metrics_lock:
+            pending = _pending_metrics_locked()
+            for name, amount in counters.items():
+                pending['counters'][name] = pending['counters'].get(name, 0) + amount
+            for key, count in buckets.items():
+                pending['buckets'][key] = pending['buckets'].get(key, 0) + count
+            for key, (total, count) in sums.items():
+                old_total, old_count = pending['sums'].get(key, (0.0, 0))
+                pending['sums'][key] = (old_total + total, old_count + count)
+        raise
+
+def metrics_flush_loop():
+    interval = app.config['METRICS_FLUSH_INTERVAL']
+    while True:
+        time.sleep(interval)
+        try:
+            flush_metrics()
+        except Exception as e:
+            print(f"写入指标失败: {str(e)}")
+
+def start_metrics_flusher():
+    if app.config['METRICS_FLUSH_INTERVAL'] > 0:
+        threading.Thread(target=metrics_flush_loop, name='metrics-flush', daemon=True).start()
+
+@atexit.register
+def flush_metrics_at_exit():
+    try:
+        flush_metrics()
+    except Exception as e:
+        print(f"写入指标失败: {str(e)}")
+
+def incr_counter(name, amount=1):
+    """累加计数器（所有进程共享），先在进程内累加，定期写入数据库"""
+    with _metrics_lock:
+        counters = _pending_metrics_locked()['counters']
+        counters[name] = counters.get(name, 0) + amount
+    if app.config['METRICS_FLUSH_INTERVAL'] <= 0:
+        flush_metrics()
+
+def get_counters(prefix=''):
+    # 先写入本进程累加的部分，其他进程的最多滞后一个写入间隔
+    flush_metrics()
+    rows = get_db().execute('SELECT name, value FROM counters WHERE name LIKE ?', (prefix + '%',)).fetchall()
+    return {row['name']: row['value'] for row in rows}
+
+# 直方图：名称 -> (说明, 桶上限)
+HISTOGRAMS = {
+    'localweb_stage_seconds': (
+        '各处理阶段耗时（秒）',
+        [0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600]),
+    'localweb_segment_inference_seconds': (
+        '每个片段的平均推理耗时（秒，按批次耗时平摊）',
+        [0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 60]),
+    'localweb_job_rtf': (
+        '转录任务的实时率（处理耗时 / 音频时长）',
+        [0.01, 0.02, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 2, 5]),
+    'localweb_job_queue_wait_seconds': (
+        '任务排队等待时间（秒）',
+        [0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600]),
+}
+
+def format_labels(labels):
+    return ','.join(f'{key}="{value}"' for key, value in sorted((labels or {}).items()))
+
+def observe(name, value, labels=None):
+    """记录一次直方图观测，先在进程内累加，定期写入数据库，所有进程汇总"""
+    buckets = HISTOGRAMS[name][1]
+    le = next((str(bound) for bound in buckets if value <= bound), '+Inf')
+    label_text = format_labels(labels)
+    with _metrics_lock:
+        pending = _pending_metrics_locked()
+        key = (name, label_text, le)
+        pending['buckets'][key] = pending['buckets'].get(key, 0) + 1
+        total, count = pending['sums'].get((name, label_text), (0.0, 0))
+        pending['sums'][(name, label_text)] = (total + value, count + 1)
+    if app.config['METRICS_FLUSH_INTERVAL'] <= 0:
+        flush_metrics()
+
+@contextmanager
+def stage_timer(stage, timings=None):
+    """统计一个处理阶段的耗时，timings 为字典时同时累加到该任务的耗时明细"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        record_stage(stage, elapsed, timings)
+
+def record_stage(stage, elapsed, timings=None):
+    try:
+        observe('localweb_stage_seconds', elapsed, {'stage': stage})
+    except Exception as e:
+        print(f"记录耗时失败: {str(e)}")
+    if timings is not None:
+        timings[stage] = round(timings.get(stage, 0.0) + elapsed, 4)
+
+def render_metrics():
+    """生成 Prometheus 文本格式的指标"""
+    flush_metrics()
+    db = get_db()
+    lines = []
+
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        counts = {}
+        for row in db.execute('SELECT labels, le, count FROM metric_buckets WHERE name = ?', (name,)):
+            counts.setdefault(row['labels'], {})[row['le']] = row['count']
+        sums = {row['labels']: (row['sum'], row['count'])
+                for row in db.execute('SELECT labels, sum, count FROM metric_sums WHERE name = ?', (name,))}
+        for label_text in sorted(sums):
+            prefix = label_text + ',' if label_text else ''
+            cumulative = 0
+            for le in [str(bound) for bound in buckets] + ['+Inf']:
+                cumulative += counts.get(label_text, {}).get(le, 0)
+                lines.append(f'{name}_bucket{{{prefix}le="{le}"}} {cumulative}')
+            label_part = f'{{{label_text}}}' if label_text else ''
+            lines.append(f'{name}_sum{label_part} {sums[label_text][0]}')
+            lines.append(f'{name}_count{label_part} {sums[label_text][1]}')
+
+    # 计数器名称本身就是 Prometheus 格式，可能带标签
+    seen = set()
+    for metric, value in sorted(get_counters('localweb_').items()):
+        base = metric.split('{', 1)[0]
+        if base not in seen:
+            seen.add(base)
+            lines.append(f'# TYPE {base} counter')
+        lines.append(f'{metric} {value}')
+
+    queue = JobQueue.stats()
+    cache = TranscriptCache.stats()
+    pcm = PcmStore.stats()
+    gauges = [
+        ('localweb_jobs_queued', '排队中的任务数', queue['queued']),
+        ('localweb_jobs_running', '运行中的任务数', queue['running']),
+        ('localweb_memory_budget_bytes', '任务内存预算（字节），0 为不限制', queue['memory']['budget_bytes']),
+        ('localweb_memory_admitted_bytes', '运行中任务的预估内存之和（字节）', queue['memory']['admitted_bytes']),
+        ('localweb_transcript_cache_entries', '转录缓存条目数', cache['entries']),
+        ('localweb_transcript_cache_bytes', '转录缓存占用空间（字节）', cache['size_bytes']),
+        ('localweb_transcript_cache_hit_ratio', '转录缓存命中率', cache['hit_rate'] or 0),
+        ('localweb_pcm_store_files', '已解码保存的 PCM 文件数', pcm['files']),
+        ('localweb_pcm_store_bytes', 'PCM 存储占用空间（字节）', pcm['size_bytes']),
+    ]
+    for name, help_text, value in gauges:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} gauge')
+        lines.append(f'{name} {value}')
+
+    # 各目录的占用在每次存储清理后记录，这里不扫描目录
+    usage = StorageManager.recorded_usage()
+    for name, help_text, field in [('localweb_storage_bytes', '各目录占用空间（字节，上次存储清理时统计）', 'bytes'),
+                                   ('localweb_storage_files', '各目录文件数（上次存储清理时统计）', 'files')]:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} gauge')
+        for area, info in usage.items():
+            lines.append(f'{name}{{area="{area}"}} {info[field]}')
+    return '\n'.join(lines) + '\n'
+
+def transcription_params():
+    """影响转录结果的模型和解码参数，参与缓存键的计算"""
+    if app.config['INFERENCE_BACKEND'] == 'onnx':
+        model = {'backend': 'onnx', 'model': app.config['ASR_ONNX_MODEL'],
+                 'quantize': app.config['ASR_ONNX_QUANTIZE']}
+    else:
+        model = {'model': app.config['ASR_MODEL'],
+                 'model_revision': app.config['ASR_MODEL_REVISION'],
+                 'beam_size': app.config['ASR_BEAM_SIZE']}
+    return {
+        **model,
+        'segment_mode': app.config['SEGMENT_MODE'],
+        'segment_max_seconds': app.config['SEGMENT_MAX_SECONDS']
+    }
+
+class TranscriptCache:
+    """按内容哈希 + 模型版本 + 解码参数索引的转录结果缓存，超过容量时按最近访问时间淘汰"""
+
+    @classmethod
+    def make_key(cls, content_hash, params=None):
+        payload = json.dumps({'content': content_hash, **(params or transcription_params())}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def entry_path(cls, cache_key):
+        return os.path.join(app.config['TRANSCRIPT_CACHE_FOLDER'], f"{cache_key}.txt")
+
+    @classmethod
+    def get(cls, file_path, count=True):
+        """count=False 时不计入命中率统计（用于任务开始前的复查）"""
+        content_hash = get_file_hash(file_path)
+        cache_key = cls.make_key(content_hash)
+        db = get_db()
+        row = db.execute('SELECT path FROM transcript_cache WHERE cache_key = ?', (cache_key,)).fetchone()
+        if row is not None and os.path.exists(row['path']):
+            with open(row['path'], 'r', encoding='utf-8') as f:
+                text = f.read()
+            db.execute('UPDATE transcript_cache SET last_access = ?, hits = hits + 1 WHERE cache_key = ?',
+                       (time.time(), cache_key))
+            if count:
+                incr_counter('localweb_transcript_cache_hits_total')
+            return text
+        if row is not None:
+            # 缓存文件已被删除，清理索引
+            db.execute('DELETE FROM transcript_cache WHERE cache_key = ?', (cache_key,))
+        if count:
+            incr_counter('localweb_transcript_cache_misses_total')
+        return None
+
+    @classmethod
+    def put(cls, file_path, transcript):
+        content_hash = get_file_hash(file_path)
+        params = transcription_params()
+        cache_key = cls.make_key(content_hash, params)
+        path = cls.entry_path(cache_key)
+        # 先写临时文件再原子替换，避免并发读到半个文件
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(transcript)
+        os.replace(temp_path, path)
+        now = time.time()
+        get_db().execute(
+            "INSERT INTO transcript_cache (cache_key, content_hash, params, path, size_bytes, created_at, last_access) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(cache_key) DO UPDATE SET size_bytes = excluded.size_bytes, last_access = excluded.last_access",
+            (cache_key, content_hash, json.dumps(params, sort_keys=True), path,
+             os.path.getsize(path), now, now))
+        cls.evict()
+
+    @classmethod
+    def evict(cls):
+        """总大小超过上限时删除最久未访问的条目"""
+        db = get_db()
+        max_bytes = app.config['TRANSCRIPT_CACHE_MAX_BYTES']
+        total = db.execute('SELECT COALESCE(SUM(size_bytes), 0) FROM transcript_cache').fetchone()[0]
+        if total <= max_bytes:
+            return
+        for row in db.execute('SELECT cache_key, path, size_bytes FROM transcript_cache '
+                              'ORDER BY last_access').fetchall():
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(row['path'])
+            except FileNotFoundError:
+                pass
+            db.execute('DELETE FROM transcript_cache WHERE cache_key = ?', (row['cache_key'],))
+            total -= row['size_bytes']
+            incr_counter('localweb_transcript_cache_evictions_total')
+
+    @classmethod
+    def purge(cls, content_hash=None):
+        """删除指定内容（为空时全部）各种转录参数下的缓存，返回 (条目数, 字节数)；全文索引不受影响"""
+        db = get_db()
+        if content_hash is None:
+            rows = db.execute('SELECT cache_key, path, size_bytes FROM transcript_cache').fetchall()
+        else:
+            rows = db.execute('SELECT cache_key, path, size_bytes FROM transcript_cache WHERE content_hash = ?',
+                              (content_hash,)).fetchall()
+        for row in rows:
+            try:
+                os.remove(row['path'])
+            except FileNotFoundError:
+                pass
+            db.execute('DELETE FROM transcript_cache WHERE cache_key = ?', (row['cache_key'],))
+        return len(rows), sum(row['size_bytes'] for row in rows)
+
+    @classmethod
+    def stats(cls):
+        row = get_db().execute(
+            'SELECT COUNT(*) AS entries, COALESCE(SUM(size_bytes), 0) AS size_bytes FROM transcript_cache').fetchone()
+        counters = get_counters('localweb_transcript_cache_')
+        hits = counters.get('localweb_transcript_cache_hits_total', 0)
+        misses = counters.get('localweb_transcript_cache_misses_total', 0)
+        return {
+            'entries': row['entries'],
+            'size_bytes': row['size_bytes'],
+            'max_bytes': app.config['TRANSCRIPT_CACHE_MAX_BYTES'],
+            'hits': hits,
+            'misses': misses,
+            'evictions': counters.get('localweb_transcript_cache_evictions_total', 0),
+            'hit_rate': round(hits / (hits + misses), 4) if hits + misses else None
+        }
+
+def get_cached_transcript(file_path, count=True):
     """获取缓存的转录结果"""
     try:
-        file_hash = get_file_hash(file_path)
-        cache_path = os.path.join(app.config['TRANSCRIPTS_FOLDER'], f"{file_hash}.txt")
-        if os.path.exists(cache_path):
-            with open(cache_path, 'r', encoding='utf-8') as f:
-                return f.read()
+        with stage_timer('cache_lookup'):
+            return TranscriptCache.get(file_path, count)
     except Exception as e:
         print(f"读取缓存失败: {str(e)}")
     return None
@@ -253,123 +1644,589 @@ def get_cached_transcript(file_path):
 def save_transcript_cache(file_path, transcript):
     """保存转录结果到缓存"""
     try:
-        file_hash = get_file_hash(file_path)
-        cache_path = os.path.join(app.config['TRANSCRIPTS_FOLDER'], f"{file_hash}.txt")
-        with open(cache_path, 'w', encoding='utf-8') as f:
-            f.write(transcript)
+        TranscriptCache.put(file_path, transcript)
     except Exception as e:
         print(f"保存缓存失败: {str(e)}")
 
-def split_audio(file_path, max_duration=60):
-    """将长音频分割成小片段"""
+def clear_segment_checkpoints(file_path):
+    """转录结果已能从缓存读到时清除片段断点；缓存写入失败时保留，重试不必重新识别已完成的片段"""
     try:
-        data, sr = sf.read(file_path)
-        segment_length = int(max_duration * sr)
-        segments = []
-        
-        # 计算总片段数
-        total_segments = len(data) // segment_length + (1 if len(data) % segment_length > 0 else 0)
-        
-        for i in range(0, len(data), segment_length):
-            segment = data[i:i + segment_length]
-            if len(segment) > 0:
-                segment_path = f"{file_path}.segment_{i//segment_length}.wav"
-                sf.write(segment_path, segment, sr)
-                segments.append(segment_path)
-                
-        return segments, total_segments
+        cache_key = TranscriptCache.make_key(get_file_hash(file_path))
+        row = get_db().execute('SELECT path FROM transcript_cache WHERE cache_key = ?', (cache_key,)).fetchone()
+        if row is not None and os.path.exists(row['path']):
+            SegmentCheckpoint.clear(cache_key)
     except Exception as e:
-        print(f"音频分割失败: {str(e)}")
-        return [], 0
+        print(f"清除片段断点失败: {str(e)}")
 
-def transcribe_audio(file_path, task_id):
-    """转录音频文件"""
-    temp_wav_path = os.path.join(app.config['AUDIO_FOLDER'], 'temp_transcribe.wav')
-    segments = []
-    
+def detect_speech_energy(data, sr):
+    """基于短时能量的快速 VAD，返回语音区间 [(起始采样, 结束采样)]"""
+    frame = int(sr * app.config['VAD_FRAME_MS'] / 1000)
+    n_frames = len(data) // frame
+    if n_frames == 0:
+        return [(0, len(data))] if len(data) else []
+
+    # 分块计算每帧能量（dB），避免对长音频整体平方产生大数组
+    energies = np.empty(n_frames, dtype=np.float32)
+    chunk_frames = 10000
+    for i in range(0, n_frames, chunk_frames):
+        count = min(chunk_frames, n_frames - i)
+        block = np.asarray(data[i * frame:(i + count) * frame], dtype=np.float32).reshape(count, frame)
+        energies[i:i + count] = 10 * np.log10(np.mean(block * block, axis=1) + 1e-10)
+
+    # 阈值：噪声底（低分位数）之上若干 dB，但不能高于响亮部分太多，以免整段都是语音时被误删
+    noise_floor = np.percentile(energies, 10)
+    loud = np.percentile(energies, 90)
+    threshold = max(min(noise_floor + app.config['VAD_THRESHOLD_DB'], loud - 15), app.config['VAD_MIN_DB'])
+    speech = energies > threshold
+
+    # 连续语音帧段
+    edges = np.diff(np.concatenate([[0], speech.astype(np.int8), [0]]))
+    runs = zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1))
+
+    # 合并间隔过短的停顿，丢弃过短的噪声
+    min_gap = int(app.config['VAD_MIN_SILENCE'] * 1000 / app.config['VAD_FRAME_MS'])
+    min_speech = int(app.config['VAD_MIN_SPEECH'] * 1000 / app.config['VAD_FRAME_MS'])
+    merged = []
+    for start, end in runs:
+        if merged and start - merged[-1][1] < min_gap:
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [(int(start) * frame, int(end) * frame) for start, end in merged if end - start >= min_speech]
+
+vad_model = None
+vad_model_lock = threading.Lock()
+
+def detect_speech_fsmn(data, sr):
+    """使用 FunASR 的 fsmn-vad 模型检测语音区间"""
+    global vad_model
+    with vad_model_lock:
+        if vad_model is None:
+            if app.config['INFERENCE_MODE'] == 'server':
+                vad_model = ModelClient(app.config['MODEL_SERVER_ADDRESS'],
+                                        app.config['MODEL_SERVER_AUTHKEY'], name='vad')
+            else:
+                print("正在加载 VAD 模型...")
+                vad_model = build_vad_model()
+    result = vad_model.generate(input=np.asarray(data, dtype=np.float32), fs=sr)
+    if not result:
+        return []
+    return [(int(beg * sr / 1000), min(len(data), int(end * sr / 1000)))
+            for beg, end in result[0].get('value', [])]
+
+def find_quiet_cut(data, sr, start, end):
+    """在 [start, end) 的后半段找能量最低的帧作为切分点"""
+    frame = int(sr * app.config['VAD_FRAME_MS'] / 1000)
+    search_from = start + (end - start) // 2
+    n_frames = (end - search_from) // frame
+    if n_frames < 2:
+        return end
+    block = np.asarray(data[search_from:search_from + n_frames * frame], dtype=np.float32).reshape(n_frames, frame)
+    quietest = int(np.argmin(np.mean(block * block, axis=1)))
+    return search_from + quietest * frame + frame // 2
+
+def pack_speech_regions(data, sr, regions, max_duration):
+    """把语音区间加上少量边距后合并成不超过 max_duration 的片段，较长的停顿不送入模型"""
+    max_len = int(max_duration * sr)
+    pad = int(app.config['VAD_PAD'] * sr)
+    max_gap = int(app.config['VAD_MAX_GAP'] * sr)
+
+    # 加边距，过长的区间在最安静处切开
+    pieces = []
+    for start, end in regions:
+        start = max(0, start - pad)
+        end = min(len(data), end + pad)
+        while end - start > max_len:
+            cut = find_quiet_cut(data, sr, start, start + max_len)
+            pieces.append([start, cut])
+            start = cut
+        if end > start:
+            pieces.append([start, end])
+
+    # 相邻区间间隔较短且合并后不超长时合为一个片段
+    packed = []
+    for start, end in pieces:
+        if packed and start - packed[-1][1] <= max_gap and end - packed[-1][0] <= max_len:
+            packed[-1][1] = max(packed[-1][1], end)
+        else:
+            packed.append([start, end])
+    return packed
+
+def split_audio(data, sr, max_duration=None, mode=None):
+    """将长音频分割成小片段，返回 (起始秒, 结束秒, 采样数据) 列表，片段数据是原数组的切片，不落盘
+
+    mode 为 energy/fsmn 时在停顿处切分并跳过静音，为 fixed 时按固定时长切分
+    """
+    max_duration = max_duration or app.config['SEGMENT_MAX_SECONDS']
+    mode = mode or app.config['SEGMENT_MODE']
+    if mode == 'fixed':
+        segment_length = int(max_duration * sr)
+        bounds = [(i, min(i + segment_length, len(data))) for i in range(0, len(data), segment_length)]
+    else:
+        regions = detect_speech_fsmn(data, sr) if mode == 'fsmn' else detect_speech_energy(data, sr)
+        bounds = pack_speech_regions(data, sr, regions, max_duration)
+        speech_samples = sum(end - start for start, end in bounds)
+        print(f"语音检测({mode}): {len(bounds)} 个片段，送入模型 {speech_samples / sr:.1f} 秒 / 共 {len(data) / sr:.1f} 秒")
+
+    return [(start / sr, end / sr, data[start:end]) for start, end in bounds if end > start]
+
+def batch_segments(segments, sr, batch_size=None, max_batch_seconds=None):
+    """按片段数和总时长把片段分组，便于一次送入模型批量推理"""
+    batch_size = batch_size or app.config['TRANSCRIBE_BATCH_SIZE']
+    max_samples = (max_batch_seconds or app.config['TRANSCRIBE_BATCH_SECONDS']) * sr
+    batch = []
+    batch_samples = 0
+    for segment in segments:
+        n = len(segment[2])
+        if batch and (len(batch) >= batch_size or batch_samples + n > max_samples):
+            yield batch
+            batch = []
+            batch_samples = 0
+        batch.append(segment)
+        batch_samples += n
+    if batch:
+        yield batch
+
+class SegmentCheckpoint:
+    """逐片段保存转录结果，任务中断后重试时跳过已完成的片段
+
+    fingerprint 由音频内容和转录参数决定，片段用起止毫秒标识。
+    """
+
+    @classmethod
+    def load(cls, fingerprint):
+        rows = get_db().execute(
+            'SELECT start_ms, end_ms, text FROM segment_checkpoints WHERE fingerprint = ?',
+            (fingerprint,)).fetchall()
+        return {(row['start_ms'], row['end_ms']): row['text'] for row in rows}
+
+    @classmethod
+    def save(cls, fingerprint, results):
+        """results: [(start_ms, end_ms, text)]"""
+        now = time.time()
+        get_db().executemany(
+            'INSERT OR REPLACE INTO segment_checkpoints (fingerprint, start_ms, end_ms, text, created_at) '
+            'VALUES (?, ?, ?, ?, ?)',
+            [(fingerprint, start_ms, end_ms, text, now) for start_ms, end_ms, text in results])
+
+    @classmethod
+    def since(cls, fingerprint, last_rowid=0):
+        """按写入顺序返回 rowid 大于 last_rowid 的片段"""
+        return get_db().execute(
+            'SELECT rowid, start_ms, end_ms, text FROM segment_checkpoints '
+            'WHERE fingerprint = ? AND rowid > ? ORDER BY rowid',
+            (fingerprint, last_rowid)).fetchall()
+
+    @classmethod
+    def clear(cls, fingerprint):
+        get_db().execute('DELETE FROM segment_checkpoints WHERE fingerprint = ?', (fingerprint,))
+
+CJK_CHARS = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff'
+CJK_RE = re.compile(f'[{CJK_CHARS}]+')
+SEARCH_TOKEN_RE = re.compile(f'[{CJK_CHARS}]+|[^\\W{CJK_CHARS}]+')
+
+def search_tokens(text, query=False):
+    """把文本切成索引词：中日韩文字按相邻两字切分（不依赖分词词典），其他文字按单词切分
+
+    连续汉字的最后一个字再单独作为一个词，使每个字都是某个词的开头，单字搜索可以用前缀匹配；
+    query=True 时按搜索词切分，末尾不补单字，以便与文中任意位置的相同文字组成的短语匹配。
+    """
+    matches = [match.group() for match in SEARCH_TOKEN_RE.finditer(text.lower())]
+    tokens = []
+    for i, run in enumerate(matches):
+        if CJK_RE.fullmatch(run) and len(run) > 1:
+            tokens.extend(run[j:j + 2] for j in range(len(run) - 1))
+            if not (query and i == len(matches) - 1):
+                tokens.append(run[-1])
+        else:
+            tokens.append(run)
+    return tokens
+
+class TranscriptIndex:
+    """转录结果全文索引：每个片段一行，记录起止毫秒，搜索结果可以定位到音频中的位置
+
+    与转录缓存使用同一个键（内容哈希 + 转录参数），同一内容重新转录时替换原有片段。
+    """
+
+    @classmethod
+    def available(cls):
+        return get_db().execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'transcript_fts'").fetchone() is not None
+
+    @classmethod
+    def add(cls, cache_key, content_hash, segments, source_path=None, transcript_path=None):
+        """segments: [(start_ms, end_ms, text)]，起止时间未知时为 None"""
+        segments = [(start_ms, end_ms, text) for start_ms, end_ms, text in segments if text and text.strip()]
+        db = get_db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            row = db.execute('SELECT id FROM transcripts WHERE cache_key = ?', (cache_key,)).fetchone()
+            if row is not None:
+                cls._delete_segments(db, row['id'])
+                db.execute('UPDATE transcripts SET source_path = COALESCE(?, source_path), '
+                           'transcript_path = COALESCE(?, transcript_path), created_at = ? WHERE id = ?',
+                           (source_path, transcript_path, time.time(), row['id']))
+                transcript_id = row['id']
+            else:
+                transcript_id = db.execute(
+                    'INSERT INTO transcripts (cache_key, content_hash, source_path, transcript_path, created_at) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (cache_key, content_hash, source_path, transcript_path, time.time())).lastrowid
+            for seq, (start_ms, end_ms, text) in enumerate(segments):
+                segment_id = db.execute(
+                    'INSERT INTO transcript_segments (transcript_id, seq, start_ms, end_ms, text) VALUES (?, ?, ?, ?, ?)',
+                    (transcript_id, seq, start_ms, end_ms, text)).lastrowid
+                db.execute('INSERT INTO transcript_fts (rowid, tokens) VALUES (?, ?)',
+                           (segment_id, ' '.join(search_tokens(text))))
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        return transcript_id
+
+    @classmethod
+    def _delete_segments(cls, db, transcript_id):
+        db.execute('DELETE FROM transcript_fts WHERE rowid IN '
+                   '(SELECT id FROM transcript_segments WHERE transcript_id = ?)', (transcript_id,))
+        db.execute('DELETE FROM transcript_segments WHERE transcript_id = ?', (transcript_id,))
+
+    @classmethod
+    def remove(cls, content_hash):
+        """删除该内容在各种转录参数下的索引，返回删除的转录数
+
+        索引保存在数据库中，与缓存文件相互独立：转录缓存按容量淘汰或整体清空（/admin/cache/purge）时
+        搜索结果仍然保留；只有明确清除某个文件的转录结果（/clear-transcript-cache）时才删除。
+        """
+        db = get_db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            rows = db.execute('SELECT id FROM transcripts WHERE content_hash = ?', (content_hash,)).fetchall()
+            for row in rows:
+                cls._delete_segments(db, row['id'])
+                db.execute('DELETE FROM transcripts WHERE id = ?', (row['id'],))
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        return len(rows)
+
+    @classmethod
+    def build_query(cls, query):
+        """空格分隔的每个词都要出现；每个词切分后组成短语，以单个汉字结尾时最后一个字按前缀匹配"""
+        clauses = []
+        for term in query.split():
+            tokens = search_tokens(term, query=True)
+            if not tokens:
+                continue
+            prefix = '*' if len(tokens[-1]) == 1 and CJK_RE.fullmatch(tokens[-1]) else ''
+            clauses.append('"' + ' '.join(tokens) + '"' + prefix)
+        return ' AND '.join(clauses)
+
+    @classmethod
+    def search(cls, query, limit=20, offset=0):
+        """按 BM25 相关度排序，返回 (命中片段列表, FTS 查询串)"""
+        match = cls.build_query(query)
+        if not match:
+            return [], match
+        db = get_db()
+        rows = db.execute(
+            'SELECT s.id, s.start_ms, s.end_ms, s.text, t.content_hash, t.source_path, t.transcript_path, '
+            'bm25(transcript_fts) AS score '
+            'FROM transcript_fts JOIN transcript_segments AS s ON s.id = transcript_fts.rowid '
+            'JOIN transcripts AS t ON t.id = s.transcript_id '
+            'WHERE transcript_fts MATCH ? ORDER BY score LIMIT ? OFFSET ?',
+            (match, limit, offset)).fetchall()
+        # 同一内容可能对应多个文件名
+        hashes = sorted({row['content_hash'] for row in rows})
+        names = {}
+        if hashes:
+            for row in db.execute(
+                    f"SELECT content_hash, name FROM media_files WHERE content_hash IN ({','.join('?' * len(hashes))}) "
+                    "ORDER BY uploaded_at DESC", hashes):
+                names.setdefault(row['content_hash'], []).append(row['name'])
+        terms = [term for term in query.split() if term]
+        return [{
+            'files': names.get(row['content_hash'], []),
+            'source_path': row['source_path'],
+            'transcript_path': row['transcript_path'],
+            'content_hash': row['content_hash'],
+            'start_ms': row['start_ms'],
+            'end_ms': row['end_ms'],
+            'score': round(-row['score'], 4),
+            'snippet': make_snippet(row['text'], terms)
+        } for row in rows], match
+
+    @classmethod
+    def backfill(cls):
+        """为已有的转录缓存建索引（没有片段信息，整篇作为一个片段）"""
+        rows = get_db().execute(
+            'SELECT cache_key, content_hash, path FROM transcript_cache '
+            'WHERE cache_key NOT IN (SELECT cache_key FROM transcripts)').fetchall()
+        indexed = 0
+        for row in rows:
+            try:
+                with open(row['path'], 'r', encoding='utf-8') as f:
+                    text = f.read()
+                cls.add(row['cache_key'], row['content_hash'], [(None, None, text)])
+                indexed += 1
+            except (OSError, sqlite3.IntegrityError):
+                # 缓存文件已被淘汰，或其他进程刚刚建好索引
+                continue
+        if indexed:
+            print(f"已为 {indexed} 个已有转录结果建立全文索引")
+
+def make_snippet(text, terms, context=30):
+    """截取第一个匹配词前后的文字，匹配词用 <mark> 标出，其余内容做 HTML 转义"""
+    lowered = text.lower()
+    spans = []
+    for term in terms:
+        start = lowered.find(term.lower())
+        while start != -1:
+            spans.append((start, start + len(term)))
+            start = lowered.find(term.lower(), start + len(term))
+    if not spans:
+        return html.escape(text[:context * 2]) + ('…' if len(text) > context * 2 else '')
+    spans.sort()
+    begin = max(0, spans[0][0] - context)
+    end = min(len(text), spans[0][1] + context)
+    parts, pos = [], begin
+    for start, stop in spans:
+        if start < pos or stop > end:
+            continue
+        parts.append(html.escape(text[pos:start]))
+        parts.append(f'<mark>{html.escape(text[start:stop])}</mark>')
+        pos = stop
+    parts.append(html.escape(text[pos:end]))
+    return ('…' if begin > 0 else '') + ''.join(parts) + ('…' if end < len(text) else '')
+
+def segment_span_ms(segment):
+    return int(round(segment[0] * 1000)), int(round(segment[1] * 1000))
+
+def generate_batches(model, batches, sr, task_id=None, total_segments=0, done=0):
+    """在本进程中逐批推理，返回 (批次, 模型结果, 推理耗时)"""
+    for batch in batches:
+        if task_id:
+            ProcessStatus.raise_if_cancelled(task_id)
+            ProcessStatus.update_progress(task_id, 30 + (60 * done // total_segments),
+                f"正在转录片段 {done + 1}-{done + len(batch)}/{total_segments}...")
+        start = time.perf_counter()
+        result = model.generate(input=[segment[2] for segment in batch],
+                                batch_size=len(batch), fs=sr)
+        yield batch, result, time.perf_counter() - start
+        done += len(batch)
+
+def generate_batches_sharded(pcm, batches, sr, timings=None):
+    """把各批片段分给分片推理进程，按完成顺序返回 (批次, 模型结果, 推理耗时)；片段按采样点位置从 PCM 文件中读取"""
+    pool = get_shard_pool()
+    if timings is not None:
+        timings['shard_workers'] = pool.workers
+    spans = [[(int(round(segment[0] * sr)), int(round(segment[0] * sr)) + len(segment[2])) for segment in batch]
+             for batch in batches]
+    try:
+        for index, result, elapsed in pool.transcribe(pcm.filename, pcm.offset, len(pcm), spans, sr):
+            yield batches[index], result, elapsed
+    except BrokenProcessPool:
+        reset_shard_pool()
+        raise Exception("分片推理进程异常退出，重试任务时会从断点继续")
+
+def transcribe_segments(model, segments, sr, task_id=None, fingerprint=None, timings=None, pcm=None):
+    """批量转录内存中的音频片段，按原顺序返回每个片段的文本
+
+    指定 fingerprint 时每批结果都会写入断点表，已有结果的片段直接跳过。
+    pcm 为 PcmStore 映射的整段音频时，各批片段分给分片推理进程并行转录，结果按片段位置合并。
+    """
+    finished = SegmentCheckpoint.load(fingerprint) if fingerprint else {}
+    pending = [segment for segment in segments if segment_span_ms(segment) not in finished]
+    if fingerprint and len(pending) < len(segments):
+        print(f"从断点继续：{len(segments) - len(pending)}/{len(segments)} 个片段已完成")
+
+    total_segments = len(segments)
+    done = total_segments - len(pending)
+    batches = list(batch_segments(pending, sr))
+    if pcm is not None and len(batches) > 1:
+        print(f"分片并行转录：{len(batches)} 批片段")
+        results = generate_batches_sharded(pcm, batches, sr, timings)
+    else:
+        results = generate_batches(model, batches, sr, task_id, total_segments, done)
+    for batch, result, elapsed in results:
+        # 并行推理时各进程的耗时累加，会大于实际经过的时间
+        record_stage('inference', elapsed, timings)
+        for _ in batch:
+            observe('localweb_segment_inference_seconds', elapsed / len(batch))
+        if not result or not isinstance(result, list) or len(result) != len(batch):
+            raise Exception(f"模型返回结果无效: {result}")
+
+        batch_results = [segment_span_ms(segment) + (item.get("text", ""),)
+                         for segment, item in zip(batch, result)]
+        if fingerprint:
+            SegmentCheckpoint.save(fingerprint, batch_results)
+        for start_ms, end_ms, text in batch_results:
+            finished[(start_ms, end_ms)] = text
+        done += len(batch)
+        if task_id and pcm is not None:
+            ProcessStatus.raise_if_cancelled(task_id)
+            ProcessStatus.update_progress(task_id, 30 + (60 * done // total_segments),
+                                          f"已转录片段 {done}/{total_segments}...")
+
+    return [finished[segment_span_ms(segment)] for segment in segments]
+
+def transcribe_audio(file_path, task_id, source_path=None, timings=None, mp3_path=None, transcript_path=None):
+    """转录音频文件，source_path 为原始上传文件，用于命名转录结果和计算缓存键
+
+    timings 为字典时记录各阶段耗时，并写入 audio_duration（音频时长，秒）。
+    mp3_path 不为空时，解码的同时导出可下载的 MP3。
+    transcript_path 为转录结果的保存路径，默认为 txt_output/<原文件名>.txt。
+    """
+    source_path = source_path or file_path
+    sr = 16000
+
+    ProcessStatus.update_progress(task_id, 10, "开始处理音频文件...")
+
+    # 确保模型已加载
+    model = ensure_model_loaded()
+    if model is None:
+        raise Exception("语音识别模型未正确加载")
+
+    # 16kHz 单声道 float32 PCM：第一次使用时解码并保存，之后直接映射，分片和推理都使用其切片
+    ProcessStatus.update_progress(task_id, 20, "解码音频...")
+    data = PcmStore.load(file_path, sr, mp3_path=mp3_path, timings=timings)
+    print(f"音频信息: 采样率={sr}Hz, 时长={len(data) / sr}秒")
+    if timings is not None:
+        timings['audio_duration'] = len(data) / sr
+
+    # 按停顿分片并跳过静音，短音频通常只有一个片段
+    ProcessStatus.update_progress(task_id, 30, "检测语音片段...")
+    with stage_timer('split', timings):
+        segments = split_audio(data, sr)
+    if not segments:
+        raise Exception("未检测到语音")
+
+    # 断点按原始文件内容和转录参数区分，重试时跳过已完成的片段
+    fingerprint = TranscriptCache.make_key(get_file_hash(source_path))
+    ProcessStatus.set_fingerprint(task_id, fingerprint)
+    # 长音频可以分给多个推理进程并行转录
+    pcm = data if isinstance(data, np.memmap) and should_shard(task_id, len(data), sr) else None
+    texts = transcribe_segments(model, segments, sr, task_id, fingerprint, timings, pcm)
+    text = " ".join(t for t in texts if t)
+
+    if not text.strip():
+        raise Exception("转录结果为空")
+
+    ProcessStatus.update_progress(task_id, 90, "转录完成，正在保存...")
+
+    # 保存转录结果
+    transcript_path = transcript_path or os.path.join(app.config['TRANSCRIPTS_FOLDER'],
+                                                      os.path.splitext(os.path.basename(source_path))[0] + '.txt')
+    with open(transcript_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+    # 保存转录结果到缓存（按原始文件内容计算缓存键，与提交时的查询一致）
+    save_transcript_cache(source_path, text)
     try:
-        ProcessStatus.update_progress(task_id, 10, "开始处理音频文件...")
-        
-        # 确保模型已加载
-        model = ensure_model_loaded()
-        if model is None:
-            raise Exception("语音识别模型未正确加载")
-            
-        # 检查文件类型和转换格式
-        ProcessStatus.update_progress(task_id, 20, "转换音频格式...")
-        convert_success = convert_to_wav(file_path, temp_wav_path)
-        if not convert_success:
-            raise Exception("音频格式转换失败")
-        
-        # 获取音频信息
-        audio_info = sf.info(temp_wav_path)
-        print(f"音频信息: 采样率={audio_info.samplerate}Hz, 时长={audio_info.duration}秒")
-        
-        # 如果音频较长，进行分片处理
-        if audio_info.duration > 60:
-            ProcessStatus.update_progress(task_id, 30, "分割长音频...")
-            segments, total_segments = split_audio(temp_wav_path)
-            if not segments:
-                raise Exception("音频分割失败")
-                
-            # 处理每个分片
-            texts = []
-            for i, segment in enumerate(segments):
-                progress = 30 + (60 * (i + 1) // total_segments)
-                ProcessStatus.update_progress(task_id, progress, 
-                    f"正在转录片段 {i+1}/{total_segments}...")
-                
-                result = model.generate(segment)
-                if result and isinstance(result, list) and len(result) > 0:
-                    texts.append(result[0]["text"])
-                
-                # 清理分片文件
-                try:
-                    os.remove(segment)
-                except Exception as e:
-                    print(f"清理分片文件失败: {str(e)}")
-            
-            text = " ".join(texts)
-        else:
-            # 短音频直接处理
-            ProcessStatus.update_progress(task_id, 50, "开始转录...")
-            result = model.generate(temp_wav_path)
-            if not result or not isinstance(result, list) or len(result) == 0:
-                raise Exception(f"模型返回结果无效: {result}")
-            text = result[0]["text"]
-        
-        if not text.strip():
-            raise Exception("转录结果为空")
-        
-        ProcessStatus.update_progress(task_id, 90, "转录完成，正在保存...")
-        
-        # 保存转录结果
-        transcript_path = os.path.join(app.config['TRANSCRIPTS_FOLDER'],
-                                     os.path.splitext(os.path.basename(file_path))[0] + '.txt')
-        with open(transcript_path, 'w', encoding='utf-8') as f:
-            f.write(text)
-        
-        # 保存转录结果到缓存
-        save_transcript_cache(file_path, text)
-        
-        ProcessStatus.set_complete(task_id)
-        return text
-        
+        with stage_timer('search_index', timings):
+            TranscriptIndex.add(fingerprint, get_file_hash(source_path),
+                                [segment_span_ms(segment) + (t,) for segment, t in zip(segments, texts)],
+                                os.path.abspath(source_path), os.path.abspath(transcript_path))
     except Exception as e:
-        ProcessStatus.set_error(task_id, str(e))
-        raise
-    finally:
-        # 清理临时文件
-        if os.path.exists(temp_wav_path):
-            try:
-                os.remove(temp_wav_path)
-            except Exception as e:
-                print(f"清理临时文件失败: {str(e)}")
+        print(f"更新全文索引失败: {str(e)}")
+
+    return text
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+READ_CHUNK_SIZE = 1024 * 1024
+MIME_SNIFF_BYTES = 64 * 1024
+
+class UploadWriter:
+    """边接收边写入临时文件，同时计算 SHA-256 并根据文件头识别 MIME 类型"""
+
+    def __init__(self, temp_path, offset=0):
+        self.temp_path = temp_path
+        self.offset = offset
+        self.hasher = hashlib.sha256() if offset == 0 else None
+        self.head = b''
+        self.mime = None
+
+    def write_stream(self, stream, limit=None):
+        mode = 'r+b' if self.offset else 'wb'
+        with open(self.temp_path, mode) as f:
+            f.seek(self.offset)
+            written = 0
+            while True:
+                chunk = stream.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if limit is not None and written > limit:
+                    raise ValueError('上传数据超过声明的文件大小')
+                f.write(chunk)
+                if self.hasher is not None:
+                    self.hasher.update(chunk)
+                if self.mime is None and self.offset == 0:
+                    self.head += chunk[:MIME_SNIFF_BYTES - len(self.head)]
+                    if len(self.head) >= MIME_SNIFF_BYTES:
+                        self.mime = magic.from_buffer(self.head, mime=True)
+            self.offset += written
+        if self.mime is None and self.head:
+            self.mime = magic.from_buffer(self.head, mime=True)
+        return written
+
+    def hexdigest(self):
+        """返回完整内容的哈希；中途换了进程（哈希状态丢失）时重新读一遍临时文件"""
+        if self.hasher is None:
+            self.hasher = hashlib.sha256()
+            with open(self.temp_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b''):
+                    self.hasher.update(chunk)
+        return self.hasher.hexdigest()
+
+def store_content(temp_path, content_hash, filename, mime=None):
+    """把上传完成的临时文件按内容哈希存放，并以硬链接的方式出现在上传目录中
+
+    相同内容的文件只保存一份，返回上传目录中的文件路径。
+    """
+    object_dir = os.path.join(app.config['OBJECTS_FOLDER'], content_hash[:2])
+    os.makedirs(object_dir, exist_ok=True)
+    object_path = os.path.join(object_dir, content_hash)
+    if os.path.exists(object_path):
+        print(f"文件内容已存在，复用: {content_hash}")
+        try:
+            # 没有文件名引用的内容超过一定时间会被存储清理删除，刷新修改时间使其不再是清理对象
+            if os.stat(object_path).st_nlink <= 1:
+                os.utime(object_path)
+        except FileNotFoundError:
+            pass
+    else:
+        os.replace(temp_path, object_path)
+
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    if os.path.exists(filepath):
+        if os.path.exists(object_path) and os.path.samefile(filepath, object_path):
+            record_file_hash(filepath, content_hash, mime=mime)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return filepath
+        os.remove(filepath)
+    try:
+        os.link(object_path, filepath)
+    except FileNotFoundError:
+        # 复用的内容刚好被存储清理删除，改用本次上传的临时文件
+        os.replace(temp_path, object_path)
+        os.link(object_path, filepath)
+    except OSError:
+        # 文件系统不支持硬链接时退回复制
+        shutil.copyfile(object_path, filepath)
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    record_file_hash(filepath, content_hash, mime=mime)
+    return filepath
+
+def register_upload(filename, filepath, mime, content_hash=None):
+    """把上传的文件登记到媒体目录，出现在最近文件列表中"""
+    return MediaCatalog.register(filename, filepath, mime, content_hash)
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     if 'file' not in request.files:
@@ -380,22 +2237,135 @@ def upload_file():
         return jsonify({'error': '没有选择文件'}), 400
     
     filename = safe_filename(file.filename)
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(filepath)
+    temp_path = os.path.join(app.config['INCOMING_FOLDER'], f'{uuid.uuid4().hex}.part')
+    try:
+        with stage_timer('upload_store'):
+            writer = UploadWriter(temp_path)
+            writer.write_stream(file.stream)
+            filepath = store_content(temp_path, writer.hexdigest(), filename, writer.mime)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    file_info = register_upload(filename, filepath, writer.mime, writer.hexdigest())
+    schedule_preview_proxy(filepath, writer.mime)
     
-    # 更新最近文件列表
-    recent_files = get_recent_files()
-    file_info = {
-        'name': filename,
-        'path': filepath,
-        'type': magic.from_file(filepath, mime=True)
+    return jsonify({
+        'message': '文件上传成功',
+        'filename': filename,
+        'type': file_info['type']
+    })
+
+# 本进程中分块上传的哈希状态，块按顺序到达同一进程时不必重新读文件
+_upload_writers = {}
+_upload_writers_lock = threading.Lock()
+
+def upload_session_json(session):
+    return {
+        'upload_id': session['id'],
+        'filename': session['filename'],
+        'size': session['size'],
+        'offset': session['received'],
+        'chunk_size': app.config['UPLOAD_CHUNK_SIZE']
     }
-    
-    if file_info not in recent_files:
-        recent_files.insert(0, file_info)
-        recent_files = recent_files[:10]  # 只保留最近10个文件
-        save_recent_files(recent_files)
-    
+
+@app.route('/upload/sessions', methods=['POST'])
+def create_upload_session():
+    """创建分块上传会话，用于超过单次请求大小限制的文件，支持断点续传"""
+    data = request.get_json(silent=True) or {}
+    filename = safe_filename(data.get('filename') or '')
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        return jsonify({'error': '缺少文件大小'}), 400
+    if not filename:
+        return jsonify({'error': '没有选择文件'}), 400
+    if size <= 0 or size > app.config['UPLOAD_MAX_TOTAL_BYTES']:
+        return jsonify({'error': '文件大小超出限制'}), 413
+
+    upload_id = uuid.uuid4().hex
+    now = time.time()
+    db = get_db()
+    db.execute(
+        'INSERT INTO upload_sessions (id, filename, size, created_at, updated_at) VALUES (?, ?, ?, ?, ?)',
+        (upload_id, filename, size, now, now))
+    open(os.path.join(app.config['INCOMING_FOLDER'], f'{upload_id}.part'), 'wb').close()
+    session = db.execute('SELECT * FROM upload_sessions WHERE id = ?', (upload_id,)).fetchone()
+    return jsonify(upload_session_json(session)), 201
+
+@app.route('/upload/sessions/<upload_id>', methods=['GET'])
+def get_upload_session(upload_id):
+    """查询已接收的字节数，客户端据此续传"""
+    session = get_db().execute('SELECT * FROM upload_sessions WHERE id = ?', (upload_id,)).fetchone()
+    if session is None:
+        return jsonify({'error': '上传会话不存在'}), 404
+    return jsonify(upload_session_json(session))
+
+@app.route('/upload/sessions/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """接收一个数据块，请求体为原始字节，offset 参数必须等于已接收的字节数"""
+    db = get_db()
+    session = db.execute('SELECT * FROM upload_sessions WHERE id = ?', (upload_id,)).fetchone()
+    if session is None:
+        return jsonify({'error': '上传会话不存在'}), 404
+    try:
+        offset = int(request.args.get('offset', -1))
+    except ValueError:
+        offset = -1
+    if offset != session['received']:
+        response = jsonify({'error': '数据块位置不匹配', **upload_session_json(session)})
+        return response, 409
+
+    temp_path = os.path.join(app.config['INCOMING_FOLDER'], f'{upload_id}.part')
+    with _upload_writers_lock:
+        writer = _upload_writers.get(upload_id)
+    if writer is None or writer.offset != offset:
+        writer = UploadWriter(temp_path, offset)
+    try:
+        writer.write_stream(request.stream, limit=session['size'] - offset)
+    except Exception as e:
+        # 哈希状态已包含不完整的数据，丢弃后由下一次请求重新计算
+        with _upload_writers_lock:
+            _upload_writers.pop(upload_id, None)
+        print(f"接收数据块失败: {str(e)}")
+        if isinstance(e, ValueError):
+            return jsonify({'error': str(e)}), 400
+        raise
+
+    mime = session['mime'] or writer.mime
+    db.execute('UPDATE upload_sessions SET received = ?, mime = ?, updated_at = ? WHERE id = ?',
+               (writer.offset, mime, time.time(), upload_id))
+    with _upload_writers_lock:
+        _upload_writers[upload_id] = writer
+    session = db.execute('SELECT * FROM upload_sessions WHERE id = ?', (upload_id,)).fetchone()
+    return jsonify(upload_session_json(session))
+
+@app.route('/upload/sessions/<upload_id>/complete', methods=['POST'])
+def complete_upload_session(upload_id):
+    """所有数据块接收完成后保存文件"""
+    db = get_db()
+    session = db.execute('SELECT * FROM upload_sessions WHERE id = ?', (upload_id,)).fetchone()
+    if session is None:
+        return jsonify({'error': '上传会话不存在'}), 404
+    if session['received'] != session['size']:
+        return jsonify({'error': '文件尚未上传完成', **upload_session_json(session)}), 409
+
+    temp_path = os.path.join(app.config['INCOMING_FOLDER'], f'{upload_id}.part')
+    with _upload_writers_lock:
+        writer = _upload_writers.pop(upload_id, None)
+    if writer is None or writer.offset != session['size']:
+        writer = UploadWriter(temp_path, session['size'])
+    mime = session['mime']
+    if mime is None:
+        with open(temp_path, 'rb') as f:
+            mime = magic.from_buffer(f.read(MIME_SNIFF_BYTES), mime=True)
+
+    filename = session['filename']
+    content_hash = writer.hexdigest()
+    filepath = store_content(temp_path, content_hash, filename, mime)
+    db.execute('DELETE FROM upload_sessions WHERE id = ?', (upload_id,))
+    file_info = register_upload(filename, filepath, mime, content_hash)
+    schedule_preview_proxy(filepath, mime)
     return jsonify({
         'message': '文件上传成功',
         'filename': filename,
@@ -404,11 +2374,92 @@ def upload_file():
 
 @app.route('/recent')
 def get_recent():
-    return jsonify(get_recent_files())
+    """最近上传的文件，?limit=&offset= 分页"""
+    try:
+        limit = max(1, min(int(request.args.get('limit', 10)), 200))
+        offset = max(0, int(request.args.get('offset', 0)))
+    except ValueError:
+        return jsonify({'error': 'limit 和 offset 必须是整数'}), 400
+    files, total = MediaCatalog.list(limit, offset)
+    response = jsonify(files)
+    response.headers['X-Total-Count'] = str(total)
+    return response
+
+@app.route('/media')
+def list_media():
+    """媒体目录分页查询，包括不在最近文件列表中的文件；?status= 按转录状态过滤"""
+    try:
+        limit = max(1, min(int(request.args.get('limit', 50)), 500))
+        offset = max(0, int(request.args.get('offset', 0)))
+    except ValueError:
+        return jsonify({'error': 'limit 和 offset 必须是整数'}), 400
+    files, total = MediaCatalog.list(limit, offset, request.args.get('status'), listed_only=False)
+    return jsonify({'files': files, 'total': total, 'limit': limit, 'offset': offset})
+
+_preview_proxy_jobs = set()
+_preview_proxy_lock = threading.Lock()
+
+def preview_proxy_path(content_hash):
+    return os.path.join(app.config['PREVIEW_PROXY_FOLDER'], f"{content_hash}.mp4")
+
+def schedule_preview_proxy(file_path, mime=None):
+    """大视频在后台转码为低码率的预览版本，已有时返回其路径，否则返回 None"""
+    if not app.config['PREVIEW_PROXY'] or find_ffmpeg() is None:
+        return None
+    try:
+        if os.path.getsize(file_path) < app.config['PREVIEW_PROXY_MIN_BYTES']:
+            return None
+        if not (mime or get_file_mime(file_path)).startswith('video/'):
+            return None
+        content_hash = get_file_hash(file_path)
+        target = preview_proxy_path(content_hash)
+        if os.path.exists(target):
+            return target
+        with _preview_proxy_lock:
+            if content_hash in _preview_proxy_jobs:
+                return None
+            _preview_proxy_jobs.add(content_hash)
+        threading.Thread(target=build_preview_proxy, args=(file_path, target, content_hash),
+                         name='preview-proxy', daemon=True).start()
+    except Exception as e:
+        print(f"安排预览转码失败: {str(e)}")
+    return None
+
+def build_preview_proxy(file_path, target, content_hash):
+    """转码预览版本：限制高度和码率，moov 放在文件开头以便边下边播"""
+    temp_path = f"{target}.{os.getpid()}.part"
+    bitrate = app.config['PREVIEW_PROXY_BITRATE']
+    command = [
+        find_ffmpeg(), '-nostdin', '-v', 'error', '-i', file_path,
+        '-vf', f"scale=-2:'min({app.config['PREVIEW_PROXY_HEIGHT']},ih)'",
+        '-c:v', 'libx264', '-preset', 'veryfast', '-b:v', bitrate, '-maxrate', bitrate,
+        '-bufsize', bitrate, '-c:a', 'aac', '-b:a', '96k',
+        '-movflags', '+faststart', '-f', 'mp4', '-y', temp_path
+    ]
+    try:
+        print(f"开始转码预览版本: {file_path}")
+        with stage_timer('preview_proxy'):
+            result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise Exception(result.stderr[-2000:])
+        os.replace(temp_path, target)
+        print(f"预览版本转码完成: {target}")
+    except Exception as e:
+        print(f"预览版本转码失败: {str(e)}")
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        with _preview_proxy_lock:
+            _preview_proxy_jobs.discard(content_hash)
 
 @app.route('/preview/<path:filename>')
 def preview_file(filename):
-    """预览文件"""
+    """预览文件
+
+    支持 Range 请求（206），浏览器播放器拖动进度时只传输需要的部分；ETag 为文件内容的 SHA-256，
+    配合 If-None-Match / If-Range 返回 304 或整个文件。文件类型使用上传时记录的结果，不再每次检测。
+    ?proxy=1 时若已有低码率预览版本则返回预览版本。
+    """
     try:
         # 解码 URL 编码的文件名
         filename = unquote(filename)
@@ -416,38 +2467,51 @@ def preview_file(filename):
         # 处理 Windows 路径分隔符
         filename = filename.replace('\\', '/')
         
-        # 构建文件路径
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
-        # 规范化路径
-        file_path = os.path.abspath(file_path)
-        upload_folder = os.path.abspath(app.config['UPLOAD_FOLDER'])
-        
-        # 安全检查：确保文件路径在上传目录内
-        if not file_path.startswith(upload_folder):
+        # 构建文件路径，安全检查：确保文件路径在上传目录内
+        file_path = safe_join(app.config['UPLOAD_FOLDER'], filename)
+        if file_path is None:
             abort(403)  # Forbidden
             
         if not os.path.exists(file_path):
             abort(404)  # Not Found
             
-        # 获取文件类型
-        mime = magic.Magic(mime=True)
-        file_type = mime.from_file(file_path)
+        # 文件类型和内容哈希都有索引，只在文件变化后重新计算
+        file_type = get_file_mime(file_path)
+        etag = get_file_hash(file_path)
+        MediaCatalog.touch(file_path)
+        serve_path = file_path
+        proxy_status = None
+        if request.args.get('proxy') == '1' and file_type.startswith('video/'):
+            proxy_path = schedule_preview_proxy(file_path, file_type)
+            if proxy_path:
+                serve_path, file_type, etag = proxy_path, 'video/mp4', f'{etag}-proxy'
+                proxy_status = 'ready'
+            else:
+                proxy_status = 'pending' if etag in _preview_proxy_jobs else 'none'
         
-        # 发送文件时指定正确的 MIME 类型和中文文件名
+        # 发送文件时指定正确的 MIME 类型和中文文件名；conditional 处理 Range、If-None-Match 等条件请求
         response = send_file(
-            file_path,
+            serve_path,
             mimetype=file_type,
             as_attachment=False,
-            download_name=filename
+            download_name=filename,
+            conditional=True,
+            etag=etag
         )
         
         # 添加必要的响应头
         response.headers['Content-Disposition'] = f'inline; filename*=UTF-8\'\'{quote(filename)}'
         response.headers['X-Content-Type-Options'] = 'nosniff'
+        # 同名文件可能被重新上传，缓存后每次用 ETag 向服务器确认
+        response.cache_control.no_cache = True
+        response.cache_control.private = True
+        if proxy_status:
+            response.headers['X-Preview-Proxy'] = proxy_status
         
         return response
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"预览文件失败: {str(e)}")
         abort(404)
@@ -455,7 +2519,9 @@ def preview_file(filename):
 @app.route('/extract-audio/<path:filename>')
 def extract_audio_from_video(filename):
     try:
-        video_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        video_path = safe_join(app.config['UPLOAD_FOLDER'], filename)
+        if video_path is None:
+            return jsonify({'error': '文件路径不合法'}), 403
         print(f"处理视频文件: {video_path}")
         
         if not os.path.exists(video_path):
@@ -475,8 +2541,21 @@ def extract_audio_from_video(filename):
         audio_path = os.path.join(app.config['AUDIO_FOLDER'], audio_filename)
         print(f"目标音频文件: {audio_path}")
         
-        # 提取音频
-        if extract_audio(video_path, audio_path):
+        # 还没有解码过的视频：同一次解码同时导出 MP3 和转录用的 PCM；已经解码过时只导出 MP3
+        if PcmStore.get(video_path) is None:
+            try:
+                PcmStore.decode(video_path, mp3_path=audio_path)
+                extracted = True
+            except Exception as e:
+                print(f"音频提取失败: {str(e)}")
+                extracted = False
+        else:
+            extracted = extract_audio(video_path, audio_path)
+
+        if extracted:
+            # 之后转录提取出的 MP3 时直接使用视频解码得到的 PCM
+            PcmStore.alias(audio_path, video_path)
+            MediaCatalog.register(audio_filename, audio_path, 'audio/mpeg', listed=False)
             print("音频提取成功")
             return jsonify({
                 'message': '音频提取成功',
@@ -490,26 +2569,240 @@ def extract_audio_from_video(filename):
         print(f"发生错误: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/transcribe-audio/<path:filename>')
+def safe_join(folder, filename):
+    """文件名拼接到目录下的绝对路径，文件名含有 .. 或绝对路径等跳出该目录时返回 None"""
+    path = os.path.abspath(os.path.join(folder, filename))
+    if not path.startswith(os.path.abspath(folder) + os.sep):
+        return None
+    return path
+
+def find_media_file(filename, folders=None):
+    """在上传目录和音频输出目录中查找文件：先查媒体目录，没有记录的文件（如目录建立前就存在的）再查文件系统并补登记
+
+    文件名跳出这些目录时视为不存在。
+    """
+    folders = [folder for folder in folders or [app.config['UPLOAD_FOLDER'], app.config['AUDIO_FOLDER']]
+               if safe_join(folder, filename) is not None]
+    if not folders:
+        return None
+    path = MediaCatalog.resolve(filename, folders)
+    if path is not None:
+        if os.path.isfile(path):
+            MediaCatalog.touch(path)
+            return path
+        # 文件已被删除
+        MediaCatalog.forget(path)
+    for folder in folders:
+        path = os.path.join(folder, filename)
+        if os.path.isfile(path):
+            try:
+                MediaCatalog.register(filename, path, get_file_mime(path), listed=False)
+            except Exception as e:
+                print(f"登记媒体文件失败: {str(e)}")
+            return path
+    return None
+
+@app.route('/waveform/<path:filename>')
+def waveform(filename):
+    """波形预览：把 PCM 分成 points 段，返回每段的最小值和最大值；已解码过的文件不需要再次解码"""
+    path = find_media_file(filename)
+    if path is None:
+        return jsonify({'error': '文件不存在'}), 404
+    try:
+        points = max(1, min(int(request.args.get('points', 1000)), 20000))
+    except ValueError:
+        return jsonify({'error': 'points 必须是整数'}), 400
+    try:
+        sr = 16000
+        data = PcmStore.load(path, sr)
+        bucket = -(-len(data) // points) if len(data) else 1
+        full = len(data) // bucket
+        peaks = []
+        # 按块计算，映射的数据只读取一遍，不生成整段的临时数组
+        step = max(1, (1 << 22) // bucket)
+        for i in range(0, full, step):
+            count = min(step, full - i)
+            block = data[i * bucket:(i + count) * bucket].reshape(count, bucket)
+            peaks.extend(zip(block.min(axis=1).tolist(), block.max(axis=1).tolist()))
+        if full * bucket < len(data):
+            tail = data[full * bucket:]
+            peaks.append((float(tail.min()), float(tail.max())))
+        response = jsonify({
+            'sample_rate': sr,
+            'duration': len(data) / sr,
+            'samples_per_point': bucket,
+            'peaks': [[round(lo, 4), round(hi, 4)] for lo, hi in peaks]
+        })
+        response.set_etag(f'{get_file_hash(path)}-{points}')
+        return response.make_conditional(request)
+    except Exception as e:
+        print(f"生成波形失败: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+def job_heartbeat_loop(job_id, worker_id, stop):
+    """任务运行期间定期刷新心跳：解码、分片、启动分片推理进程等阶段可能很久没有进度更新，
+    只有进程真正退出、心跳停止后任务才会被其他工作线程重新领取"""
+    while not stop.wait(app.config['JOB_HEARTBEAT_INTERVAL']):
+        try:
+            if not ProcessStatus.heartbeat(job_id, worker_id):
+                return
+        except Exception as e:
+            print(f"刷新任务心跳失败: {str(e)}")
+
+def run_transcribe_job(job, worker_id):
+    """在工作线程中执行一个转录任务"""
+    job_id = job['id']
+    filename = job['filename']
+    source_path = job['source_path']
+    timings = {}
+    started = time.perf_counter()
+    if job['status'] == 'queued':
+        observe('localweb_job_queue_wait_seconds', max(0.0, time.time() - job['updated_at']))
+    status = 'error'
+    update_catalog_status(source_path, 'running', job_id)
+    stop_heartbeat = threading.Event()
+    heartbeat = threading.Thread(target=job_heartbeat_loop, args=(job_id, worker_id, stop_heartbeat),
+                                 name=f'job-heartbeat-{job_id[:8]}', daemon=True)
+    heartbeat.start()
+    try:
+        # 排队期间其他任务可能已经转录过相同内容
+        cached_transcript = get_cached_transcript(source_path, count=False)
+        if cached_transcript:
+            ProcessStatus.set_complete(job_id, cached_transcript)
+            status = 'cached'
+            clear_segment_checkpoints(source_path)
+            return
+
+        # 视频还没有提取过音频时，解码的同时导出 MP3（与 /extract-audio 的文件名一致），不再单独解码一次
+        mp3_path = None
+        with stage_timer('mime_sniff', timings):
+            is_video = get_file_mime(source_path).startswith('video/')
+        if is_video and find_ffmpeg():
+            candidate = os.path.join(app.config['AUDIO_FOLDER'], os.path.splitext(filename)[0] + '.mp3')
+            if not os.path.exists(candidate):
+                os.makedirs(os.path.dirname(candidate), exist_ok=True)
+                mp3_path = candidate
+
+        ProcessStatus.raise_if_cancelled(job_id)
+        print("开始语音识别...")
+        transcript = transcribe_audio(source_path, job_id, source_path, timings, mp3_path=mp3_path)
+        ProcessStatus.set_complete(job_id, transcript)
+        status = 'complete'
+        # 任务标记完成后再清除断点，此前中断的重试仍可跳过已完成的片段
+        clear_segment_checkpoints(source_path)
+    except JobCancelled:
+        print(f"任务已取消: {job_id}")
+        ProcessStatus.set_cancelled(job_id)
+        status = 'cancelled'
+    except Exception as e:
+        print(f"转录过程出错: {str(e)}")
+        ProcessStatus.set_error(job_id, e)
+    finally:
+        stop_heartbeat.set()
+        heartbeat.join()
+        record_job_metrics(job_id, source_path, status, time.perf_counter() - started, timings)
+        update_catalog_status(source_path, 'complete' if status == 'cached' else status, job_id,
+                              timings.get('audio_duration'))
+
+def update_catalog_status(source_path, status, job_id, duration=None):
+    """更新媒体目录中的转录状态，失败不影响任务本身"""
+    try:
+        MediaCatalog.set_transcript_status(source_path, status, job_id, duration)
+        MediaCatalog.set_job_status(job_id, status, duration)
+    except Exception as e:
+        print(f"更新媒体目录失败: {str(e)}")
+
+def record_job_metrics(job_id, source_path, status, elapsed, timings):
+    """记录任务级指标，并把耗时明细保存到任务中"""
+    try:
+        incr_counter(f'localweb_jobs_total{{status="{status}"}}')
+        timings['total'] = round(elapsed, 4)
+        audio_duration = timings.get('audio_duration')
+        if status == 'complete' and audio_duration:
+            timings['rtf'] = round(elapsed / audio_duration, 4)
+            observe('localweb_job_rtf', elapsed / audio_duration)
+            incr_counter('localweb_audio_seconds_total', audio_duration)
+            if os.path.exists(source_path):
+                incr_counter('localweb_bytes_processed_total', os.path.getsize(source_path))
+        ProcessStatus.set_timings(job_id, timings)
+        print(f"任务耗时明细: {timings}")
+    except Exception as e:
+        print(f"记录任务指标失败: {str(e)}")
+
+def job_worker_loop(worker_id):
+    """转录工作线程：循环领取任务表中的任务"""
+    # 模型第一次加载尝试结束前不领取任务，让已就绪的进程先处理
+    while not model_attempted.wait(app.config['JOB_POLL_INTERVAL']):
+        pass
+    while True:
+        try:
+            job = JobQueue.claim(worker_id)
+        except Exception as e:
+            print(f"领取任务失败: {str(e)}")
+            job = None
+        if job is None:
+            time.sleep(app.config['JOB_POLL_INTERVAL'])
+            continue
+        print(f"[{worker_id}] 开始处理任务 {job['id']}: {job['filename']}")
+        run_transcribe_job(job, worker_id)
+
+def start_job_workers():
+    """启动本进程的转录工作线程池"""
+    for i in range(app.config['JOB_WORKERS']):
+        worker_id = f"{os.getpid()}-{i}"
+        thread = threading.Thread(target=job_worker_loop, args=(worker_id,),
+                                  name=f'job-worker-{i}', daemon=True)
+        thread.start()
+    if app.config['JOB_WORKERS'] and TranscriptIndex.available():
+        # 只在处理任务的 Web 进程中补建索引，批处理的解码进程不需要
+        threading.Thread(target=run_index_backfill, name='search-backfill', daemon=True).start()
+
+def run_index_backfill():
+    try:
+        TranscriptIndex.backfill()
+    except Exception as e:
+        print(f"补建全文索引失败: {str(e)}")
+
+def job_to_json(job, released=False):
+    """任务信息的对外表示；released 为 True 时表示当前请求已取消等待，任务本身仍可能在为其他请求运行"""
+    data = {
+        'job_id': job['id'],
+        'filename': job['filename'],
+        'status': job['status'],
+        'priority': job['priority'],
+        'progress': job['progress'],
+        'message': job['message'],
+        'error': job['error'],
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at'],
+        'waiters': job['waiters'],
+        'memory_estimate': job['memory_estimate']
+    }
+    if job['status'] == 'queued':
+        data['queue_position'] = JobQueue.queue_position(job)
+    if job['status'] == 'complete':
+        data['transcript'] = job['result']
+    if job['timings']:
+        data['timings'] = json.loads(job['timings'])
+    if released:
+        data['job_status'] = job['status']
+        data['status'] = 'cancelled'
+        data['message'] = '已取消等待'
+        data.pop('transcript', None)
+        data.pop('queue_position', None)
+    return data
+
+@app.route('/transcribe-audio/<path:filename>', methods=['GET', 'POST'])
 def handle_transcribe_request(filename):
-    """处理音频转录请求"""
+    """提交音频转录任务，立即返回任务ID"""
     try:
         # 解码URL编码的中文字符
         filename = unquote(filename)
         
-        # 构建可能的音频文件路径
-        possible_paths = [
-            os.path.join(app.config['AUDIO_FOLDER'], filename),
-            os.path.join(app.config['UPLOAD_FOLDER'], filename),
-            os.path.join(app.config['AUDIO_FOLDER'], filename.replace('.wav', '.mp3'))
-        ]
-        
-        # 查找第一个存在的文件路径
-        audio_path = None
-        for path in possible_paths:
-            if os.path.exists(path):
-                audio_path = path
-                break
+        # 依次在音频输出目录、上传目录中查找
+        audio_path = (find_media_file(filename, [app.config['AUDIO_FOLDER'], app.config['UPLOAD_FOLDER']])
+                      or find_media_file(filename.replace('.wav', '.mp3'), [app.config['AUDIO_FOLDER']]))
                 
         if not audio_path:
             return jsonify({'error': '音频文件不存在'}), 404
@@ -517,75 +2810,820 @@ def handle_transcribe_request(filename):
         # 尝试从缓存中获取转录结果
         cached_transcript = get_cached_transcript(audio_path)
         if cached_transcript:
+            MediaCatalog.set_transcript_status(audio_path, 'complete')
             return jsonify({
                 'message': '转录完成（从缓存）',
                 'transcript': cached_transcript
             })
-            
-        # 如果传入的是.mp3文件，自动转换为.wav
-        if filename.endswith('.mp3'):
-            wav_filename = filename.replace('.mp3', '.wav')
-            wav_path = os.path.join(app.config['AUDIO_FOLDER'], wav_filename)
-            # 转换音频格式
-            convert_to_wav(audio_path, wav_path)
-            audio_path = wav_path
-            filename = wav_filename
-
-        # 确保音频格式正确（16kHz采样率的WAV格式）
-        wav_path = os.path.join(app.config['AUDIO_FOLDER'], 
-                              os.path.splitext(filename)[0] + '_temp.wav')
-        
+
         try:
-            print("转换音频格式...")
-            convert_to_wav(audio_path, wav_path, sample_rate=16000)
-            print("音频格式转换完成")
-        except Exception as e:
-            print(f"音频格式转换失败: {str(e)}")
-            return jsonify({'error': '音频格式转换失败'}), 500
+            priority = int(request.args.get('priority', 0))
+        except ValueError:
+            return jsonify({'error': 'priority 必须是整数'}), 400
 
-        # 开始转录
-        task_id = filename
+        # 同时转录相同内容的请求合并为一个任务
+        dedup_key = TranscriptCache.make_key(get_file_hash(audio_path))
         try:
-            print("开始语音识别...")
-            transcript = transcribe_audio(wav_path, task_id)
-            
-            return jsonify({
-                'message': '转录完成',
-                'transcript': transcript
-            })
-        except Exception as e:
-            print(f"转录过程出错: {str(e)}")
-            return jsonify({'error': str(e)}), 500
+            job_id, created, token = JobQueue.submit(filename, audio_path, priority, dedup_key,
+                                                     estimate_job_memory(audio_path))
+        except QueueFullError as e:
+            response = jsonify({'error': str(e)})
+            response.headers['Retry-After'] = '30'
+            return response, 503
+        except MemoryBudgetError as e:
+            incr_counter('localweb_jobs_rejected_memory_total')
+            return jsonify({'error': str(e)}), 413
+        # 合并到已有任务时，本文件也关联到该任务，任务结束时一并更新
+        job = JobQueue.get(job_id) if not created else None
+        MediaCatalog.set_transcript_status(audio_path, job['status'] if job else 'queued', job_id)
+
+        return jsonify({
+            'message': '转录任务已提交' if created else '相同内容的转录任务正在进行，已合并',
+            'job_id': job_id,
+            'waiter_token': token,
+            'coalesced': not created,
+            'status_url': f'/jobs/{job_id}?waiter={token}',
+            'cancel_url': f'/jobs/{job_id}/cancel?waiter={token}'
+        }), 202
             
     except Exception as e:
         print(f"处理请求失败: {str(e)}")
         return jsonify({'error': str(e)}), 500
-    finally:
-        # 清理临时文件
-        if 'wav_path' in locals() and os.path.exists(wav_path):
+
+@app.route('/search')
+def search_transcripts():
+    """全文搜索转录结果：?q=关键词（空格分隔的词都要出现）&limit=&offset=，按相关度返回命中片段和起止时间"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': '缺少搜索关键词 q'}), 400
+    try:
+        limit = max(1, min(int(request.args.get('limit', 20)), 100))
+        offset = max(0, int(request.args.get('offset', 0)))
+    except ValueError:
+        return jsonify({'error': 'limit 和 offset 必须是整数'}), 400
+    if not TranscriptIndex.available():
+        return jsonify({'error': '当前 SQLite 不支持 FTS5，全文搜索不可用'}), 501
+    started = time.perf_counter()
+    try:
+        hits, match = TranscriptIndex.search(query, limit, offset)
+    except sqlite3.OperationalError as e:
+        return jsonify({'error': f'搜索语法错误: {str(e)}'}), 400
+    elapsed = time.perf_counter() - started
+    record_stage('search', elapsed)
+    return jsonify({
+        'query': query,
+        'hits': hits,
+        'limit': limit,
+        'offset': offset,
+        'took_ms': round(elapsed * 1000, 2)
+    })
+
+@app.route('/healthz')
+def healthz():
+    """存活检查：进程能响应请求即可，不等待模型加载"""
+    return jsonify({'status': 'ok', 'pid': os.getpid()})
+
+@app.route('/readyz')
+def readyz():
+    """就绪检查：模型已加载并预热、数据库可用时返回 200，否则返回 503，负载均衡只把请求转给就绪的进程
+
+    MODEL_PRELOAD=0 时模型在第一次转录时才加载，数据库可用即视为就绪，model_loaded 为 false。
+    """
+    status = {
+        'pid': os.getpid(),
+        'inference_mode': app.config['INFERENCE_MODE'],
+        'model': model_status['state'],
+        'model_error': model_status['error'],
+        'uptime_seconds': round(time.time() - model_status['started_at'], 1)
+    }
+    if model_status['ready_at']:
+        status['model_load_seconds'] = round(model_status['ready_at'] - model_status['started_at'], 1)
+    status['model_loaded'] = inference_pipeline is not None
+    ready = status['model_loaded'] or not app.config['MODEL_PRELOAD']
+    try:
+        get_db().execute('SELECT 1').fetchone()
+        if isinstance(inference_pipeline, ModelClient):
+            # 模型服务可能在连接之后重启或退出
+            inference_pipeline.ping()
+    except Exception as e:
+        status['error'] = str(e)
+        ready = False
+    status['ready'] = ready
+    return jsonify(status), 200 if ready else 503
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus 格式的指标"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/cache/stats')
+def get_cache_stats():
+    """转录缓存统计"""
+    return jsonify(TranscriptCache.stats())
+
+@app.route('/jobs')
+def get_job_stats():
+    """任务队列概况"""
+    return jsonify(JobQueue.stats())
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    """查询转录任务状态，完成后返回转录结果"""
+    job = JobQueue.get(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify(job_to_json(job, JobQueue.waiter_released(job_id, request.args.get('waiter'))))
+
+def sse_event(event, data, event_id=None):
+    """格式化一条 Server-Sent Events 消息"""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append('data: ' + json.dumps(data, ensure_ascii=False))
+    return '\n'.join(lines) + '\n\n'
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """以 Server-Sent Events 推送任务进度和每个片段的转录文本，任务结束后关闭
+
+    事件类型：progress、segment、complete、error、cancelled。
+    segment 事件带 id，断线重连时浏览器通过 Last-Event-ID 只接收之后的片段。
+    ?waiter=<令牌> 时该请求被取消后立即发送 cancelled，不必等其他请求共享的任务结束。
+    """
+    if JobQueue.get(job_id) is None:
+        return jsonify({'error': '任务不存在'}), 404
+    waiter = request.args.get('waiter')
+    try:
+        last_segment = int(request.headers.get('Last-Event-ID', 0))
+    except ValueError:
+        last_segment = 0
+
+    def generate():
+        nonlocal last_segment
+        last_state = None
+        last_sent = time.time()
+        while True:
+            job = JobQueue.get(job_id)
+            if job is None:
+                yield sse_event('error', {'error': '任务不存在'})
+                return
+            if JobQueue.waiter_released(job_id, waiter):
+                yield sse_event('cancelled', {'job_id': job_id, 'error': None, 'released': True})
+                return
+
+            if job['fingerprint']:
+                for row in SegmentCheckpoint.since(job['fingerprint'], last_segment):
+                    last_segment = row['rowid']
+                    last_sent = time.time()
+                    yield sse_event('segment', {
+                        'start': row['start_ms'] / 1000,
+                        'end': row['end_ms'] / 1000,
+                        'text': row['text']
+                    }, event_id=row['rowid'])
+
+            state = (job['status'], job['progress'], job['message'])
+            if state != last_state:
+                last_state = state
+                last_sent = time.time()
+                progress = job_to_json(job)
+                progress.pop('transcript', None)
+                yield sse_event('progress', progress)
+
+            if job['status'] == 'complete':
+                yield sse_event('complete', {'job_id': job_id, 'transcript': job['result']})
+                return
+            if job['status'] in ('error', 'cancelled'):
+                yield sse_event(job['status'], {'job_id': job_id, 'error': job['error']})
+                return
+
+            if time.time() - last_sent >= app.config['SSE_KEEPALIVE_SECONDS']:
+                last_sent = time.time()
+                yield ': keep-alive\n\n'
+            time.sleep(app.config['SSE_POLL_INTERVAL'])
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+streaming_model = None
+streaming_model_lock = threading.Lock()  # 本进程的流式模型，各连接的推理串行进行
+stream_slots = threading.BoundedSemaphore(app.config['STREAM_MAX_CONCURRENT'])
+
+def get_streaming_model():
+    """延迟加载流式识别模型；server 模式下由模型服务加载"""
+    global streaming_model
+    with streaming_model_lock:
+        if streaming_model is None:
+            if app.config['INFERENCE_MODE'] == 'server':
+                streaming_model = ModelClient(app.config['MODEL_SERVER_ADDRESS'],
+                                              app.config['MODEL_SERVER_AUTHKEY'], name='streaming')
+            else:
+                print("正在加载流式识别模型...")
+                streaming_model = build_streaming_model(app.config['STREAMING_MODEL'],
+                                                        app.config['STREAMING_MODEL_REVISION'])
+    return streaming_model
+
+class StreamingSession:
+    """一个实时转写连接的状态：待识别的采样、重采样器、模型缓存和已识别的文本
+
+    客户端发送的 PCM（s16le 或 f32le，任意采样率、单声道）先重采样到 16kHz，
+    每凑满一块（默认 600ms）送入流式模型一次，模型的编码器和解码器状态保存在 cache 中。
+    """
+
+    SAMPLE_RATE = 16000
+
+    def __init__(self, sample_rate=16000, sample_format='s16le'):
+        if sample_format not in ('s16le', 'f32le'):
+            raise ValueError(f'不支持的采样格式: {sample_format}')
+        self.id = uuid.uuid4().hex
+        self.sample_format = sample_format
+        self.resampler = PolyphaseResampler(sample_rate, self.SAMPLE_RATE) if sample_rate != self.SAMPLE_RATE else None
+        self.chunk_samples = app.config['STREAM_CHUNK_SIZE'][1] * 960
+        self.pending = np.zeros(0, dtype=np.float32)
+        self.cache = {}
+        self.text = ''
+        self.received_samples = 0
+        self.processed_samples = 0
+        self.finished = False
+
+    def add(self, payload):
+        if self.sample_format == 's16le':
+            samples = np.frombuffer(payload, dtype='<i2').astype(np.float32) / 32768.0
+        else:
+            samples = np.frombuffer(payload, dtype='<f4').astype(np.float32)
+        if self.resampler is not None:
+            samples = self.resampler.process(samples)
+        self.pending = np.concatenate([self.pending, samples])
+        self.received_samples += len(samples)
+
+    def backlog_seconds(self):
+        return len(self.pending) / self.SAMPLE_RATE
+
+    def has_chunk(self):
+        return len(self.pending) >= self.chunk_samples
+
+    def recognize(self, is_final=False):
+        """识别一块（is_final 时识别剩余的全部采样），返回新增的文本"""
+        if is_final:
+            if self.resampler is not None:
+                self.pending = np.concatenate([self.pending, self.resampler.flush()])
+            chunk, self.pending = self.pending, np.zeros(0, dtype=np.float32)
+        else:
+            chunk, self.pending = self.pending[:self.chunk_samples], self.pending[self.chunk_samples:]
+
+        options = {
+            'input': chunk,
+            'is_final': is_final,
+            'chunk_size': app.config['STREAM_CHUNK_SIZE'],
+            'encoder_chunk_look_back': app.config['STREAM_ENCODER_LOOK_BACK'],
+            'decoder_chunk_look_back': app.config['STREAM_DECODER_LOOK_BACK']
+        }
+        model = get_streaming_model()
+        with stage_timer('stream_chunk'):
+            if isinstance(model, ModelClient):
+                result = model.generate(cache_id=self.id, **options)
+            else:
+                with streaming_model_lock:
+                    result = model.generate(cache=self.cache, **options)
+        self.processed_samples += len(chunk)
+        self.finished = is_final
+        delta = ''.join(res.get('text', '') for res in result or [])
+        self.text += delta
+        return delta
+
+    def release(self):
+        """连接异常断开时释放模型服务端的 cache"""
+        if not self.finished and isinstance(streaming_model, ModelClient):
             try:
-                os.remove(wav_path)
-                print("临时文件已清理")
+                streaming_model.release(self.id)
             except Exception as e:
-                print(f"清理临时文件失败: {str(e)}")
+                print(f"释放流式识别状态失败: {str(e)}")
+
+    def message(self, kind, delta=None):
+        payload = {
+            'type': kind,
+            'text': self.text,
+            'received_ms': self.received_samples * 1000 // self.SAMPLE_RATE,
+            'processed_ms': self.processed_samples * 1000 // self.SAMPLE_RATE
+        }
+        if delta is not None:
+            payload['delta'] = delta
+        return json.dumps(payload, ensure_ascii=False)
+
+def run_stream(ws):
+    """实时转写连接的主循环
+
+    协议：可选地先发送文本消息 {"type": "config", "sample_rate": 48000, "format": "f32le"}，
+    之后发送二进制 PCM 数据，结束时发送 {"type": "end"}。服务端每识别一块返回
+    {"type": "partial", "text", "delta", "received_ms", "processed_ms"}，结束后返回 {"type": "final", ...}。
+
+    每次推理前先取出所有已到达的消息，未处理的音频超过 STREAM_MAX_BACKLOG_SECONDS 说明识别跟不上发送速度，
+    返回错误并断开；客户端可以根据 received_ms 和 processed_ms 的差值自行降速。
+    """
+    session = StreamingSession()
+    started = False
+    try:
+        while True:
+            message = ws.receive(timeout=0 if session.has_chunk() else app.config['STREAM_IDLE_TIMEOUT'])
+            if message is None and not session.has_chunk():
+                ws.send(json.dumps({'type': 'error', 'message': '长时间没有收到音频数据'}, ensure_ascii=False))
+                break
+            if isinstance(message, str):
+                control = json.loads(message)
+                if control.get('type') == 'config' and not started:
+                    session = StreamingSession(int(control.get('sample_rate', 16000)),
+                                               control.get('format', 's16le'))
+                    continue
+                if control.get('type') == 'end':
+                    while session.has_chunk():
+                        ws.send(session.message('partial', session.recognize()))
+                    delta = session.recognize(is_final=True)
+                    incr_counter('localweb_stream_audio_seconds_total',
+                                 session.processed_samples / StreamingSession.SAMPLE_RATE)
+                    ws.send(session.message('final', delta))
+                    break
+                continue
+            if message is not None:
+                started = True
+                session.add(message)
+                if session.backlog_seconds() > app.config['STREAM_MAX_BACKLOG_SECONDS']:
+                    incr_counter('localweb_stream_overflows_total')
+                    ws.send(json.dumps({'type': 'error', 'message': '识别速度跟不上音频输入，连接已断开'}, ensure_ascii=False))
+                    break
+                continue
+            # 已到达的消息都取完了，识别一块
+            delta = session.recognize()
+            ws.send(session.message('partial', delta))
+    finally:
+        session.release()
+
+def live_transcribe(ws):
+    """实时转写：WebSocket 连接，限制每个进程的并发连接数"""
+    if not stream_slots.acquire(blocking=False):
+        incr_counter('localweb_stream_rejected_total')
+        ws.send(json.dumps({'type': 'error', 'message': '实时转写连接数已满，请稍后再试'}, ensure_ascii=False))
+        return
+    incr_counter('localweb_stream_sessions_total')
+    try:
+        run_stream(ws)
+    except ConnectionClosed:
+        print("实时转写连接已断开")
+    except Exception as e:
+        print(f"实时转写失败: {str(e)}")
+        try:
+            ws.send(json.dumps({'type': 'error', 'message': str(e)}, ensure_ascii=False))
+        except Exception:
+            pass
+    finally:
+        stream_slots.release()
+
+if Sock is not None:
+    sock = Sock(app)
+    sock.route('/ws/transcribe')(live_transcribe)
+else:
+    print("未安装 flask-sock，实时转写接口不可用")
+
+@app.route('/jobs/<job_id>/retry', methods=['POST'])
+def retry_job(job_id):
+    """重试失败或已取消的任务"""
+    try:
+        job, token = JobQueue.retry(job_id)
+    except QueueFullError as e:
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+    except MemoryBudgetError as e:
+        incr_counter('localweb_jobs_rejected_memory_total')
+        return jsonify({'error': str(e)}), 413
+    if job is None:
+        return jsonify({'error': '任务不存在'}), 404
+    data = job_to_json(job)
+    if token:
+        data['waiter_token'] = token
+    return jsonify(data)
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """撤回 ?waiter=<令牌> 对应的转录请求，其他请求都已撤回时取消任务"""
+    try:
+        job, released = JobQueue.cancel(job_id, request.args.get('waiter'))
+    except WaiterTokenError as e:
+        return jsonify({'error': str(e)}), 403
+    if job is None:
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify(job_to_json(job, released))
 
 @app.route('/download-audio/<path:filename>')
 def download_audio(filename):
     try:
+        path = safe_join(app.config['AUDIO_FOLDER'], filename)
+        if path is None:
+            abort(403)
+        MediaCatalog.touch(path)
         return send_file(
-            os.path.join(app.config['AUDIO_FOLDER'], filename),
+            path,
             as_attachment=True,
             download_name=filename
         )
     except:
         abort(404)
 
-@app.route('/clear-transcript-cache/<path:filename>')
+class StorageManager:
+    """磁盘占用管理：按目录的容量上限和保留天数淘汰文件，清理中断遗留的临时文件和失效的记录
+
+    目录（area）：uploads（上传文件）、audio（提取出的 MP3 等）、transcripts（txt_output 下的转录结果）、
+    proxy（预览版本）；PCM 存储和转录缓存有各自的容量上限，清理时一并执行。
+    超过容量时按最近使用时间淘汰，取文件修改时间、访问时间和媒体目录中记录的使用时间中最晚的一个。
+    排队中和运行中任务用到的文件、刚写入不久的文件不会被删除。
+    各进程的后台线程定时检查，通过数据库租约保证同一时间只有一个进程在清理。
+    """
+
+    AREAS = {
+        'uploads': ('UPLOAD_FOLDER', None),
+        'audio': ('AUDIO_FOLDER', None),
+        'transcripts': ('TRANSCRIPTS_FOLDER', '.txt'),
+        'proxy': ('PREVIEW_PROXY_FOLDER', '.mp4'),
+    }
+    LEASE_NAME = 'storage_gc'
+    LEASE_SECONDS = 900
+    KEEP_RUNS = 50
+    # 旧版 convert_to_wav / split_audio 在 audio_output 中留下的临时文件
+    LEGACY_TEMP_RE = re.compile(r'^(temp_audio\.wav|temp_transcribe\.wav(\.segment_\d+\.wav)?|.+_temp\.wav)$')
+    # 旧版按 MD5 命名、放在 txt_output 中的转录缓存
+    LEGACY_CACHE_RE = re.compile(r'^[0-9a-f]{32}\.txt$')
+
+    @classmethod
+    def quota(cls, area):
+        """返回 (容量上限字节数, 最长保留秒数)，0 表示不限制"""
+        max_mb, max_days = app.config['STORAGE_QUOTAS'][area]
+        return int(max_mb * 1024 * 1024), max_days * 86400
+
+    @classmethod
+    def scan(cls, folder, suffix=None):
+        """目录第一层的普通文件 [(绝对路径, stat)]，不包括子目录和隐藏文件"""
+        files = []
+        try:
+            entries = list(os.scandir(folder))
+        except FileNotFoundError:
+            return files
+        for entry in entries:
+            if entry.name.startswith('.') or (suffix and not entry.name.endswith(suffix)):
+                continue
+            try:
+                if entry.is_file(follow_symlinks=False):
+                    files.append((os.path.abspath(entry.path), entry.stat(follow_symlinks=False)))
+            except FileNotFoundError:
+                continue
+        return files
+
+    @classmethod
+    def area_files(cls, area):
+        """各目录中参与容量统计和淘汰的文件，临时文件由 sweep_temp 单独处理"""
+        key, suffix = cls.AREAS[area]
+        return [(path, st) for path, st in cls.scan(app.config[key], suffix)
+                if not path.endswith(('.part', '.tmp'))
+                and not cls.LEGACY_TEMP_RE.match(os.path.basename(path))
+                and not (area == 'transcripts' and cls.LEGACY_CACHE_RE.match(os.path.basename(path)))]
+
+    @classmethod
+    def measure(cls, files):
+        """同一内容的多个硬链接只占一份空间"""
+        return sum({(st.st_dev, st.st_ino): st.st_size for _, st in files}.values())
+
+    @classmethod
+    def usage(cls):
+        """实时统计各目录的文件数和占用空间"""
+        result = {}
+        for area in cls.AREAS:
+            files = cls.area_files(area)
+            max_bytes, max_age = cls.quota(area)
+            result[area] = {
+                'files': len(files),
+                'bytes': cls.measure(files),
+                'max_bytes': max_bytes,
+                'max_age_days': max_age / 86400
+            }
+        return result
+
+    @classmethod
+    def recorded_usage(cls):
+        """上次清理时记录的各目录占用，供指标接口使用，不扫描目录"""
+        return {row['area']: {'files': row['files'], 'bytes': row['bytes']}
+                for row in get_db().execute('SELECT area, files, bytes FROM storage_usage ORDER BY area')}
+
+    @classmethod
+    def protected_paths(cls):
+        """排队中和运行中任务的源文件，以及转录视频时会用到的同名 MP3"""
+        protected = set()
+        for row in get_db().execute("SELECT filename, source_path FROM jobs WHERE status IN ('queued', 'running')"):
+            protected.add(os.path.abspath(row['source_path']))
+            protected.add(os.path.abspath(os.path.join(app.config['AUDIO_FOLDER'],
+                                                       os.path.splitext(row['filename'])[0] + '.mp3')))
+        return protected
+
+    @classmethod
+    def remove(cls, path, st, area, reason, report):
+        """删除一个文件并计入清理报告；只有最后一个硬链接被删除时才算作释放空间"""
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        freed = st.st_size if st.st_nlink <= 1 else 0
+        entry = report['deleted'].setdefault(f'{area}:{reason}', {'files': 0, 'bytes': 0})
+        entry['files'] += 1
+        entry['bytes'] += freed
+        report['deleted_files'] += 1
+        report['freed_bytes'] += freed
+        labels = format_labels({'area': area, 'reason': reason})
+        incr_counter(f'localweb_storage_deleted_files_total{{{labels}}}')
+        incr_counter(f'localweb_storage_freed_bytes_total{{{labels}}}', freed)
+
+    @classmethod
+    def enforce(cls, area, report, now=None):
+        """删除超过保留天数的文件，再按最近使用时间从旧到新删除，直到不超过容量上限"""
+        now = now or time.time()
+        max_bytes, max_age = cls.quota(area)
+        if not max_bytes and not max_age:
+            return
+        files = cls.area_files(area)
+        accessed = MediaCatalog.access_times() if area in ('uploads', 'audio') else {}
+        protected = cls.protected_paths()
+        grace = app.config['TEMP_FILE_MAX_AGE']
+
+        def last_used(item):
+            path, st = item
+            return max(st.st_mtime, st.st_atime, accessed.get(path) or 0)
+
+        files.sort(key=last_used)
+        links = {}
+        for _, st in files:
+            links[(st.st_dev, st.st_ino)] = links.get((st.st_dev, st.st_ino), 0) + 1
+        total = cls.measure(files)
+        for item in files:
+            path, st = item
+            if max_age and now - last_used(item) > max_age:
+                reason = 'age'
+            elif max_bytes and total > max_bytes:
+                reason = 'quota'
+            else:
+                # 按使用时间排序，后面的文件既没有过期也不需要再腾出空间
+                break
+            if path in protected or now - last_used(item) < grace:
+                continue
+            cls.remove(path, st, area, reason, report)
+            if area in ('uploads', 'audio'):
+                MediaCatalog.forget(path)
+                get_db().execute('DELETE FROM file_index WHERE path = ?', (path,))
+            key = (st.st_dev, st.st_ino)
+            links[key] -= 1
+            if links[key] == 0:
+                total -= st.st_size
+
+    @classmethod
+    def sweep_temp(cls, report, now=None):
+        """清理中断遗留的临时文件、过期的分块上传、没有记录的缓存文件和不再被引用的上传内容"""
+        now = now or time.time()
+        max_age = app.config['TEMP_FILE_MAX_AGE']
+        db = get_db()
+
+        # 长时间没有进展的分块上传会话
+        expired = db.execute('SELECT id FROM upload_sessions WHERE updated_at < ?',
+                             (now - app.config['UPLOAD_SESSION_TTL'],)).fetchall()
+        for row in expired:
+            path = os.path.join(app.config['INCOMING_FOLDER'], f"{row['id']}.part")
+            try:
+                cls.remove(path, os.stat(path), 'temp', 'upload_session', report)
+            except FileNotFoundError:
+                pass
+            db.execute('DELETE FROM upload_sessions WHERE id = ?', (row['id'],))
+            with _upload_writers_lock:
+                _upload_writers.pop(row['id'], None)
+        sessions = {row['id'] for row in db.execute('SELECT id FROM upload_sessions')}
+        pcm_paths = {row['path'] for row in db.execute('SELECT DISTINCT path FROM pcm_store')}
+        cache_paths = {row['path'] for row in db.execute('SELECT path FROM transcript_cache')}
+
+        candidates = []
+        for path, st in cls.scan(app.config['INCOMING_FOLDER']):
+            # 进行中的分块上传由会话的过期时间决定
+            if os.path.basename(path)[:-len('.part')] not in sessions:
+                candidates.append((path, st, 'temp'))
+        for path, st in cls.scan(app.config['PCM_FOLDER']):
+            if path.endswith('.tmp'):
+                candidates.append((path, st, 'temp'))
+            elif path not in pcm_paths:
+                candidates.append((path, st, 'orphan'))
+        for path, st in cls.scan(app.config['TRANSCRIPT_CACHE_FOLDER']):
+            if path.endswith('.tmp'):
+                candidates.append((path, st, 'temp'))
+            elif path not in cache_paths:
+                candidates.append((path, st, 'orphan'))
+        for key in ('AUDIO_FOLDER', 'PREVIEW_PROXY_FOLDER'):
+            for path, st in cls.scan(app.config[key]):
+                if path.endswith(('.part', '.tmp')) or cls.LEGACY_TEMP_RE.match(os.path.basename(path)):
+                    candidates.append((path, st, 'temp'))
+        for path, st in cls.scan(app.config['TRANSCRIPTS_FOLDER']):
+            stem, _ = os.path.splitext(os.path.basename(path))
+            # 恰好以 32 位十六进制命名的媒体文件的转录结果不是旧版缓存
+            if cls.LEGACY_CACHE_RE.match(os.path.basename(path)) and db.execute(
+                    'SELECT 1 FROM media_files WHERE name LIKE ? LIMIT 1', (stem + '.%',)).fetchone() is None:
+                candidates.append((path, st, 'legacy_cache'))
+        # 上传目录中的文件名都已删除、只剩按内容存放的那一份
+        objects = app.config['OBJECTS_FOLDER']
+        for prefix in (os.listdir(objects) if os.path.isdir(objects) else []):
+            for path, st in cls.scan(os.path.join(objects, prefix)):
+                if st.st_nlink <= 1:
+                    candidates.append((path, st, 'orphan'))
+
+        for path, st, reason in candidates:
+            if now - st.st_mtime > max_age:
+                cls.remove(path, st, 'temp', reason, report)
+
+    @classmethod
+    def cleanup_records(cls, report, now=None):
+        """删除文件已不存在的记录，以及没有对应任务的过期片段断点"""
+        now = now or time.time()
+        db = get_db()
+        removed = 0
+        for table in ('pcm_store', 'transcript_cache', 'media_files', 'file_index'):
+            paths = [row['path'] for row in db.execute(f'SELECT DISTINCT path FROM {table}')]
+            missing = [path for path in paths if not os.path.exists(path)]
+            for path in missing:
+                db.execute(f'DELETE FROM {table} WHERE path = ?', (path,))
+            removed += len(missing)
+        removed += db.execute(
+            "DELETE FROM segment_checkpoints WHERE created_at < ? AND fingerprint NOT IN "
+            "(SELECT fingerprint FROM jobs WHERE fingerprint IS NOT NULL AND status IN ('queued', 'running'))",
+            (now - app.config['CHECKPOINT_MAX_AGE'],)).rowcount
+        report['records_removed'] = removed
+
+    @classmethod
+    def record_usage(cls):
+        usage = cls.usage()
+        now = time.time()
+        get_db().executemany(
+            "INSERT INTO storage_usage (area, files, bytes, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(area) DO UPDATE SET files = excluded.files, bytes = excluded.bytes, "
+            "updated_at = excluded.updated_at",
+            [(area, info['files'], info['bytes'], now) for area, info in usage.items()])
+        return usage
+
+    @classmethod
+    def acquire_lease(cls, owner):
+        """租约未被持有或已过期时取得，返回是否成功"""
+        now = time.time()
+        db = get_db()
+        db.execute(
+            "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE leases.expires_at < ?",
+            (cls.LEASE_NAME, owner, now + cls.LEASE_SECONDS, now))
+        row = db.execute('SELECT owner FROM leases WHERE name = ?', (cls.LEASE_NAME,)).fetchone()
+        return row is not None and row['owner'] == owner
+
+    @classmethod
+    def release_lease(cls, owner):
+        get_db().execute('DELETE FROM leases WHERE name = ? AND owner = ?', (cls.LEASE_NAME, owner))
+
+    @classmethod
+    def run(cls):
+        """执行一次清理，返回清理报告；其他进程正在清理时返回 None"""
+        owner = f'{os.getpid()}-{uuid.uuid4().hex}'
+        if not cls.acquire_lease(owner):
+            return None
+        started = time.time()
+        report = {'started_at': started, 'deleted_files': 0, 'freed_bytes': 0, 'deleted': {}, 'errors': []}
+        steps = [(f'enforce:{area}', lambda area=area: cls.enforce(area, report, started)) for area in cls.AREAS]
+        steps += [
+            # 淘汰上传文件后，不再被引用的内容在这里删除
+            ('sweep_temp', lambda: cls.sweep_temp(report, started)),
+            ('cleanup_records', lambda: cls.cleanup_records(report, started)),
+            ('pcm_store', lambda: PcmStore.evict()),
+            ('transcript_cache', lambda: TranscriptCache.evict()),
+        ]
+        try:
+            for name, step in steps:
+                try:
+                    step()
+                except Exception as e:
+                    print(f"存储清理步骤 {name} 失败: {str(e)}")
+                    report['errors'].append(f'{name}: {str(e)}')
+            report['usage'] = cls.record_usage()
+            report['finished_at'] = time.time()
+            report['seconds'] = round(report['finished_at'] - started, 3)
+            db = get_db()
+            db.execute('INSERT INTO storage_gc_runs (started_at, finished_at, report) VALUES (?, ?, ?)',
+                       (started, report['finished_at'], json.dumps(report, ensure_ascii=False)))
+            db.execute('DELETE FROM storage_gc_runs WHERE id <= '
+                       '(SELECT MAX(id) FROM storage_gc_runs) - ?', (cls.KEEP_RUNS,))
+            incr_counter('localweb_storage_gc_runs_total')
+        finally:
+            cls.release_lease(owner)
+        return report
+
+    @classmethod
+    def last_run(cls):
+        row = get_db().execute('SELECT report FROM storage_gc_runs ORDER BY id DESC LIMIT 1').fetchone()
+        return json.loads(row['report']) if row is not None else None
+
+    @classmethod
+    def purge_proxies(cls, content_hash=None):
+        """删除预览版本，返回 (文件数, 字节数)"""
+        files = [(path, st) for path, st in cls.scan(app.config['PREVIEW_PROXY_FOLDER'], '.mp4')
+                 if content_hash is None or os.path.basename(path) == f'{content_hash}.mp4']
+        for path, _ in files:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        return len(files), sum(st.st_size for _, st in files)
+
+def storage_gc_loop():
+    """定期检查上次清理的时间，多个进程中只有一个会执行"""
+    interval = app.config['STORAGE_GC_INTERVAL']
+    while True:
+        try:
+            last = StorageManager.last_run()
+            if last is None or time.time() - last['finished_at'] >= interval:
+                report = StorageManager.run()
+                if report and report['deleted_files']:
+                    print(f"存储清理: 删除 {report['deleted_files']} 个文件，"
+                          f"释放 {report['freed_bytes'] / 1024 / 1024:.1f}MB，耗时 {report['seconds']} 秒")
+        except Exception as e:
+            print(f"存储清理失败: {str(e)}")
+        time.sleep(min(interval, 60))
+
+def start_storage_gc():
+    if app.config['STORAGE_GC_INTERVAL'] > 0:
+        threading.Thread(target=storage_gc_loop, name='storage-gc', daemon=True).start()
+
+def require_admin():
+    """管理接口需要在 X-Admin-Token 请求头中提供 ADMIN_TOKEN；没有配置令牌时只允许本机直接访问"""
+    token = app.config['ADMIN_TOKEN']
+    if token:
+        if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), token):
+            abort(403)
+    elif request.remote_addr not in ('127.0.0.1', '::1'):
+        # 经过反向代理或容器端口映射的请求不是本机地址，同样拒绝
+        abort(403)
+
+@app.route('/admin/storage')
+def admin_storage():
+    """各目录和缓存的占用情况、容量上限、磁盘剩余空间和上次清理的结果"""
+    require_admin()
+    disk = shutil.disk_usage(app.config['UPLOAD_FOLDER'])
+    return jsonify({
+        'areas': StorageManager.usage(),
+        'pcm_store': PcmStore.stats(),
+        'transcript_cache': TranscriptCache.stats(),
+        'disk': {'total_bytes': disk.total, 'used_bytes': disk.used, 'free_bytes': disk.free},
+        'gc_interval': app.config['STORAGE_GC_INTERVAL'],
+        'last_gc': StorageManager.last_run()
+    })
+
+@app.route('/admin/storage/gc', methods=['POST'])
+def admin_storage_gc():
+    """立即执行一次存储清理"""
+    require_admin()
+    report = StorageManager.run()
+    if report is None:
+        return jsonify({'error': '其他进程正在清理，请稍后再试'}), 409
+    return jsonify(report)
+
+@app.route('/admin/cache/purge', methods=['POST'])
+def admin_cache_purge():
+    """清空缓存：target 为 transcripts（转录缓存）、pcm（已解码的 PCM）、proxy（预览版本）或 all"""
+    require_admin()
+    target = request.args.get('target', 'all')
+    purgers = {
+        'transcripts': TranscriptCache.purge,
+        'pcm': PcmStore.purge,
+        'proxy': StorageManager.purge_proxies,
+    }
+    if target != 'all' and target not in purgers:
+        return jsonify({'error': f'未知的缓存类型: {target}'}), 400
+    result = {}
+    for name, purge in purgers.items():
+        if target in ('all', name):
+            count, size = purge()
+            result[name] = {'files': count, 'bytes': size}
+    return jsonify(result)
+
+@app.route('/clear-transcript-cache/<path:filename>', methods=['GET', 'POST'])
 def clear_transcript_cache(filename):
-    """清除转录缓存"""
+    """清除该文件内容在各种转录参数下的缓存、全文索引和片段断点，下次转录时重新识别"""
     try:
-        # 不再尝试清除模型缓存，因为 FunASR 不支持这个功能
-        return jsonify({'message': '缓存已清除'})
+        path = find_media_file(filename)
+        if path is None:
+            return jsonify({'error': '文件不存在'}), 404
+        content_hash = get_file_hash(path)
+        entries, size = TranscriptCache.purge(content_hash)
+        indexed = TranscriptIndex.remove(content_hash) if TranscriptIndex.available() else 0
+        fingerprint = TranscriptCache.make_key(content_hash)
+        # 正在转录时保留断点，任务完成后会自行清除
+        if get_db().execute("SELECT 1 FROM jobs WHERE fingerprint = ? AND status IN ('queued', 'running')",
+                            (fingerprint,)).fetchone() is None:
+            SegmentCheckpoint.clear(fingerprint)
+        return jsonify({'message': '缓存已清除', 'entries': entries, 'freed_bytes': size, 'index_removed': indexed})
     except Exception as e:
         print(f"清除缓存失败: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -594,11 +3632,21 @@ def clear_transcript_cache(filename):
 def clear_recent():
     """清空最近文件列表"""
     try:
-        save_recent_files([])
+        MediaCatalog.clear_listed()
         return jsonify({'message': '最近文件列表已清空'})
     except Exception as e:
         print(f"清空最近文件列表失败: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+# 后台加载模型（server 模式下模型由模型服务进程持有，这里只连接），并启动转录工作线程和存储清理线程
+# （gunicorn 每个 worker 进程各自启动，共享同一个任务表）
+# 多进程 spawn 出的子进程（分片推理等）以 __mp_main__ 的名称重新导入启动脚本，不在其中启动这些线程
+if __name__ != '__mp_main__':
+    MediaCatalog.migrate_recent_files()
+    start_model_loading()
+    start_job_workers()
+    start_storage_gc()
+    start_metrics_flusher()
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5001, debug=False)
@@ -0,0 +1,258 @@
+"""批量转录目录或清单中的音视频文件
+
+解码和重采样在进程池中并行进行，结果写入 PCM 存储；主进程按解码完成的顺序依次推理，
+两个阶段之间用有界队列连接，推理当前文件时后面的文件已经在解码。
+每个文件处理完后追加一行到状态文件（JSONL），中断后重新运行会跳过已完成的文件；
+文件内部的片段断点与 Web 任务共用，中断时正在转录的文件也会从断点继续。
+
+用法（在应用目录下运行，与 Web 服务共用数据库、缓存和 PCM 存储）：
+    python batch_transcribe.py /data/recordings --decode-workers 4
+    python batch_transcribe.py --manifest files.txt --output-dir txt_output/archive
+
+环境变量与 Web 服务相同，例如 INFERENCE_MODE=server 时使用模型服务推理。
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+
+MEDIA_EXTENSIONS = ('.wav', '.mp3', '.m4a', '.aac', '.flac', '.ogg', '.opus', '.wma',
+                    '.mp4', '.mov', '.avi', '.mkv', '.webm', '.flv', '.wmv')
+
+
+def prepare_environment():
+    """批处理进程不领取 Web 任务、不做存储清理；模型只在推理阶段按需加载，解码进程不加载模型"""
+    os.environ['JOB_WORKERS'] = '0'
+    os.environ['MODEL_PRELOAD'] = '0'
+    os.environ['STORAGE_GC_INTERVAL'] = '0'
+
+
+def init_decoder():
+    prepare_environment()
+    import app  # noqa: F401
+
+
+def decode_file(path):
+    """解码进程：命中转录缓存时直接返回文本，否则解码并写入 PCM 存储"""
+    import app as web
+
+    start = time.perf_counter()
+    try:
+        cached = web.TranscriptCache.get(path, count=False)
+        if cached is not None:
+            return {'path': path, 'cached': cached, 'decode_seconds': time.perf_counter() - start}
+        data = web.PcmStore.load(path)
+        return {'path': path, 'samples': len(data), 'decode_seconds': time.perf_counter() - start}
+    except Exception as e:
+        return {'path': path, 'error': f'解码失败: {str(e)}', 'decode_seconds': time.perf_counter() - start}
+    finally:
+        # 进程池退出时不执行 atexit，每个文件解码后写入本进程累加的指标
+        try:
+            web.flush_metrics()
+        except Exception as e:
+            print(f"写入指标失败: {str(e)}", file=sys.stderr)
+
+
+def collect_inputs(args):
+    """返回 [(绝对路径, 相对输出路径)]"""
+    inputs = []
+    if args.manifest:
+        with open(args.manifest, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                path = json.loads(line)['path'] if line.startswith('{') else line
+                inputs.append((os.path.abspath(path), os.path.basename(path)))
+    for root in args.inputs:
+        root = os.path.abspath(root)
+        if os.path.isfile(root):
+            inputs.append((root, os.path.basename(root)))
+            continue
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+            for name in sorted(filenames):
+                if name.lower().endswith(MEDIA_EXTENSIONS):
+                    path = os.path.join(dirpath, name)
+                    inputs.append((path, os.path.relpath(path, root)))
+    return inputs
+
+
+def load_state(state_path):
+    """读取状态文件，同一文件以最后一条记录为准"""
+    state = {}
+    if os.path.exists(state_path):
+        with open(state_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 上次中断时可能只写了半行
+                    continue
+                state[record['path']] = record
+    return state
+
+
+def is_finished(record, path, skip_errors):
+    if record is None:
+        return False
+    if record['status'] == 'error':
+        return skip_errors
+    try:
+        st = os.stat(path)
+    except OSError:
+        return True
+    # 文件内容变了需要重新转录
+    return record.get('size') == st.st_size and record.get('mtime_ns') == st.st_mtime_ns
+
+
+class Progress:
+    """汇总吞吐：每小时墙钟时间能转录多少小时音频"""
+
+    def __init__(self, total):
+        self.total = total
+        self.started = time.time()
+        self.files = 0
+        self.cached = 0
+        self.errors = 0
+        self.audio_seconds = 0.0
+        self.decode_seconds = 0.0
+        self.inference_seconds = 0.0
+
+    def summary(self):
+        wall = time.time() - self.started
+        return {
+            'files': self.files,
+            'total': self.total,
+            'cached': self.cached,
+            'errors': self.errors,
+            'audio_hours': round(self.audio_seconds / 3600, 3),
+            'wall_hours': round(wall / 3600, 4),
+            'audio_hours_per_hour': round(self.audio_seconds / wall, 2) if wall > 0 else None,
+            'decode_cpu_seconds': round(self.decode_seconds, 1),
+            'inference_seconds': round(self.inference_seconds, 1)
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('inputs', nargs='*', help='音视频文件或目录（递归查找）')
+    parser.add_argument('--manifest', help='文件清单：每行一个路径，或 JSONL（{"path": ...}）')
+    parser.add_argument('--output-dir', help='转录结果目录，默认 txt_output，按输入目录的相对路径存放')
+    parser.add_argument('--state', help='状态文件，默认 <输出目录>/batch_state.jsonl')
+    parser.add_argument('--decode-workers', type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help='解码进程数')
+    parser.add_argument('--prefetch', type=int, help='已提交解码但还未推理的文件数上限，默认解码进程数的 2 倍')
+    parser.add_argument('--skip-errors', action='store_true', help='跳过之前失败的文件（默认会重试）')
+    parser.add_argument('--report-interval', type=float, default=60, help='输出吞吐汇总的间隔（秒）')
+    args = parser.parse_args()
+    if not args.inputs and not args.manifest:
+        parser.error('需要指定输入目录、文件或 --manifest')
+
+    prepare_environment()
+    import app as web
+
+    output_dir = args.output_dir or web.app.config['TRANSCRIPTS_FOLDER']
+    state_path = args.state or os.path.join(output_dir, 'batch_state.jsonl')
+    os.makedirs(output_dir, exist_ok=True)
+
+    inputs = collect_inputs(args)
+    state = load_state(state_path)
+    todo = [(path, rel) for path, rel in inputs if not is_finished(state.get(path), path, args.skip_errors)]
+    print(f"共 {len(inputs)} 个文件，已完成 {len(inputs) - len(todo)} 个，待处理 {len(todo)} 个", file=sys.stderr)
+    if not todo:
+        return
+
+    web.ensure_model_loaded()
+    outputs = dict(todo)
+    progress = Progress(len(todo))
+    prefetch = args.prefetch or args.decode_workers * 2
+    slots = threading.BoundedSemaphore(prefetch)
+    decoded = queue.Queue()
+    last_report = time.time()
+
+    # spawn：不继承主进程中已加载的模型和数据库连接
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(args.decode_workers, mp_context=context, initializer=init_decoder) as pool, \
+            open(state_path, 'a', encoding='utf-8') as state_file:
+
+        def feed():
+            error = None
+            for path, _ in todo:
+                slots.acquire()
+                if error is None:
+                    try:
+                        future = pool.submit(decode_file, path)
+                    except Exception as e:
+                        # 解码进程异常退出后进程池不再接受任务，剩余文件都记为失败，主循环不会一直等待
+                        error = e
+                    else:
+                        future.add_done_callback(lambda f, p=path: decoded.put((p, f)))
+                        continue
+                failed = Future()
+                failed.set_exception(error)
+                decoded.put((path, failed))
+
+        threading.Thread(target=feed, name='batch-feeder', daemon=True).start()
+
+        for _ in range(len(todo)):
+            path, future = decoded.get()
+            try:
+                result = future.result()
+            except Exception as e:
+                # 解码进程异常退出
+                result = {'path': path, 'error': f'解码进程失败: {str(e)}'}
+
+            st = os.stat(path) if os.path.exists(path) else None
+            record = {'path': path, 'size': st.st_size if st else None, 'mtime_ns': st.st_mtime_ns if st else None}
+            transcript_path = os.path.join(output_dir, os.path.splitext(outputs[path])[0] + '.txt')
+            timings = {}
+            start = time.perf_counter()
+            try:
+                if 'error' in result:
+                    raise Exception(result['error'])
+                os.makedirs(os.path.dirname(transcript_path), exist_ok=True)
+                if 'cached' in result:
+                    with open(transcript_path, 'w', encoding='utf-8') as f:
+                        f.write(result['cached'])
+                    record['status'] = 'cached'
+                    progress.cached += 1
+                else:
+                    web.transcribe_audio(path, None, path, timings, transcript_path=transcript_path)
+                    web.clear_segment_checkpoints(path)
+                    record['status'] = 'done'
+                    record['duration'] = round(timings.get('audio_duration', 0), 2)
+                    progress.audio_seconds += timings.get('audio_duration', 0)
+                record['transcript'] = transcript_path
+            except Exception as e:
+                record['status'] = 'error'
+                record['error'] = str(e)
+                progress.errors += 1
+            finally:
+                slots.release()
+
+            elapsed = time.perf_counter() - start
+            progress.files += 1
+            progress.decode_seconds += result.get('decode_seconds', 0)
+            progress.inference_seconds += elapsed
+            record['seconds'] = round(elapsed + result.get('decode_seconds', 0), 3)
+            record['finished_at'] = time.time()
+            state_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            state_file.flush()
+
+            print(f"[{progress.files}/{progress.total}] {record['status']} {path}"
+                  + (f"（{record['error']}）" if record['status'] == 'error' else ''), file=sys.stderr)
+            if time.time() - last_report >= args.report_interval:
+                last_report = time.time()
+                print(f"吞吐汇总: {json.dumps(progress.summary(), ensure_ascii=False)}", file=sys.stderr)
+
+    print(json.dumps(progress.summary(), ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
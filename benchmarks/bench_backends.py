@@ -0,0 +1,186 @@
+"""推理后端基准测试：对比 torch 和 ONNX Runtime（int8 量化 / float32）后端的识别准确率（字错误率）和实时率
+
+需要一组带参考文本的音频：目录中每个音频文件（wav/flac/mp3 等）旁边放一个同名的 .txt 参考转写。
+音频按应用中相同的方式切分成片段、分批送入模型，统计纯推理时间（onnx 后端在批内逐个片段推理）。
+每个片段的结果必须与输入一一对应，否则字错误率没有意义，数量不一致时该后端直接报错。
+
+用法：
+    python benchmarks/bench_backends.py --dataset data/eval --backends torch onnx onnx-fp32 --threads 4 \\
+        --output bench_backends.json
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import sys
+import time
+
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from model_server import DEFAULT_ONNX_MODEL, build_asr_model, configure_cpu, warm_up_model  # noqa: E402
+from resampler import resample  # noqa: E402
+
+TARGET_RATE = 16000
+AUDIO_EXTENSIONS = ('.wav', '.flac', '.mp3', '.ogg', '.m4a')
+
+BACKENDS = {
+    'torch': {'backend': 'torch'},
+    'onnx': {'backend': 'onnx', 'quantize': True},
+    'onnx-fp32': {'backend': 'onnx', 'quantize': False},
+}
+
+
+def normalize_text(text):
+    """计算字错误率前去掉标点和空白，英文统一小写"""
+    return re.sub(r'[\W_]+', '', text).lower()
+
+
+def edit_distance(ref, hyp):
+    previous = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        current = [i]
+        for j, h in enumerate(hyp, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (r != h)))
+        previous = current
+    return previous[-1]
+
+
+def load_dataset(directory):
+    samples = []
+    for name in sorted(os.listdir(directory)):
+        base, ext = os.path.splitext(name)
+        reference = os.path.join(directory, base + '.txt')
+        if ext.lower() not in AUDIO_EXTENSIONS or not os.path.exists(reference):
+            continue
+        data, sr = sf.read(os.path.join(directory, name), dtype='float32', always_2d=True)
+        data = data.mean(axis=1, dtype=np.float32)
+        if sr != TARGET_RATE:
+            data = resample(data, sr, TARGET_RATE)
+        with open(reference, 'r', encoding='utf-8') as f:
+            samples.append({'name': name, 'audio': data, 'reference': f.read().strip()})
+    return samples
+
+
+def split_fixed(data, max_seconds):
+    step = int(max_seconds * TARGET_RATE)
+    return [data[start:start + step] for start in range(0, len(data), step)]
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 1024 / (1024 if sys.platform == 'darwin' else 1), 1)
+
+
+def run_backend(name, samples, args):
+    options = dict(BACKENDS[name], batch_size=args.batch_size, onnx_model=args.onnx_model,
+                   intra_op_threads=args.threads)
+    start = time.perf_counter()
+    model = build_asr_model(**options)
+    load_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    warm_up_model(model)
+    warmup_seconds = time.perf_counter() - start
+
+    errors = chars = 0
+    audio_seconds = inference_seconds = 0.0
+    files = []
+    for sample in samples:
+        segments = split_fixed(sample['audio'], args.segment_seconds)
+        texts = []
+        start = time.perf_counter()
+        for i in range(0, len(segments), args.batch_size):
+            batch = segments[i:i + args.batch_size]
+            results = model.generate(input=batch, batch_size=len(batch), fs=TARGET_RATE)
+            if len(results) != len(batch):
+                raise RuntimeError(f'{name} 对 {len(batch)} 个片段返回了 {len(results)} 个结果')
+            texts.extend(res.get('text', '') for res in results)
+        elapsed = time.perf_counter() - start
+        hypothesis = normalize_text(''.join(texts))
+        reference = normalize_text(sample['reference'])
+        distance = edit_distance(reference, hypothesis)
+        duration = len(sample['audio']) / TARGET_RATE
+
+        errors += distance
+        chars += len(reference)
+        audio_seconds += duration
+        inference_seconds += elapsed
+        files.append({'name': sample['name'], 'duration_s': round(duration, 2),
+                      'cer': round(distance / max(len(reference), 1), 4), 'rtf': round(elapsed / duration, 4)})
+
+    return {
+        'backend': name,
+        'load_seconds': round(load_seconds, 2),
+        'warmup_seconds': round(warmup_seconds, 3),
+        'audio_seconds': round(audio_seconds, 1),
+        'inference_seconds': round(inference_seconds, 3),
+        'rtf': round(inference_seconds / audio_seconds, 4) if audio_seconds else None,
+        'cer': round(errors / chars, 4) if chars else None,
+        'peak_rss_mb': peak_rss_mb(),
+        'files': files
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dataset', required=True, help='音频和同名 .txt 参考文本所在目录')
+    parser.add_argument('--backends', nargs='+', default=['torch', 'onnx'], choices=sorted(BACKENDS))
+    parser.add_argument('--threads', type=int, default=4, help='torch 线程数 / ONNX 算子内线程数')
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--segment-seconds', type=float, default=30, help='固定切分的片段时长（秒）')
+    parser.add_argument('--onnx-model', default=DEFAULT_ONNX_MODEL)
+    parser.add_argument('--run-backend', help=argparse.SUPPRESS)
+    parser.add_argument('--output', help='结果 JSON 文件路径，默认输出到标准输出')
+    args = parser.parse_args()
+
+    configure_cpu(num_threads=args.threads)
+    samples = load_dataset(args.dataset)
+    if not samples:
+        parser.error(f'{args.dataset} 中没有找到带 .txt 参考文本的音频')
+
+    if args.run_backend:
+        print(json.dumps(run_backend(args.run_backend, samples, args), ensure_ascii=False))
+        return
+
+    import subprocess
+    report = {'python': platform.python_version(), 'platform': platform.platform(),
+              'cpu_count': os.cpu_count(), 'threads': args.threads, 'batch_size': args.batch_size,
+              'files': len(samples), 'results': []}
+    for name in args.backends:
+        print(f'运行 {name}...', file=sys.stderr)
+        # 每个后端一个子进程，峰值内存和线程池互不影响
+        command = [sys.executable, os.path.abspath(__file__), '--run-backend', name,
+                   '--dataset', args.dataset, '--threads', str(args.threads),
+                   '--batch-size', str(args.batch_size), '--segment-seconds', str(args.segment_seconds),
+                   '--onnx-model', args.onnx_model]
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode != 0:
+            print(result.stderr, file=sys.stderr)
+            report['results'].append({'backend': name, 'error': result.stderr[-2000:]})
+            continue
+        entry = json.loads(result.stdout.strip().splitlines()[-1])
+        report['results'].append(entry)
+        print(json.dumps({k: entry[k] for k in ('backend', 'rtf', 'cer', 'peak_rss_mb')}), file=sys.stderr)
+
+    baseline = next((r for r in report['results'] if r['backend'] == 'torch' and r.get('rtf')), None)
+    if baseline:
+        for entry in report['results']:
+            if entry.get('rtf'):
+                entry['speedup_vs_torch'] = round(baseline['rtf'] / entry['rtf'], 2)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,344 @@
+"""转录流程离线基准测试
+
+生成不同时长、采样率、声道数和格式的合成音视频，用模拟推理耗时的假模型代替 AutoModel，
+不需要网络和模型下载。分别统计 decode_audio、split_audio、transcribe_audio 和
+Flask 接口（上传、提交转录并等待完成、命中缓存的重复请求）的耗时、吞吐、实时率和峰值内存，
+结果输出为 JSON，可以与之前提交的结果对比，发现性能退化。
+
+用法：
+    python benchmarks/bench_pipeline.py --durations 60 10m --rates 44100 48000 --channels 2 \\
+        --formats wav mp3 mp4 --output bench_pipeline.json
+    python benchmarks/bench_pipeline.py --compare bench_pipeline.json --threshold 0.2
+
+时长支持秒数或 10m、3h 这样的写法；mp3/mp4 夹具需要系统中有 ffmpeg。
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import soundfile as sf
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeAutoModel:
+    """模拟 AutoModel.generate：按音频时长 * rtf 加上每批固定开销来 sleep，返回与真实模型相同结构的结果"""
+
+    def __init__(self, rtf=0.02, batch_overhead=0.01):
+        self.rtf = rtf
+        self.batch_overhead = batch_overhead
+        self.calls = 0
+
+    def generate(self, input=None, fs=16000, **kwargs):
+        items = input if isinstance(input, list) else [input]
+        seconds = 0.0
+        for item in items:
+            if isinstance(item, str):
+                seconds += sf.info(item).duration
+            else:
+                seconds += len(item) / fs
+        self.calls += 1
+        time.sleep(self.batch_overhead + seconds * self.rtf)
+        return [{'key': f'bench_{i}', 'text': '测试文本'} for i in range(len(items))]
+
+
+def parse_duration(text):
+    text = str(text).strip().lower()
+    units = {'s': 1, 'm': 60, 'h': 3600}
+    if text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(float(text))
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return round(peak / 1024 / (1024 if sys.platform == 'darwin' else 1), 1)
+
+
+def make_wav_fixture(path, seconds, sr, channels, seed=0):
+    """类语音的合成音频：带调幅的谐波片段和停顿交替（约三分之一是静音），分块写入"""
+    rng = np.random.default_rng(seed)
+    with sf.SoundFile(path, 'w', samplerate=sr, channels=channels, subtype='PCM_16') as f:
+        written = 0
+        total = seconds * sr
+        while written < total:
+            n = min(total - written, int(sr * rng.uniform(1, 6)))
+            t = np.arange(n) / sr
+            f0 = rng.uniform(100, 250)
+            burst = sum(np.sin(2 * np.pi * f0 * k * t) / k for k in range(1, 5))
+            burst *= 0.2 * (0.6 + 0.4 * np.sin(2 * np.pi * 4 * t))
+            block = burst[:, None] + 0.003 * rng.standard_normal((n, channels))
+            f.write(block.astype(np.float32))
+            written += n
+
+            n = min(total - written, int(sr * rng.uniform(0.3, 3)))
+            if n > 0:
+                f.write((0.003 * rng.standard_normal((n, channels))).astype(np.float32))
+                written += n
+
+
+def make_fixture(directory, seconds, sr, channels, fmt):
+    wav_path = os.path.join(directory, f'bench_{seconds}s_{sr}_{channels}ch.wav')
+    if not os.path.exists(wav_path):
+        make_wav_fixture(wav_path, seconds, sr, channels)
+    if fmt == 'wav':
+        return wav_path
+
+    out_path = os.path.splitext(wav_path)[0] + f'.{fmt}'
+    if os.path.exists(out_path):
+        return out_path
+    if fmt == 'mp3':
+        command = ['ffmpeg', '-y', '-loglevel', 'error', '-i', wav_path,
+                   '-codec:a', 'libmp3lame', '-q:a', '2', out_path]
+    elif fmt == 'mp4':
+        command = ['ffmpeg', '-y', '-loglevel', 'error',
+                   '-f', 'lavfi', '-i', 'color=c=black:s=320x240:r=5', '-i', wav_path,
+                   '-shortest', '-c:v', 'libx264', '-preset', 'ultrafast', '-c:a', 'aac', out_path]
+    else:
+        raise ValueError(f'不支持的格式: {fmt}')
+    subprocess.run(command, check=True)
+    return out_path
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def stage_result(seconds, audio_seconds, nbytes=None):
+    result = {
+        'seconds': round(seconds, 4),
+        'x_realtime': round(audio_seconds / seconds, 2) if seconds > 0 else None,
+        'rtf': round(seconds / audio_seconds, 5)
+    }
+    if nbytes is not None and seconds > 0:
+        result['mb_per_s'] = round(nbytes / seconds / 1024 / 1024, 2)
+    return result
+
+
+def wait_for_job(client, job_id, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = client.get(f'/jobs/{job_id}').get_json()
+        if job['status'] in ('complete', 'error', 'cancelled'):
+            return job
+        time.sleep(0.05)
+    raise TimeoutError(f'任务超时: {job_id}')
+
+
+def run_case(case):
+    """在独立的工作目录和进程中运行一个测试用例"""
+    workdir = tempfile.mkdtemp(prefix='localweb_bench_')
+    os.chdir(workdir)
+    # server 模式下导入 app 不会加载真实模型，随后替换成假模型
+    os.environ['INFERENCE_MODE'] = 'server'
+    os.environ['MODEL_SERVER_ADDRESS'] = os.path.join(workdir, 'no-model-server.sock')
+    os.environ['JOB_WORKERS'] = '1'
+    os.environ['LOCALWEB_DB'] = os.path.join(workdir, 'bench.db')
+    sys.path.insert(0, REPO_ROOT)
+
+    import_seconds, app = timed(__import__, 'app')
+    app.inference_pipeline = FakeAutoModel(case['fake_rtf'], case['fake_batch_overhead'])
+    rss_after_import = peak_rss_mb()
+
+    fixture = case['fixture']
+    name = os.path.basename(fixture)
+    source = os.path.join(app.app.config['UPLOAD_FOLDER'], name)
+    shutil.copyfile(fixture, source)
+    audio_seconds = case['duration']
+    nbytes = os.path.getsize(fixture)
+    stages = {}
+
+    sr = 16000
+    seconds, data = timed(app.decode_audio, source, sr)
+    stages['decode_audio'] = stage_result(seconds, audio_seconds, nbytes)
+
+    seconds, segments = timed(app.split_audio, data, sr)
+    stages['split_audio'] = stage_result(seconds, audio_seconds)
+    stages['split_audio']['segments'] = len(segments)
+    stages['split_audio']['speech_ratio'] = round(
+        sum(end - start for start, end, _ in segments) / audio_seconds, 3)
+    del data, segments
+
+    seconds, _ = timed(app.transcribe_audio, source, 'bench', source)
+    stages['transcribe_audio'] = stage_result(seconds, audio_seconds, nbytes)
+
+    # transcribe_audio 已保存解码后的 PCM，再次读取只是映射文件
+    seconds, _ = timed(app.PcmStore.load, source)
+    stages['pcm_store_hit'] = {'seconds': round(seconds, 4)}
+
+    # 清空缓存，下面的接口测试走完整流程
+    db = app.get_db()
+    db.execute('DELETE FROM transcript_cache')
+    db.execute('DELETE FROM pcm_store')
+    db.execute('DELETE FROM file_index')
+
+    client = app.app.test_client()
+    upload_name = 'upload_' + name
+    with open(fixture, 'rb') as f:
+        seconds, response = timed(client.post, '/upload', data={'file': (f, upload_name)},
+                                  content_type='multipart/form-data')
+    assert response.status_code == 200, response.get_data(as_text=True)
+    stages['http_upload'] = stage_result(seconds, audio_seconds, nbytes)
+
+    start = time.perf_counter()
+    response = client.post(f'/transcribe-audio/{upload_name}')
+    assert response.status_code == 202, response.get_data(as_text=True)
+    job = wait_for_job(client, response.get_json()['job_id'], timeout=max(600, audio_seconds * 2))
+    assert job['status'] == 'complete', job
+    stages['http_transcribe'] = stage_result(time.perf_counter() - start, audio_seconds, nbytes)
+    stages['http_transcribe']['job_timings'] = job.get('timings')
+
+    seconds, response = timed(client.post, f'/transcribe-audio/{upload_name}')
+    assert response.status_code == 200 and 'transcript' in response.get_json()
+    stages['http_transcribe_cached'] = {'seconds': round(seconds, 4)}
+
+    return {
+        'case': case['name'],
+        'format': case['format'],
+        'duration_s': audio_seconds,
+        'sample_rate': case['sample_rate'],
+        'channels': case['channels'],
+        'fixture_mb': round(nbytes / 1024 / 1024, 1),
+        'import_seconds': round(import_seconds, 3),
+        'stages': stages,
+        'rss_after_import_mb': rss_after_import,
+        'peak_rss_mb': peak_rss_mb(),
+        'model_calls': app.inference_pipeline.calls
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(report, baseline, threshold):
+    """逐个用例、逐个阶段比较耗时，慢于基线超过 threshold 比例的视为退化"""
+    regressions = []
+    previous = {entry['case']: entry for entry in baseline.get('cases', [])}
+    for entry in report['cases']:
+        old = previous.get(entry['case'])
+        if not old:
+            continue
+        for stage, result in entry['stages'].items():
+            old_result = old['stages'].get(stage)
+            if not old_result or not old_result.get('seconds'):
+                continue
+            change = result['seconds'] / old_result['seconds'] - 1
+            if change > threshold:
+                regressions.append({'case': entry['case'], 'stage': stage,
+                                    'baseline_s': old_result['seconds'], 'current_s': result['seconds'],
+                                    'change': round(change, 3)})
+        if old.get('peak_rss_mb') and entry.get('peak_rss_mb'):
+            change = entry['peak_rss_mb'] / old['peak_rss_mb'] - 1
+            if change > threshold:
+                regressions.append({'case': entry['case'], 'stage': 'peak_rss_mb',
+                                    'baseline': old['peak_rss_mb'], 'current': entry['peak_rss_mb'],
+                                    'change': round(change, 3)})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--durations', nargs='+', default=['60', '10m'], help='音频时长，如 60、10m、3h')
+    parser.add_argument('--rates', type=int, nargs='+', default=[44100, 48000])
+    parser.add_argument('--channels', type=int, nargs='+', default=[2])
+    parser.add_argument('--formats', nargs='+', default=['wav', 'mp3', 'mp4'])
+    parser.add_argument('--fake-rtf', type=float, default=0.02, help='假模型的实时率（推理耗时 / 音频时长）')
+    parser.add_argument('--fake-batch-overhead', type=float, default=0.01, help='假模型每批的固定耗时（秒）')
+    parser.add_argument('--fixtures-dir', help='夹具目录，默认使用临时目录，指定后可在多次运行间复用')
+    parser.add_argument('--output', help='结果 JSON 文件路径，默认输出到标准输出')
+    parser.add_argument('--compare', help='与之前的结果 JSON 比较')
+    parser.add_argument('--threshold', type=float, default=0.2, help='耗时增加超过该比例视为退化')
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        print(json.dumps(run_case(json.loads(args.run_case)), ensure_ascii=False))
+        return
+
+    formats = list(args.formats)
+    if not shutil.which('ffmpeg'):
+        skipped = [fmt for fmt in formats if fmt != 'wav']
+        if skipped:
+            print(f"未找到 ffmpeg，跳过格式: {', '.join(skipped)}", file=sys.stderr)
+        formats = [fmt for fmt in formats if fmt == 'wav']
+
+    fixtures_dir = args.fixtures_dir or tempfile.mkdtemp(prefix='localweb_fixtures_')
+    os.makedirs(fixtures_dir, exist_ok=True)
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'fake_rtf': args.fake_rtf,
+        'cases': []
+    }
+    try:
+        for duration in map(parse_duration, args.durations):
+            for sr in args.rates:
+                for channels in args.channels:
+                    for fmt in formats:
+                        case = {
+                            'name': f'{fmt}_{duration}s_{sr}_{channels}ch',
+                            'format': fmt,
+                            'duration': duration,
+                            'sample_rate': sr,
+                            'channels': channels,
+                            'fixture': make_fixture(fixtures_dir, duration, sr, channels, fmt),
+                            'fake_rtf': args.fake_rtf,
+                            'fake_batch_overhead': args.fake_batch_overhead
+                        }
+                        print(f"运行 {case['name']}...", file=sys.stderr)
+                        # 每个用例一个子进程，峰值内存互不影响
+                        result = subprocess.run(
+                            [sys.executable, os.path.abspath(__file__), '--run-case', json.dumps(case)],
+                            capture_output=True, text=True)
+                        if result.returncode != 0:
+                            print(result.stderr, file=sys.stderr)
+                            report['cases'].append({'case': case['name'], 'error': result.stderr[-2000:]})
+                            continue
+                        entry = json.loads(result.stdout.strip().splitlines()[-1])
+                        report['cases'].append(entry)
+                        print(json.dumps({'case': entry['case'], 'peak_rss_mb': entry['peak_rss_mb'],
+                                          'http_transcribe_s': entry['stages']['http_transcribe']['seconds']},
+                                         ensure_ascii=False), file=sys.stderr)
+    finally:
+        if not args.fixtures_dir:
+            shutil.rmtree(fixtures_dir, ignore_errors=True)
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            report['regressions'] = compare(report, json.load(f), args.threshold)
+        exit_code = 1 if report['regressions'] else 0
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""重采样基准测试：对比旧的 np.interp 线性插值路径和流式多相重采样的速度、峰值内存和混叠抑制
+
+用法：
+    python benchmarks/bench_resample.py --durations 60 600 --rates 44100 48000 --output bench_resample.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from resampler import resample, resample_file  # noqa: E402
+
+TARGET_RATE = 16000
+
+
+def legacy_convert(input_path, output_path, sample_rate=TARGET_RATE):
+    """原 convert_to_wav 的处理方式：整文件 float64 读入、np.mean 转单声道、np.interp 线性插值"""
+    data, sr = sf.read(input_path)
+    if len(data.shape) > 1:
+        data = np.mean(data, axis=1)
+    if sr != sample_rate:
+        new_length = int(len(data) * sample_rate / sr)
+        indices = np.linspace(0, len(data) - 1, new_length)
+        data = np.interp(indices, np.arange(len(data)), data)
+    sf.write(output_path, data, sample_rate)
+
+
+def legacy_resample(data, sr, sample_rate=TARGET_RATE):
+    new_length = int(len(data) * sample_rate / sr)
+    indices = np.linspace(0, len(data) - 1, new_length)
+    return np.interp(indices, np.arange(len(data)), data)
+
+
+def tone_amplitude(signal, freq, sr):
+    """用加窗 FFT 估计某个频率分量的幅度"""
+    window = np.hanning(len(signal))
+    spectrum = np.abs(np.fft.rfft(signal * window)) * 2 / window.sum()
+    bin_index = int(round(freq * len(signal) / sr))
+    return spectrum[max(0, bin_index - 2):bin_index + 3].max()
+
+
+def measure_quality(sr):
+    """混叠抑制：送入高于 8kHz 的正弦波，测量折叠到通带内的残留（相对带内 1kHz 正弦波）"""
+    seconds = 4
+    t = np.arange(sr * seconds) / sr
+    in_band = 0.5 * np.sin(2 * np.pi * 1000 * t)
+    out_freq = 11000 if sr > 22000 else sr * 0.45
+    alias_freq = abs(TARGET_RATE - out_freq) if out_freq > TARGET_RATE / 2 else out_freq
+    out_band = 0.5 * np.sin(2 * np.pi * out_freq * t)
+
+    results = {}
+    for name, fn in [('legacy_interp', lambda x: legacy_resample(x, sr)),
+                     ('polyphase', lambda x: resample(x.astype(np.float32), sr, TARGET_RATE))]:
+        ref = tone_amplitude(fn(in_band), 1000, TARGET_RATE)
+        alias = tone_amplitude(fn(out_band), alias_freq, TARGET_RATE)
+        results[name] = {
+            'passband_gain_db': round(20 * np.log10(ref / 0.5), 3),
+            'alias_db': round(20 * np.log10(max(alias, 1e-12) / ref), 1)
+        }
+    return results
+
+
+def measure_conversion(fn, input_path, output_path):
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn(input_path, output_path)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def make_fixture(path, seconds, sr, channels):
+    """分块写入立体声测试音频（正弦波加噪声），避免生成夹具本身占用大量内存"""
+    rng = np.random.default_rng(0)
+    block = sr * 10
+    with sf.SoundFile(path, 'w', samplerate=sr, channels=channels, subtype='PCM_16') as f:
+        for start in range(0, seconds * sr, block):
+            n = min(block, seconds * sr - start)
+            t = (start + np.arange(n)) / sr
+            tone = 0.3 * np.sin(2 * np.pi * 440 * t)
+            data = tone[:, None] + 0.05 * rng.standard_normal((n, channels))
+            f.write(data.astype(np.float32))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--durations', type=int, nargs='+', default=[60, 600], help='测试音频时长（秒）')
+    parser.add_argument('--rates', type=int, nargs='+', default=[44100, 48000], help='输入采样率')
+    parser.add_argument('--channels', type=int, default=2)
+    parser.add_argument('--output', help='结果 JSON 文件路径，默认输出到标准输出')
+    args = parser.parse_args()
+
+    report = {'target_rate': TARGET_RATE, 'quality': {}, 'conversion': []}
+    for sr in args.rates:
+        report['quality'][str(sr)] = measure_quality(sr)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for sr in args.rates:
+            for seconds in args.durations:
+                src = os.path.join(tmp, f'src_{sr}_{seconds}.wav')
+                make_fixture(src, seconds, sr, args.channels)
+                entry = {'sample_rate': sr, 'channels': args.channels, 'duration_s': seconds}
+                for name, fn in [('legacy_interp', legacy_convert), ('polyphase_stream', resample_file)]:
+                    elapsed, peak = measure_conversion(fn, src, os.path.join(tmp, f'out_{name}.wav'))
+                    entry[name] = {
+                        'seconds': round(elapsed, 3),
+                        'realtime_factor': round(elapsed / seconds, 5),
+                        'peak_python_mb': round(peak / 1024 / 1024, 1)
+                    }
+                report['conversion'].append(entry)
+                os.remove(src)
+                print(json.dumps(entry, ensure_ascii=False), file=sys.stderr)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
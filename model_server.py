@@ -0,0 +1,455 @@
+"""语音识别模型服务
+
+单独的进程持有模型，gunicorn 的各个 Web 进程通过本地 socket 调用，
+HTTP 进程数增加时模型内存不随之增加。
+
+启动：
+    python model_server.py
+
+环境变量：
+    MODEL_SERVER_ADDRESS   监听地址，host:port 或 Unix socket 路径（默认 127.0.0.1:6007）
+    MODEL_SERVER_AUTHKEY   连接认证密钥，服务端和 Web 进程必须一致；监听非本机地址时必须设置
+    MODEL_SERVER_REPLICAS  模型副本数，可同时处理的推理请求数（默认 1）
+    TORCH_NUM_THREADS      每个进程的 torch 计算线程数
+    TORCH_INTEROP_THREADS  torch 算子间并行线程数
+    CPU_AFFINITY           绑定的 CPU 核，例如 "0-3,6"
+    MODEL_WARMUP           设为 0 时加载后不做预热推理
+    INFERENCE_BACKEND      torch（默认）或 onnx
+    ASR_ONNX_MODEL         onnx 后端的模型 ID 或本地目录
+    ASR_ONNX_QUANTIZE      onnx 后端是否使用 int8 量化模型（默认 1）
+    ONNX_INTRA_OP_THREADS  onnx 后端的算子内线程数（默认 TORCH_NUM_THREADS 或 CPU 核数）
+"""
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.connection import Listener, Client
+
+DEFAULT_ADDRESS = '127.0.0.1:6007'
+
+
+def parse_address(text):
+    """host:port 解析为 TCP 地址，否则视为 Unix socket 路径"""
+    host, sep, port = text.rpartition(':')
+    if sep and port.isdigit():
+        return host, int(port)
+    return text
+
+
+def is_loopback_address(address):
+    """Unix socket 和 127.0.0.0/8、::1、localhost 只有本机进程能连接"""
+    if isinstance(address, str):
+        return True
+    host = address[0]
+    return host in ('localhost', '::1') or host.startswith('127.')
+
+
+def load_authkey(address):
+    """读取 MODEL_SERVER_AUTHKEY
+
+    连接上传输的是 pickle，能连接的一方可以在服务进程中执行任意代码，因此监听非本机地址时必须显式设置密钥，
+    没有默认值；只监听本机地址时未设置则不做认证。
+    """
+    authkey = os.environ.get('MODEL_SERVER_AUTHKEY')
+    if authkey:
+        return authkey.encode('utf-8')
+    if not is_loopback_address(address):
+        raise RuntimeError(f'监听地址 {address} 不是本机地址，必须设置 MODEL_SERVER_AUTHKEY')
+    print("警告：未设置 MODEL_SERVER_AUTHKEY，本机的其他进程可以不经认证连接模型服务")
+    return None
+
+
+def parse_cpu_list(text):
+    """把 "0-3,6" 解析为 {0, 1, 2, 3, 6}"""
+    cpus = set()
+    for part in text.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-', 1)
+            cpus.update(range(int(start), int(end) + 1))
+        else:
+            cpus.add(int(part))
+    return cpus
+
+
+def configure_cpu(num_threads=None, interop_threads=None, affinity=None):
+    """设置 CPU 亲和性和 torch 线程数，避免多个推理进程争抢同一批核"""
+    if affinity and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, parse_cpu_list(affinity))
+        print(f"CPU 亲和性: {sorted(os.sched_getaffinity(0))}")
+    try:
+        import torch
+    except ImportError:
+        # 只用 onnx 后端时可以不安装 torch
+        return
+    if num_threads:
+        torch.set_num_threads(int(num_threads))
+    if interop_threads:
+        try:
+            torch.set_num_interop_threads(int(interop_threads))
+        except RuntimeError as e:
+            # 只能在第一次并行计算之前设置
+            print(f"设置 torch 算子间线程数失败: {str(e)}")
+    print(f"torch 线程数: {torch.get_num_threads()}")
+
+
+def configure_cpu_from_env():
+    configure_cpu(os.environ.get('TORCH_NUM_THREADS'),
+                  os.environ.get('TORCH_INTEROP_THREADS'),
+                  os.environ.get('CPU_AFFINITY'))
+
+
+def detect_memory_limit():
+    """容器的内存上限（cgroup v2/v1），没有限制时返回物理内存大小（字节），无法获取时返回 None"""
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        # 没有限制时 v2 为 "max"，v1 为一个接近 2^63 的数
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value)
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+DEFAULT_ONNX_MODEL = 'iic/speech_paraformer-large_asr_nat-zh-cn-16k-common-vocab8404-pytorch'
+
+
+class OnnxAsrModel:
+    """ONNX Runtime 推理的 Paraformer，generate 的参数和返回值与 AutoModel 一致
+
+    模型目录中没有导出的 ONNX 文件时，funasr_onnx 会在第一次加载时自动导出（需要安装 funasr 和 torch），
+    quantize=True 使用 int8 动态量化的 model_quant.onnx。
+    """
+
+    def __init__(self, model_dir=DEFAULT_ONNX_MODEL, batch_size=4, quantize=True, intra_op_threads=None):
+        from funasr_onnx import Paraformer
+
+        self.model = Paraformer(model_dir, batch_size=batch_size, quantize=quantize,
+                                intra_op_num_threads=int(intra_op_threads or os.cpu_count() or 4))
+
+    def generate(self, input=None, fs=16000, **kwargs):
+        """逐个片段调用 Paraformer，返回与输入一一对应的结果
+
+        funasr_onnx 把列表输入当作文件路径逐个读取，因此每次只传一个 ndarray；
+        某个片段推理失败（静音、过短等触发 ONNXRuntimeError）时该片段的文本为空，不影响其他片段。
+        """
+        import numpy as np
+        try:
+            from onnxruntime.capi.onnxruntime_pybind11_state import Fail as ONNXRuntimeError
+        except ImportError:
+            ONNXRuntimeError = RuntimeError
+
+        if fs != 16000:
+            raise ValueError(f'ONNX 模型只支持 16kHz 输入，收到 {fs}Hz')
+        items = input if isinstance(input, list) else [input]
+        results = []
+        for i, item in enumerate(items):
+            waveform = item if isinstance(item, str) else np.asarray(item, dtype=np.float32)
+            try:
+                output = self.model(waveform)
+            except ONNXRuntimeError as e:
+                print(f"ONNX 推理失败，片段 {i} 的结果为空: {str(e)}")
+                output = []
+            text = output[0].get('preds', '') if output else ''
+            if isinstance(text, (list, tuple)):
+                # 部分版本返回 (文本, 词列表)
+                text = text[0] if text else ''
+            results.append({'key': f'onnx_{i}', 'text': text})
+        return results
+
+
+def build_asr_model(model='paraformer-zh', model_revision='v2.0.4', batch_size=4, beam_size=1,
+                    backend='torch', onnx_model=DEFAULT_ONNX_MODEL, quantize=True, intra_op_threads=None):
+    """创建语音识别模型：backend 为 torch 时使用 FunASR AutoModel，为 onnx 时使用 ONNX Runtime（仅 CPU）"""
+    if backend == 'onnx':
+        print(f"使用 ONNX Runtime 后端: {onnx_model}（{'int8 量化' if quantize else 'float32'}）")
+        return OnnxAsrModel(onnx_model, batch_size=batch_size, quantize=quantize,
+                            intra_op_threads=intra_op_threads)
+    if backend != 'torch':
+        raise ValueError(f'未知的推理后端: {backend}')
+
+    import torch
+    from funasr import AutoModel
+
+    asr_model = AutoModel(
+        model=model,
+        model_revision=model_revision,
+        device="cuda" if torch.cuda.is_available() else "cpu",
+        batch_size=batch_size,  # 批处理大小
+        num_workers=4,          # 增加工作进程数
+        beam_size=beam_size,    # 减小束搜索大小以提高速度
+        hotwords_path=None,     # 关闭热词功能以提高速度
+        continuous_decoding=True  # 启用连续解码
+    )
+    if not torch.cuda.is_available():
+        print("警告：未检测到GPU，将使用CPU进行推理")
+    return asr_model
+
+
+def warm_up_model(model, sample_rate=16000, seconds=1.0):
+    """用一段静音做一次推理，提前完成计算图初始化和内存分配，第一个真实请求不再变慢"""
+    import numpy as np
+
+    model.generate(input=[np.zeros(int(sample_rate * seconds), dtype=np.float32)],
+                   batch_size=1, fs=sample_rate)
+
+
+def build_vad_model():
+    """创建 FunASR 的 fsmn-vad 模型"""
+    import torch
+    from funasr import AutoModel
+
+    return AutoModel(model="fsmn-vad", model_revision="v2.0.4",
+                     device="cuda" if torch.cuda.is_available() else "cpu")
+
+
+def build_streaming_model(model='paraformer-zh-streaming', model_revision='v2.0.4'):
+    """创建 FunASR 的流式 Paraformer 模型，按块解码，编码器状态保存在调用方传入的 cache 中"""
+    import torch
+    from funasr import AutoModel
+
+    return AutoModel(model=model, model_revision=model_revision,
+                     device="cuda" if torch.cuda.is_available() else "cpu")
+
+
+def partition_cpus(cpus, parts):
+    """把 CPU 核按顺序平均分成 parts 组，相邻的核（通常共享缓存）分在同一组"""
+    cpus = sorted(cpus)
+    return [cpus[i * len(cpus) // parts:(i + 1) * len(cpus) // parts] for i in range(parts)]
+
+
+# 分片推理子进程中的模型
+_shard_model = None
+
+
+def _init_shard_worker(counter, cpu_groups, model_options, warmup):
+    """分片推理子进程初始化：按启动顺序领取一组 CPU 核并绑定，torch 线程数等于分到的核数，然后加载模型"""
+    global _shard_model
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+    cpus = cpu_groups[index % len(cpu_groups)]
+    configure_cpu(num_threads=len(cpus), interop_threads=1, affinity=','.join(str(cpu) for cpu in cpus))
+    options = dict(model_options)
+    if options.get('backend') == 'onnx':
+        options['intra_op_threads'] = len(cpus)
+    _shard_model = build_asr_model(**options)
+    if warmup:
+        warm_up_model(_shard_model)
+
+
+def _transcribe_shard(pcm_path, offset, total_samples, spans, sample_rate):
+    """在子进程中转录一批片段：映射 PCM 文件后按采样点位置切片，音频数据不经过进程间管道"""
+    import numpy as np
+
+    data = np.memmap(pcm_path, dtype=np.float32, mode='r', offset=offset, shape=(total_samples,))
+    start = time.perf_counter()
+    result = _shard_model.generate(input=[data[begin:end] for begin, end in spans],
+                                   batch_size=len(spans), fs=sample_rate)
+    return result, time.perf_counter() - start
+
+
+class ShardPool:
+    """把一个长音频的片段分给多个进程并行推理
+
+    每个进程持有自己的模型，CPU 核平均分给各进程并绑定亲和性，torch 线程数等于分到的核数，避免线程数超过核数。
+    音频以 PCM 文件路径和采样点范围传递，子进程用 np.memmap 映射，不复制音频数据。
+    """
+
+    def __init__(self, workers, model_options, cpus=None, warmup=True):
+        if cpus is None:
+            cpus = os.sched_getaffinity(0) if hasattr(os, 'sched_getaffinity') else range(os.cpu_count() or 1)
+        cpus = sorted(cpus)
+        self.workers = max(1, min(workers, len(cpus)))
+        self.cpu_groups = partition_cpus(cpus, self.workers)
+        # spawn：子进程不继承父进程中已加载的模型和线程
+        context = multiprocessing.get_context('spawn')
+        self.executor = ProcessPoolExecutor(
+            self.workers, mp_context=context, initializer=_init_shard_worker,
+            initargs=(context.Value('i', 0), self.cpu_groups, model_options, warmup))
+
+    def transcribe(self, pcm_path, offset, total_samples, batches, sample_rate=16000):
+        """batches 为若干批 [(起始采样点, 结束采样点)]，按完成顺序逐个返回 (批次序号, 模型结果, 推理耗时)
+
+        调用方提前停止迭代时（如任务取消），尚未开始的批次不再执行。
+        """
+        futures = {self.executor.submit(_transcribe_shard, pcm_path, offset, total_samples, spans, sample_rate): i
+                   for i, spans in enumerate(batches)}
+        try:
+            for future in as_completed(futures):
+                result, elapsed = future.result()
+                yield futures[future], result, elapsed
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class ModelServer:
+    """持有若干个模型副本，每个连接一个线程，推理时借用一个空闲副本
+
+    流式模型的 cache 不能跨进程传递，保存在服务端，按客户端给出的 cache_id 区分，最后一块（is_final）后释放。
+    """
+
+    def __init__(self, address, authkey, replicas=1, model_options=None, warmup=True):
+        self.address = address
+        self.authkey = authkey
+        self.model_options = model_options or {}
+        self.replicas = replicas
+        self.asr_models = queue.Queue()
+        for i in range(replicas):
+            print(f"正在加载语音识别模型副本 {i + 1}/{replicas}...")
+            model = build_asr_model(**self.model_options)
+            if warmup:
+                warm_up_model(model)
+            self.asr_models.put(model)
+        self.vad_model = None
+        self.vad_lock = threading.Lock()
+        self.streaming_model = None
+        self.streaming_caches = {}
+        self.streaming_lock = threading.Lock()
+        print("语音识别模型加载完成")
+
+    def generate(self, name, kwargs):
+        if name == 'vad':
+            with self.vad_lock:
+                if self.vad_model is None:
+                    print("正在加载 VAD 模型...")
+                    self.vad_model = build_vad_model()
+                return self.vad_model.generate(**kwargs)
+
+        if name == 'streaming':
+            with self.streaming_lock:
+                if self.streaming_model is None:
+                    print("正在加载流式识别模型...")
+                    self.streaming_model = build_streaming_model(
+                        os.environ.get('STREAMING_MODEL', 'paraformer-zh-streaming'),
+                        os.environ.get('STREAMING_MODEL_REVISION', 'v2.0.4'))
+                cache_id = kwargs.pop('cache_id')
+                cache = self.streaming_caches.setdefault(cache_id, {})
+                try:
+                    return self.streaming_model.generate(cache=cache, **kwargs)
+                finally:
+                    if kwargs.get('is_final'):
+                        self.streaming_caches.pop(cache_id, None)
+
+        model = self.asr_models.get()
+        try:
+            return model.generate(**kwargs)
+        finally:
+            self.asr_models.put(model)
+
+    def handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    op, name, kwargs = conn.recv()
+                except (EOFError, OSError):
+                    break
+                try:
+                    if op == 'ping':
+                        result = {'pid': os.getpid(), 'replicas': self.replicas,
+                                  'model': self.model_options.get('model')}
+                    elif op == 'generate':
+                        result = self.generate(name, kwargs)
+                    elif op == 'release':
+                        # 流式连接异常断开时释放服务端的 cache
+                        with self.streaming_lock:
+                            result = self.streaming_caches.pop(kwargs['cache_id'], None) is not None
+                    else:
+                        raise ValueError(f'未知操作: {op}')
+                    conn.send(('ok', result))
+                except Exception as e:
+                    print(f"推理请求失败: {str(e)}")
+                    conn.send(('error', str(e)))
+
+    def serve_forever(self):
+        with Listener(self.address, authkey=self.authkey) as listener:
+            print(f"模型服务已启动: {self.address}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    print(f"接受连接失败: {str(e)}")
+                    continue
+                threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+
+class ModelClient:
+    """模型服务的客户端，接口与 AutoModel.generate 一致，每个线程使用各自的连接"""
+
+    def __init__(self, address, authkey, name='asr'):
+        self.address = address
+        self.authkey = authkey
+        self.name = name
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = Client(self.address, authkey=self.authkey)
+            self._local.conn = conn
+        return conn
+
+    def _call(self, op, kwargs):
+        # 模型服务重启后旧连接失效，重连一次
+        for attempt in range(2):
+            try:
+                conn = self._connection()
+                conn.send((op, self.name, kwargs))
+                status, payload = conn.recv()
+                break
+            except (EOFError, OSError):
+                self._local.conn = None
+                if attempt:
+                    raise
+        if status == 'error':
+            raise Exception(f"模型服务推理失败: {payload}")
+        return payload
+
+    def ping(self):
+        return self._call('ping', {})
+
+    def generate(self, **kwargs):
+        return self._call('generate', kwargs)
+
+    def release(self, cache_id):
+        return self._call('release', {'cache_id': cache_id})
+
+
+def main():
+    address = parse_address(os.environ.get('MODEL_SERVER_ADDRESS', DEFAULT_ADDRESS))
+    # 先检查密钥再加载模型，配置错误时立即退出
+    authkey = load_authkey(address)
+    configure_cpu_from_env()
+    server = ModelServer(
+        address,
+        authkey,
+        replicas=int(os.environ.get('MODEL_SERVER_REPLICAS', 1)),
+        model_options={
+            'model': os.environ.get('ASR_MODEL', 'paraformer-zh'),
+            'model_revision': os.environ.get('ASR_MODEL_REVISION', 'v2.0.4'),
+            'batch_size': int(os.environ.get('TRANSCRIBE_BATCH_SIZE', 4)),
+            'beam_size': 1,
+            'backend': os.environ.get('INFERENCE_BACKEND', 'torch'),
+            'onnx_model': os.environ.get('ASR_ONNX_MODEL', DEFAULT_ONNX_MODEL),
+            'quantize': os.environ.get('ASR_ONNX_QUANTIZE', '1') != '0',
+            'intra_op_threads': os.environ.get('ONNX_INTRA_OP_THREADS') or os.environ.get('TORCH_NUM_THREADS')
+        },
+        warmup=os.environ.get('MODEL_WARMUP', '1') != '0')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+"""流式多相重采样：按有理数比例（如 44100→16000、48000→16000）分块处理 float32 音频，内存占用只与块大小有关"""
+import math
+import time
+
+import numpy as np
+import soundfile as sf
+
+
+def design_lowpass(up, down, zero_crossings=12, rolloff=0.92, beta=7.0):
+    """设计 Kaiser 窗 sinc 低通滤波器，截止频率取上下采样后较低的奈奎斯特频率"""
+    max_rate = max(up, down)
+    cutoff = rolloff / max_rate  # 相对上采样后奈奎斯特频率的归一化截止频率
+    half_len = int(math.ceil(zero_crossings / cutoff))
+    n = np.arange(-half_len, half_len + 1)
+    h = cutoff * np.sinc(cutoff * n) * np.kaiser(2 * half_len + 1, beta)
+    # 插零上采样会把增益降为 1/up，这里补回来
+    return h * up, half_len
+
+
+class PolyphaseResampler:
+    """有理数比例多相重采样器
+
+    输出第 n 个采样对应上采样序列中的位置 t = n * down + half_len，
+    只需计算 t 处的滤波结果：y[n] = sum_k h[t % up + k * up] * x[t // up - k]。
+    process() 可以反复调用，每次送入一块单声道 float32 数据，最后调用 flush() 取出剩余输出。
+    """
+
+    def __init__(self, sr_in, sr_out, max_block_outputs=8192):
+        g = math.gcd(int(sr_in), int(sr_out))
+        self.up = int(sr_out) // g
+        self.down = int(sr_in) // g
+        self.max_block_outputs = max_block_outputs
+
+        h, self.half_len = design_lowpass(self.up, self.down)
+        self.taps = int(math.ceil(len(h) / self.up))
+        padded = np.zeros(self.up * self.taps, dtype=np.float64)
+        padded[:len(h)] = h
+        # phases[p, j] = h[p + (taps - 1 - j) * up]，与输入窗口 x[i - taps + 1 .. i] 逐元素相乘
+        self.phases = np.ascontiguousarray(
+            padded.reshape(self.taps, self.up).T[:, ::-1], dtype=np.float32)
+
+        # 缓冲区前面补 taps - 1 个零，第一个输出也有完整的输入窗口
+        self._buf = np.zeros(self.taps - 1, dtype=np.float32)
+        self._buf_start = -(self.taps - 1)  # 缓冲区第一个元素对应的输入下标
+        self._n_in = 0
+        self._n_out = 0
+
+    def _input_index(self, n):
+        return (n * self.down + self.half_len) // self.up
+
+    def _emit(self, n_end):
+        """计算输出 [_n_out, n_end)，要求所需输入都已在缓冲区中"""
+        out = []
+        windows = np.lib.stride_tricks.sliding_window_view(self._buf, self.taps)
+        while self._n_out < n_end:
+            stop = min(n_end, self._n_out + self.max_block_outputs)
+            t = np.arange(self._n_out, stop, dtype=np.int64) * self.down + self.half_len
+            rows = t // self.up - self.taps + 1 - self._buf_start
+            out.append(np.einsum('ij,ij->i', windows[rows], self.phases[t % self.up]))
+            self._n_out = stop
+
+        # 丢弃之后不再需要的输入
+        keep_from = self._input_index(self._n_out) - self.taps + 1
+        drop = max(0, keep_from - self._buf_start)
+        if drop:
+            self._buf = self._buf[drop:]
+            self._buf_start += drop
+
+        if not out:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate(out).astype(np.float32, copy=False)
+
+    def process(self, block):
+        """送入一块单声道数据，返回已经可以确定的输出"""
+        block = np.asarray(block, dtype=np.float32)
+        if self.up == self.down:
+            return block
+        self._buf = np.concatenate([self._buf, block])
+        self._n_in += len(block)
+
+        # 输出 n 需要输入到 t // up 为止
+        numerator = self._n_in * self.up - 1 - self.half_len
+        n_end = numerator // self.down + 1 if numerator >= 0 else 0
+        return self._emit(n_end)
+
+    def flush(self):
+        """输入结束，补零计算剩余输出"""
+        if self.up == self.down:
+            return np.zeros(0, dtype=np.float32)
+        total = -(-self._n_in * self.up // self.down)  # ceil(n_in * up / down)
+        if total <= self._n_out:
+            return np.zeros(0, dtype=np.float32)
+        last_needed = self._input_index(total - 1)
+        pad = last_needed + 1 - (self._buf_start + len(self._buf))
+        if pad > 0:
+            self._buf = np.concatenate([self._buf, np.zeros(pad, dtype=np.float32)])
+        return self._emit(total)
+
+
+def resample(data, sr_in, sr_out):
+    """一次性重采样整段单声道数据"""
+    resampler = PolyphaseResampler(sr_in, sr_out)
+    return np.concatenate([resampler.process(data), resampler.flush()])
+
+
+def load_resampled(input_path, sample_rate=16000, blocksize=65536, timings=None, output=None):
+    """分块读取音频文件，转为单声道并重采样，返回 (float32 数组, 原始采样率)
+
+    timings 为字典时累加 decode（读取解码）和 resample（转单声道和重采样）耗时（秒）。
+    output 为二进制文件对象时每块结果直接写入其中，不在内存中拼接整段音频，返回 (采样点数, 原始采样率)。
+    """
+    elapsed = {'decode': 0.0, 'resample': 0.0}
+    chunks = []
+    written = 0
+    with sf.SoundFile(input_path) as src:
+        sr = src.samplerate
+        resampler = PolyphaseResampler(sr, sample_rate) if sr != sample_rate else None
+        blocks = src.blocks(blocksize=blocksize, dtype='float32', always_2d=True)
+        while True:
+            t0 = time.perf_counter()
+            block = next(blocks, None)
+            t1 = time.perf_counter()
+            elapsed['decode'] += t1 - t0
+            if block is None:
+                mono = resampler.flush() if resampler is not None else None
+            else:
+                mono = block.mean(axis=1, dtype=np.float32) if block.shape[1] > 1 else block[:, 0].copy()
+                if resampler is not None:
+                    mono = resampler.process(mono)
+            if mono is not None and len(mono):
+                # 滤波后可能略微超出 [-1, 1]
+                np.clip(mono, -1.0, 1.0, out=mono)
+                if output is not None:
+                    output.write(mono.tobytes())
+                    written += len(mono)
+                else:
+                    chunks.append(mono)
+            elapsed['resample'] += time.perf_counter() - t1
+            if block is None:
+                break
+    if timings is not None:
+        for stage, seconds in elapsed.items():
+            timings[stage] = timings.get(stage, 0.0) + seconds
+    if output is not None:
+        return written, sr
+    data = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.float32)
+    return data, sr
+
+
+def resample_file(input_path, output_path, sample_rate=16000, blocksize=65536, timings=None):
+    """分块读取音频文件，转为单声道并重采样后写成 16 位 WAV，返回原始采样率
+
+    timings 为字典时累加 decode（读取解码）、resample（转单声道和重采样）、write（写文件）各阶段耗时（秒）。
+    """
+    elapsed = {'decode': 0.0, 'resample': 0.0, 'write': 0.0}
+    with sf.SoundFile(input_path) as src:
+        sr = src.samplerate
+        resampler = PolyphaseResampler(sr, sample_rate) if sr != sample_rate else None
+        with sf.SoundFile(output_path, 'w', samplerate=sample_rate, channels=1,
+                          subtype='PCM_16') as dst:
+            blocks = src.blocks(blocksize=blocksize, dtype='float32', always_2d=True)
+            while True:
+                t0 = time.perf_counter()
+                block = next(blocks, None)
+                t1 = time.perf_counter()
+                elapsed['decode'] += t1 - t0
+                if block is None:
+                    mono = resampler.flush() if resampler is not None else None
+                else:
+                    mono = block.mean(axis=1, dtype=np.float32) if block.shape[1] > 1 else block[:, 0]
+                    if resampler is not None:
+                        mono = resampler.process(mono)
+                t2 = time.perf_counter()
+                elapsed['resample'] += t2 - t1
+                # 滤波后可能略微超出 [-1, 1]，写成 16 位整数前先截断
+                if mono is not None and len(mono):
+                    dst.write(np.clip(mono, -1.0, 1.0))
+                elapsed['write'] += time.perf_counter() - t2
+                if block is None:
+                    break
+    if timings is not None:
+        for stage, seconds in elapsed.items():
+            timings[stage] = timings.get(stage, 0.0) + seconds
+    return sr
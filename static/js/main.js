@@ -16,6 +16,9 @@ function copyToClipboard() {
         });
 }
 
+// 超过该大小的文件分块上传，支持失败后续传
+const CHUNKED_UPLOAD_THRESHOLD = 32 * 1024 * 1024;
+
 // 上传文件
 function uploadFile(event) {
     const file = event.target.files[0];
@@ -27,15 +30,25 @@ function uploadFile(event) {
             正在上传 ${file.name}...
         </div>`;
 
-    const formData = new FormData();
-    formData.append('file', file);
+    let upload;
+    if (file.size > CHUNKED_UPLOAD_THRESHOLD) {
+        upload = uploadInChunks(file);
+    } else {
+        const formData = new FormData();
+        formData.append('file', file);
 
-    fetch('/upload', {
-        method: 'POST',
-        body: formData
-    })
-    .then(response => response.json())
+        upload = fetch('/upload', {
+            method: 'POST',
+            body: formData
+        })
+        .then(response => response.json());
+    }
+
+    upload
     .then(data => {
+        if (data.error) {
+            throw new Error(data.error);
+        }
         document.getElementById('uploadInfo').innerHTML = `
             <div class="alert alert-success">
                 文件 ${data.filename} 上传成功
@@ -51,6 +64,54 @@ function uploadFile(event) {
     });
 }
 
+// 分块上传大文件，每块失败时按服务器记录的位置重试
+async function uploadInChunks(file) {
+    const sessionResponse = await fetch('/upload/sessions', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ filename: file.name, size: file.size })
+    });
+    const session = await sessionResponse.json();
+    if (!sessionResponse.ok) {
+        throw new Error(session.error || '创建上传会话失败');
+    }
+
+    let offset = session.offset;
+    let retries = 0;
+    while (offset < file.size) {
+        const chunk = file.slice(offset, offset + session.chunk_size);
+        try {
+            const response = await fetch(`/upload/sessions/${session.upload_id}?offset=${offset}`, {
+                method: 'PUT',
+                headers: { 'Content-Type': 'application/octet-stream' },
+                body: chunk
+            });
+            const data = await response.json();
+            if (!response.ok && response.status !== 409) {
+                throw new Error(data.error || '上传失败');
+            }
+            // 409 表示位置不一致，以服务器记录的位置为准
+            offset = data.offset;
+            retries = 0;
+        } catch (error) {
+            if (++retries > 5) {
+                throw error;
+            }
+            await new Promise(resolve => setTimeout(resolve, 1000 * retries));
+            const status = await fetch(`/upload/sessions/${session.upload_id}`).then(r => r.json());
+            offset = status.offset;
+        }
+        const percent = Math.floor(offset * 100 / file.size);
+        document.getElementById('uploadInfo').innerHTML = `
+            <div class="alert alert-info">
+                正在上传 ${file.name}... ${percent}%
+            </div>`;
+    }
+
+    const response = await fetch(`/upload/sessions/${session.upload_id}/complete`, { method: 'POST' });
+    return response.json();
+}
+
 // 加载最近文件列表
 function loadRecentFiles() {
     fetch('/recent')
@@ -95,7 +156,8 @@ function previewFile(filename, type) {
     } else if (type.startsWith('video/')) {
         // 视频预览
         const video = document.createElement('video');
-        video.src = fullUrl;
+        // 大视频有低码率预览版本时使用预览版本
+        video.src = fullUrl + '?proxy=1';
         video.className = 'preview';
         video.controls = true;
         previewContent.appendChild(video);
@@ -234,14 +296,8 @@ function transcribeAudio(filename) {
     
     console.log('开始转录音频:', filename);
 
-    // 首先清除缓存
-    fetch(`/clear-transcript-cache/${filename}`)
-        .then(response => response.json())
-        .then(data => {
-            console.log('缓存清除结果:', data);
-            // 继续进行转录
-            return fetch(`/transcribe-audio/${filename}`);
-        })
+    // 提交转录任务；同一内容已有转录结果时服务端直接返回缓存
+    fetch(`/transcribe-audio/${filename}`, { method: 'POST' })
         .then(response => {
             console.log('收到响应:', response.status);
             if (!response.ok) {
@@ -252,42 +308,15 @@ function transcribeAudio(filename) {
             return response.json();
         })
         .then(data => {
-            console.log('转录成功:', data);
-            const container = document.getElementById('previewContainer');
-            
-            // 创建转录文本区域
-            const transcriptionSection = document.createElement('div');
-            transcriptionSection.className = 'transcription-section mt-4';
-            
-            // 设置转录文本区域的内容
-            transcriptionSection.innerHTML = `
-                <div class="alert alert-success">音频转录成功！</div>
-                <div class="card">
-                    <div class="card-header">
-                        <h5 class="mb-0">转录文本</h5>
-                    </div>
-                    <div class="card-body">
-                        <div class="text-content">
-                            ${data.transcript || data.text || '无转录结果'}
-                        </div>
-                        <div class="copy-container">
-                            <button class="btn btn-outline-secondary mt-3" onclick="copyTranscript('${data.transcript || data.text || ''}', this)">
-                                复制文本
-                            </button>
-                            <span class="copy-feedback"></span>
-                        </div>
-                    </div>
-                </div>
-            `;
-            
-            // 移除之前的转录文本区域（如果存在）
-            const existingTranscriptionSection = container.querySelector('.transcription-section');
-            if (existingTranscriptionSection) {
-                existingTranscriptionSection.remove();
+            // 命中缓存时直接返回结果，否则订阅任务事件流
+            if (data.job_id) {
+                return watchJob(data.job_id, transcribeBtn, data.waiter_token);
             }
-            
-            // 添加新的转录文本区域
-            container.appendChild(transcriptionSection);
+            return data;
+        })
+        .then(data => {
+            console.log('转录成功:', data);
+            showTranscript(data.transcript || data.text || '');
         })
         .catch(error => {
             console.error('转录失败:', error);
@@ -305,6 +334,241 @@ function transcribeAudio(filename) {
         });
 }
 
+// 通过事件流接收任务进度和已完成片段的文本，浏览器不支持或连接失败时改为轮询
+function watchJob(jobId, transcribeBtn, waiterToken) {
+    if (!window.EventSource) {
+        return waitForJob(jobId, transcribeBtn, waiterToken);
+    }
+    return new Promise((resolve, reject) => {
+        const segments = [];
+        const source = new EventSource(`/jobs/${jobId}/events${waiterQuery(waiterToken)}`);
+
+        source.addEventListener('progress', event => {
+            const job = JSON.parse(event.data);
+            if (transcribeBtn) {
+                transcribeBtn.textContent = job.status === 'queued'
+                    ? `排队中（前面还有 ${job.queue_position} 个任务）`
+                    : `转录中 ${job.progress}%`;
+            }
+        });
+        source.addEventListener('segment', event => {
+            segments.push(JSON.parse(event.data));
+            segments.sort((a, b) => a.start - b.start);
+            showPartialTranscript(segments);
+        });
+        source.addEventListener('complete', event => {
+            source.close();
+            resolve(JSON.parse(event.data));
+        });
+        source.addEventListener('error', event => {
+            // 服务端发送的 error 事件带有数据；连接错误没有数据，由浏览器自动重连
+            if (event.data) {
+                source.close();
+                reject(new Error(JSON.parse(event.data).error || '转录失败'));
+            } else if (source.readyState === EventSource.CLOSED) {
+                waitForJob(jobId, transcribeBtn, waiterToken).then(resolve, reject);
+            }
+        });
+        source.addEventListener('cancelled', () => {
+            source.close();
+            reject(new Error('任务已取消'));
+        });
+    });
+}
+
+// 显示已完成片段的转录文本
+function showPartialTranscript(segments) {
+    const container = document.getElementById('previewContainer');
+    let section = container.querySelector('.transcription-section');
+    if (!section || !section.classList.contains('partial')) {
+        if (section) {
+            section.remove();
+        }
+        section = document.createElement('div');
+        section.className = 'transcription-section partial mt-4';
+        section.innerHTML = `
+            <div class="alert alert-info">正在转录，以下为已完成的部分：</div>
+            <div class="card">
+                <div class="card-body">
+                    <div class="text-content"></div>
+                </div>
+            </div>
+        `;
+        container.appendChild(section);
+    }
+    section.querySelector('.text-content').textContent = segments.map(segment => segment.text).join(' ');
+}
+
+// 提交任务时返回的等待者令牌，取消后查询和事件流都以该请求的状态为准
+function waiterQuery(waiterToken) {
+    return waiterToken ? `?waiter=${encodeURIComponent(waiterToken)}` : '';
+}
+
+// 轮询转录任务直到完成
+function waitForJob(jobId, transcribeBtn, waiterToken) {
+    return new Promise((resolve, reject) => {
+        const poll = () => {
+            fetch(`/jobs/${jobId}${waiterQuery(waiterToken)}`)
+                .then(response => response.json())
+                .then(job => {
+                    if (job.status === 'complete') {
+                        resolve(job);
+                    } else if (job.status === 'error') {
+                        reject(new Error(job.error || '转录失败'));
+                    } else if (job.status === 'cancelled') {
+                        reject(new Error('任务已取消'));
+                    } else if (job.error && !job.status) {
+                        reject(new Error(job.error));
+                    } else {
+                        if (transcribeBtn) {
+                            transcribeBtn.textContent = job.status === 'queued'
+                                ? `排队中（前面还有 ${job.queue_position} 个任务）`
+                                : `转录中 ${job.progress}%`;
+                        }
+                        setTimeout(poll, 1000);
+                    }
+                })
+                .catch(reject);
+        };
+        poll();
+    });
+}
+
+// 显示转录文本
+function showTranscript(transcript) {
+    const container = document.getElementById('previewContainer');
+    
+    // 创建转录文本区域
+    const transcriptionSection = document.createElement('div');
+    transcriptionSection.className = 'transcription-section mt-4';
+    
+    // 设置转录文本区域的内容
+    transcriptionSection.innerHTML = `
+        <div class="alert alert-success">音频转录成功！</div>
+        <div class="card">
+            <div class="card-header">
+                <h5 class="mb-0">转录文本</h5>
+            </div>
+            <div class="card-body">
+                <div class="text-content">
+                    ${transcript || '无转录结果'}
+                </div>
+                <div class="copy-container">
+                    <button class="btn btn-outline-secondary mt-3" onclick="copyTranscript('${transcript}', this)">
+                        复制文本
+                    </button>
+                    <span class="copy-feedback"></span>
+                </div>
+            </div>
+        </div>
+    `;
+    
+    // 移除之前的转录文本区域（如果存在）
+    const existingTranscriptionSection = container.querySelector('.transcription-section');
+    if (existingTranscriptionSection) {
+        existingTranscriptionSection.remove();
+    }
+    
+    // 添加新的转录文本区域
+    container.appendChild(transcriptionSection);
+}
+
+// 实时转写：麦克风音频通过 WebSocket 发送，服务端边识别边返回文本
+let liveSession = null;
+
+function toggleLiveTranscription() {
+    if (liveSession) {
+        stopLiveTranscription();
+    } else {
+        startLiveTranscription();
+    }
+}
+
+async function startLiveTranscription() {
+    const liveBtn = document.getElementById('liveTranscribeBtn');
+    let stream;
+    try {
+        stream = await navigator.mediaDevices.getUserMedia({ audio: { channelCount: 1, echoCancellation: true } });
+    } catch (error) {
+        alert(`无法使用麦克风: ${error.message}`);
+        return;
+    }
+
+    const context = new AudioContext();
+    const source = context.createMediaStreamSource(stream);
+    const processor = context.createScriptProcessor(4096, 1, 1);
+    const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+    const socket = new WebSocket(`${protocol}//${window.location.host}/ws/transcribe`);
+    const session = { socket, stream, context, source, processor, sentMs: 0, processedMs: 0 };
+    liveSession = session;
+
+    document.getElementById('previewContainer').innerHTML = '';
+    liveBtn.textContent = '停止实时转写';
+    liveBtn.classList.replace('btn-outline-primary', 'btn-danger');
+
+    socket.onopen = () => {
+        // 使用浏览器的采样率发送 float32，服务端负责重采样
+        socket.send(JSON.stringify({ type: 'config', sample_rate: context.sampleRate, format: 'f32le' }));
+        processor.onaudioprocess = (event) => {
+            if (socket.readyState !== WebSocket.OPEN) {
+                return;
+            }
+            // 服务端识别跟不上或发送缓冲积压时丢弃这一帧，避免延迟越来越大
+            if (session.sentMs - session.processedMs > 3000 || socket.bufferedAmount > 1024 * 1024) {
+                return;
+            }
+            const samples = event.inputBuffer.getChannelData(0);
+            socket.send(samples.slice().buffer);
+            session.sentMs += samples.length * 1000 / context.sampleRate;
+        };
+        source.connect(processor);
+        processor.connect(context.destination);
+    };
+
+    socket.onmessage = (event) => {
+        const data = JSON.parse(event.data);
+        if (data.type === 'partial') {
+            session.processedMs = data.processed_ms;
+            showPartialTranscript([{ text: data.text }]);
+        } else if (data.type === 'final') {
+            showTranscript(data.text);
+        } else if (data.type === 'error') {
+            const errorMsg = document.createElement('div');
+            errorMsg.className = 'mt-3 alert alert-danger';
+            errorMsg.textContent = `实时转写失败: ${data.message}`;
+            document.getElementById('previewContainer').appendChild(errorMsg);
+        }
+    };
+
+    socket.onclose = () => releaseLiveAudio(session);
+}
+
+function stopLiveTranscription() {
+    const session = liveSession;
+    releaseLiveAudio(session);
+    // 通知服务端识别剩余音频，收到最终结果后服务端关闭连接
+    if (session.socket.readyState === WebSocket.OPEN) {
+        session.socket.send(JSON.stringify({ type: 'end' }));
+    }
+}
+
+function releaseLiveAudio(session) {
+    if (!session || session.released) {
+        return;
+    }
+    session.released = true;
+    session.processor.disconnect();
+    session.source.disconnect();
+    session.stream.getTracks().forEach(track => track.stop());
+    session.context.close();
+    if (liveSession === session) {
+        liveSession = null;
+    }
+    const liveBtn = document.getElementById('liveTranscribeBtn');
+    liveBtn.textContent = '实时转写';
+    liveBtn.classList.replace('btn-danger', 'btn-outline-primary');
+}
+
 // 清空最近文件列表
 function clearRecentFiles() {
     if (!confirm('确定要清空最近文件列表吗？')) {
@@ -0,0 +1,78 @@
+"""OnnxAsrModel.generate 的输入转换，用一个模拟 funasr_onnx.Paraformer 输入处理方式的替身代替真实模型
+
+运行：python -m unittest discover tests
+"""
+import os
+import sys
+import types
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import model_server  # noqa: E402
+
+try:
+    from onnxruntime.capi.onnxruntime_pybind11_state import Fail as ONNXRuntimeError
+except ImportError:
+    ONNXRuntimeError = RuntimeError
+
+
+class FakeParaformer:
+    """与 funasr_onnx 相同：ndarray 是一段音频，字符串和列表中的元素都当作文件路径"""
+
+    def __init__(self, model_dir, batch_size=1, quantize=True, intra_op_num_threads=4):
+        self.calls = []
+
+    def __call__(self, wav_content):
+        if isinstance(wav_content, np.ndarray):
+            waveforms = [wav_content]
+        elif isinstance(wav_content, str):
+            waveforms = [np.zeros(16000, dtype=np.float32)]
+        else:
+            waveforms = [open(path, 'rb') for path in wav_content]
+        self.calls.append(len(waveforms))
+        results = []
+        for waveform in waveforms:
+            if len(waveform) < 1600:
+                raise ONNXRuntimeError('input is too short')
+            results.append({'preds': (f'{len(waveform) / 16000:.1f}s', ['x'])})
+        return results
+
+
+class OnnxGenerateTest(unittest.TestCase):
+    def setUp(self):
+        self.saved_module = sys.modules.get('funasr_onnx')
+        sys.modules['funasr_onnx'] = types.SimpleNamespace(Paraformer=FakeParaformer)
+        self.model = model_server.OnnxAsrModel('model-dir', batch_size=4)
+
+    def tearDown(self):
+        if self.saved_module is None:
+            sys.modules.pop('funasr_onnx', None)
+        else:
+            sys.modules['funasr_onnx'] = self.saved_module
+
+    def test_list_of_arrays_is_decoded_per_segment(self):
+        segments = [np.zeros(16000, dtype=np.float32), np.zeros(32000, dtype=np.float64)]
+        results = self.model.generate(input=segments, batch_size=2, fs=16000)
+        self.assertEqual([res['text'] for res in results], ['1.0s', '2.0s'])
+        self.assertEqual(self.model.model.calls, [1, 1])
+
+    def test_failed_segment_keeps_results_aligned(self):
+        segments = [np.zeros(16000, dtype=np.float32), np.zeros(100, dtype=np.float32),
+                    np.zeros(48000, dtype=np.float32)]
+        results = self.model.generate(input=segments, fs=16000)
+        self.assertEqual([res['text'] for res in results], ['1.0s', '', '3.0s'])
+
+    def test_single_array_input(self):
+        results = self.model.generate(input=np.zeros(16000, dtype=np.float32), fs=16000)
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['text'], '1.0s')
+
+    def test_rejects_other_sample_rates(self):
+        with self.assertRaises(ValueError):
+            self.model.generate(input=[np.zeros(8000, dtype=np.float32)], fs=8000)
+
+
+if __name__ == '__main__':
+    unittest.main()